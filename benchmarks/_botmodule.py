@@ -0,0 +1,36 @@
+"""Loads tele-bot-enhancement.py (not importable by name because of the hyphens) for benchmarks."""
+import importlib.util
+import json
+import logging
+import os
+import time
+
+from telegram.request import BaseRequest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_SCRIPT = os.path.join(REPO_DIR, "tele-bot-enhancement.py")
+
+def load_bot_module(quiet: bool = True):
+    os.chdir(REPO_DIR) # Pack and phrasebook files are opened relative to the repo, some lazily after import
+    spec = importlib.util.spec_from_file_location("tele_bot_enhancement", BOT_SCRIPT)
+    module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)
+    if quiet: logging.disable(logging.WARNING)
+    return module
+
+class StubRequest(BaseRequest):
+    """Answers every Bot API call locally with a minimal successful result; counts calls by method."""
+    def __init__(self): self.calls: dict[str, int] = {}; self._next_message_id = 1
+
+    async def initialize(self) -> None: pass
+
+    async def shutdown(self) -> None: pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]; params = request_data.parameters if request_data else {}
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if api_method == "getMe": result = {'id': 1, 'is_bot': True, 'first_name': "StubBot", 'username': "stub_bot"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            self._next_message_id += 1
+            result = {'message_id': self._next_message_id, 'date': int(time.time()), 'chat': {'id': params.get("chat_id", 0), 'type': 'private'}, 'text': params.get("text", "")}
+        else: result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
@@ -0,0 +1,151 @@
+"""Micro-benchmarks for the scheduling and dictionary hot paths, written as JSON.
+
+Fills an in-process JobQueue (stubbed Bot API, nothing leaves the process) with 1k, 100k and 1M
+reminder jobs spread over many chats, plus one benchmark chat with BENCH_CHAT_WORDS words and a B2+
+pack in progress, then times at each size:
+
+    schedule_reminders_for_word      one new word (its single pending reminder job)
+    dictionary_page                  generate_dictionary_text, one page
+    dictionary_export                generate_dictionary_text, all items
+    load_forecast                    forecast_review_load, current and a what-if intensity modifier
+    learning_intensity               count_daily_reminders + get_learning_intensity
+    process_curated_pack             one B2+ pack word activation
+    send_reminder                    keyboard building + sendMessage to the stub
+
+    python benchmarks/bench_hot_paths.py [--sizes 1000,100000,1000000] [--output results.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from telegram.ext import Application, CallbackContext
+
+from _botmodule import REPO_DIR, StubRequest, load_bot_module
+
+BENCH_CHAT_ID = 1
+BENCH_CHAT_WORDS = 50
+FILLER_CHAT_WORDS = 10 # Each filler chat holds this many words' reminders
+MIN_BENCH_SECONDS = 0.2 # Repeat a benchmark until it ran at least this long...
+MAX_REPEATS = 200 # ...or this many times
+
+async def _noop_job(context) -> None: pass
+
+def _add_filler_reminders(bot, job_queue, count: int, first_chat_id: int) -> int:
+    """Adds `count` reminder jobs for synthetic chats; returns the next unused chat id."""
+    chat_id, intervals = first_chat_id, bot.REMINDER_INTERVALS_SECONDS
+    for n in range(count):
+        if n and n % (FILLER_CHAT_WORDS * len(intervals)) == 0: chat_id += 1
+        word_index, interval_index = divmod(n, len(intervals))
+        job_queue.run_once(bot.send_reminder, intervals[interval_index] + random.randint(0, 3600), chat_id=chat_id,
+                           data={'message_text': f"filler word {word_index}", 'item_id': str(word_index), 'learning_start_date': "2024-01-01",
+                                 'is_pack_word': False, 'current_interval_index': interval_index})
+    return chat_id + 1
+
+async def _timed(fn, setup=None) -> list[float]:
+    """Runs the (async) callable repeatedly; `setup` runs untimed before each call."""
+    samples = []; total = 0.0
+    while total < MIN_BENCH_SECONDS and len(samples) < MAX_REPEATS:
+        if setup: await setup()
+        started = time.perf_counter(); result = fn()
+        if asyncio.iscoroutine(result): await result
+        elapsed = time.perf_counter() - started; samples.append(elapsed); total += elapsed
+    return samples
+
+def _summary(name: str, reminders: int, samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {'benchmark': name, 'reminders': reminders, 'repeats': len(ordered), 'min_ms': ordered[0] * 1000,
+            'median_ms': ordered[len(ordered) // 2] * 1000, 'mean_ms': sum(ordered) / len(ordered) * 1000}
+
+async def _run_size(bot, app, reminders: int) -> list[dict]:
+    chat_context = CallbackContext(app, chat_id=BENCH_CHAT_ID, user_id=BENCH_CHAT_ID)
+    job_queue, user_data = app.job_queue, chat_context.user_data
+    default_sort = lambda item: item[0].lower()
+    results = []
+
+    word_counter = iter(range(10**9))
+    async def schedule_word() -> None:
+        await bot.schedule_reminders_for_word(chat_context, BENCH_CHAT_ID, f"bench new word {next(word_counter)}")
+    async def forget_new_words() -> None:
+        for item_id, item in list(bot._get_item_table(chat_context.chat_data)['items'].items()):
+            if item['text'].startswith("bench new word"): bot.remove_item_jobs(BENCH_CHAT_ID, item_id); bot.forget_learning_item(chat_context.chat_data, item_id)
+    results.append(_summary("schedule_reminders_for_word", reminders, await _timed(schedule_word, forget_new_words)))
+    await forget_new_words()
+
+    results.append(_summary("dictionary_page", reminders, await _timed(lambda: bot.generate_dictionary_text(
+        BENCH_CHAT_ID, user_data, job_queue, "Medium", "👍", page_number=2, items_per_page=bot.WORDS_PER_PAGE, sort_key_func=default_sort))))
+    results.append(_summary("dictionary_export", reminders, await _timed(lambda: bot.generate_dictionary_text(
+        BENCH_CHAT_ID, user_data, job_queue, "Medium", "👍", items_per_page=float('inf'), sort_key_func=default_sort))))
+    results.append(_summary("load_forecast", reminders, await _timed(
+        lambda: bot.forecast_review_load(chat_context.chat_data, user_data, (1.0, 2.0)))))
+    results.append(_summary("learning_intensity", reminders, await _timed(
+        lambda: bot.get_learning_intensity(bot.count_daily_reminders(job_queue, BENCH_CHAT_ID)))))
+
+    pack_job = job_queue.run_once(_noop_job, 10**7, chat_id=BENCH_CHAT_ID, user_id=BENCH_CHAT_ID, name="bench_pack")
+    pack_context = CallbackContext.from_job(pack_job, app)
+    async def ready_pack() -> None:
+        pack_data = user_data[bot.USER_PACK_DATA_KEY]
+        pack_data.update(words_scheduled_today=0, last_pack_word_scheduled_time=0.0)
+        for word_status in pack_data['pack_words_status']:
+            if word_status['status'] == 'active': # Undo the previous activation so every run activates a word
+                word_status['status'] = 'pending'
+                item_id = bot.find_learning_item(chat_context.chat_data, BENCH_CHAT_ID, word_status['word'])
+                if item_id: bot.remove_item_jobs(BENCH_CHAT_ID, item_id); bot.forget_learning_item(chat_context.chat_data, item_id) # Else its due counts it as scheduled
+    results.append(_summary("process_curated_pack", reminders, await _timed(lambda: bot.process_curated_pack_for_user(pack_context), ready_pack)))
+    await ready_pack(); pack_job.schedule_removal()
+
+    reminder_job = next(job for job in job_queue.jobs() if job.chat_id == BENCH_CHAT_ID and job.data and 'message_text' in job.data)
+    reminder_context = CallbackContext.from_job(reminder_job, app)
+    results.append(_summary("send_reminder", reminders, await _timed(lambda: bot.send_reminder(reminder_context))))
+    return results
+
+async def run(sizes: list[int]) -> list[dict]:
+    bot = load_bot_module(); random.seed(1)
+    bot.PACK_DEFER_DAILY_REMINDERS = 0 # The benchmark chat's 50 words would otherwise defer every pack activation
+    app = Application.builder().token("123456:BENCH").request(StubRequest()).updater(None).build()
+    results = []
+    async with app:
+        await app.start()
+        chat_context = CallbackContext(app, chat_id=BENCH_CHAT_ID, user_id=BENCH_CHAT_ID)
+        for i in range(BENCH_CHAT_WORDS): await bot.schedule_reminders_for_word(chat_context, BENCH_CHAT_ID, f"bench word {i}")
+        pack_words = bot.load_pack_items(bot.VOCABULARY_PACK_FILE) or [f"pack word {i}" for i in range(100)]
+        chat_context.user_data[bot.USER_PACK_DATA_KEY] = {'pack_words_status': [{'word': w, 'status': 'pending', 'estimated_start_date': None, 'actual_start_date': None} for w in pack_words],
+                                                          'words_scheduled_today': 0, 'last_scheduled_date': "", 'last_pack_word_scheduled_time': 0.0, 'status': 'in_progress'}
+        next_chat_id = BENCH_CHAT_ID + 1
+        for size in sorted(sizes):
+            missing = size - len(app.job_queue.jobs())
+            if missing > 0:
+                started = time.perf_counter(); next_chat_id = _add_filler_reminders(bot, app.job_queue, missing, next_chat_id)
+                print(f"Queue filled to {len(app.job_queue.jobs())} jobs in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+            for result in await _run_size(bot, app, size):
+                results.append(result); print(f"{size:>9} {result['benchmark']:<28} {result['median_ms']:10.3f} ms (median of {result['repeats']})", file=sys.stderr)
+        app.job_queue.scheduler.remove_all_jobs() # Faster shutdown than letting them all be cancelled
+        await app.stop()
+    return results
+
+def _git_commit() -> str | None:
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma-separated total reminder counts")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = {'suite': "hot_paths", 'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+              'git_commit': _git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'results': asyncio.run(run(sizes))}
+    report['max_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.output:
+        with open(args.output, "w") as out: json.dump(report, out, indent=2)
+    else: print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Micro-benchmark: per-message dispatch overhead of reply-keyboard routing.
+
+Compares the previous handler setup (one filters.Regex handler per keyboard button plus a
+catch-all with four negated regexes) with the single MessageHandler + dict lookup router.
+Only handler selection is timed; no handler callback runs.
+
+    python benchmarks/bench_message_dispatch.py [--messages 200000]
+"""
+import argparse
+import datetime
+import re
+import time
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import MessageHandler, filters
+
+from _botmodule import load_bot_module
+
+async def _noop(update, context): pass
+
+def legacy_handlers(bot) -> list:
+    button_texts = [bot.LEARNING_DICT_BUTTON_TEXT, bot.SHOW_VOCABULARY_PACKS_BUTTON_TEXT, bot.RANDOM_WORD_BUTTON_TEXT, bot.RUN_QUIZ_BUTTON_TEXT]
+    handlers = [MessageHandler(filters.TEXT & filters.Regex(f'^{re.escape(text)}$'), _noop) for text in button_texts]
+    catch_all = filters.TEXT & ~filters.COMMAND
+    for text in button_texts: catch_all = catch_all & ~filters.Regex(f'^{re.escape(text)}$')
+    return handlers + [MessageHandler(catch_all, _noop)]
+
+def dispatch_legacy(handlers: list, update: Update):
+    for handler in handlers:
+        if handler.check_update(update): return handler
+    return None
+
+def dispatch_router(handler: MessageHandler, routes: dict, fallback, update: Update):
+    if handler.check_update(update): return routes.get(update.effective_message.text, fallback)
+    return None
+
+def make_updates(bot, count: int) -> list:
+    user = User(1, "u", False); chat = Chat(1, "private"); now = datetime.datetime.now(datetime.timezone.utc)
+    texts = [bot.LEARNING_DICT_BUTTON_TEXT, bot.RANDOM_WORD_BUTTON_TEXT] + [f"word{i}" for i in range(8)] # 80% plain words
+    return [Update(i, message=Message(i, now, chat, from_user=user, text=texts[i % len(texts)])) for i in range(count)]
+
+def bench(label: str, fn, updates: list) -> None:
+    started = time.perf_counter()
+    for update in updates: fn(update)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<22} {elapsed / len(updates) * 1e6:8.2f} µs/message  ({len(updates)} messages, {elapsed:.2f}s)")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200_000)
+    args = parser.parse_args()
+    bot = load_bot_module(); updates = make_updates(bot, args.messages)
+    legacy = legacy_handlers(bot); router = MessageHandler(filters.TEXT & ~filters.COMMAND, bot.route_text_message)
+    bench("stacked regex filters", lambda u: dispatch_legacy(legacy, u), updates)
+    bench("single-lookup router", lambda u: dispatch_router(router, bot.REPLY_KEYBOARD_ROUTES, bot.handle_user_message_for_scheduling, u), updates)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Fake Telegram Bot API server for offline load tests.
+
+Answers getMe, getUpdates (long polling), setWebhook/deleteWebhook, sendMessage, editMessageText,
+answerCallbackQuery and anything else with a plausible result, records every call, and can add
+latency and answer a fraction of calls with 429 (which python-telegram-bot raises as RetryAfter).
+Point the bot at it with TELEGRAM_API_BASE_URL=http://127.0.0.1:<port>/bot.
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency-ms 30 --retry-after-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.parse
+
+GET_UPDATES_MAX_BATCH = 100
+
+class FakeBotApi:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_seconds: float = 0.0,
+                 retry_after_rate: float = 0.0, retry_after_methods: tuple = ("sendMessage", "editMessageText")):
+        self.host, self.port, self.latency_seconds = host, port, latency_seconds
+        self.retry_after_rate, self.retry_after_methods = retry_after_rate, retry_after_methods
+        self.calls: list[tuple[float, str, dict]] = [] # (monotonic time, method, params)
+        self.listeners: list = [] # Called as listener(timestamp, method, params, injected_429) for every call
+        self.pending_updates: list[dict] = []; self._updates_arrived = asyncio.Event()
+        self.stats = {'calls': 0, 'injected_429': 0}
+        self._server = None; self._next_message_id = 1; self._closing = False
+        self._connections: dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    @property
+    def base_url(self) -> str: return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        if not self.port: self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """Stops listening, ends pending long polls and closes open connections."""
+        if self._server: self._server.close()
+        self._closing = True; self._updates_arrived.set()
+        for writer in self._connections.values(): writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    def push_update(self, update: dict) -> None:
+        """Queues an update for the bot's next getUpdates call (polling mode)."""
+        self.pending_updates.append(update); self._updates_arrived.set()
+
+    async def _get_updates(self, params: dict) -> list:
+        offset, timeout = int(params.get("offset") or 0), float(params.get("timeout") or 0)
+        self.pending_updates = [u for u in self.pending_updates if u['update_id'] >= offset] # Confirmed by the offset
+        if not self.pending_updates and timeout and not self._closing:
+            self._updates_arrived.clear()
+            try: await asyncio.wait_for(self._updates_arrived.wait(), timeout)
+            except asyncio.TimeoutError: pass
+        return self.pending_updates[:GET_UPDATES_MAX_BATCH]
+
+    def _message(self, params: dict) -> dict:
+        self._next_message_id += 1
+        chat_id = params.get("chat_id", 0)
+        return {'message_id': int(params.get("message_id") or self._next_message_id), 'date': int(time.time()),
+                'chat': {'id': int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, 'type': 'private'}, 'text': params.get("text", "")}
+
+    async def _call(self, method: str, params: dict) -> dict:
+        injected = method in self.retry_after_methods and random.random() < self.retry_after_rate
+        now = time.monotonic(); self.calls.append((now, method, params)); self.stats['calls'] += 1
+        for listener in self.listeners: listener(now, method, params, injected)
+        if self.latency_seconds and method != "getUpdates": await asyncio.sleep(self.latency_seconds)
+        if injected:
+            self.stats['injected_429'] += 1
+            return {'ok': False, 'error_code': 429, 'description': "Too Many Requests: retry after 1", 'parameters': {'retry_after': 1}}
+        if method == "getMe": result = {'id': 1, 'is_bot': True, 'first_name': "FakeBot", 'username': "fake_bot"}
+        elif method == "getUpdates": result = await self._get_updates(params)
+        elif method in ("sendMessage", "editMessageText"): result = self._message(params)
+        else: result = True
+        return {'ok': True, 'result': result}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task(); self._connections[task] = writer
+        try:
+            while request_line := await reader.readline():
+                _, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":"); headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+                if "json" in headers.get("content-type", ""): params = json.loads(body or b"{}")
+                else: params = dict(urllib.parse.parse_qsl(body.decode("utf-8")))
+                result = await self._call(path.rsplit("/", 1)[-1], params); response = json.dumps(result).encode()
+                status = "200 OK" if result['ok'] else "429 Too Many Requests"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(response)}\r\n\r\n".encode("latin-1") + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError): pass
+        finally: writer.close(); self._connections.pop(task, None)
+
+async def _serve(args) -> None:
+    api = FakeBotApi(args.host, args.port, args.latency_ms / 1000, args.retry_after_rate)
+    api.listeners.append(lambda ts, method, params, injected: print(f"{method}{' (429)' if injected else ''} {params}"))
+    await api.start(); print(f"Fake Bot API on {api.base_url}")
+    try: await asyncio.Event().wait()
+    finally: await api.stop()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--retry-after-rate", type=float, default=0.0)
+    try: asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt: pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Offline load test: simulated users against tele-bot-enhancement.py and a fake Bot API.
+
+Runs the bot as a subprocess pointed at an in-process FakeBotApi (polling or webhook mode) and lets
+N simulated users add words, start packs, open and page the dictionary and tap Clue/Explain. Each
+user waits for the bot's answer (its next sendMessage/editMessageText to that chat) before acting
+again, so latency is update-in to answer-out. Reports p50/p95/p99 per action, throughput, timeouts,
+injected 429s and the bot process RSS (the front dispatcher's only, with --shards).
+
+    python benchmarks/load_test.py --users 200 --actions 20 --mode polling --latency-ms 20 --json out.json
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import random
+import secrets
+import signal
+import socket
+import sys
+import time
+
+from fake_bot_api import FakeBotApi
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_SCRIPT = os.path.join(REPO_DIR, "tele-bot-enhancement.py")
+FIRST_CHAT_ID = 10_000_000
+ANSWER_METHODS = ("sendMessage", "editMessageText") # answerCallbackQuery comes before the handler's work
+ACTION_WEIGHTS = {"add_word": 6, "open_dictionary": 2, "next_page": 2, "clue": 2, "explain": 1, "start_pack": 1}
+PACK_CALLBACKS = ("start_b2_pack", "start_lux_pack")
+
+def _free_port() -> int:
+    with socket.socket() as sock: sock.bind(("127.0.0.1", 0)); return sock.getsockname()[1]
+
+def _base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"; out = ""
+    while True:
+        number, rem = divmod(number, 36); out = digits[rem] + out
+        if not number: return out
+
+def _item_id(chat_id: int, word: str) -> str:
+    """The bot's item_id_for(); the words added here are already in canonical (item_key) form."""
+    return _base36(int.from_bytes(hashlib.blake2b(f"{chat_id}\x00{word}".encode("utf-8"), digest_size=8).digest(), "big"))
+
+def _word(chat_id: int, number: int) -> str: return f"loadword{chat_id}x{number}"
+
+def _rss_kib(pid: int) -> dict:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            fields = dict(line.split(":", 1) for line in status if line.startswith(("VmRSS", "VmHWM")))
+        return {key: int(value.split()[0]) for key, value in fields.items()}
+    except OSError: return {} # Not Linux, or the process is gone
+
+def _quantile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))] if sorted_values else 0.0
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args; self.update_ids = itertools.count(1)
+        self.api = FakeBotApi(latency_seconds=args.latency_ms / 1000, retry_after_rate=args.retry_after_rate)
+        self.api.listeners.append(self._on_api_call)
+        self.waiting: dict[int, asyncio.Future] = {}; self.polling_started = asyncio.Event()
+        self.latencies: dict[str, list[float]] = {action: [] for action in ACTION_WEIGHTS}
+        self.timeouts = {action: 0 for action in ACTION_WEIGHTS}; self.webhook_port = _free_port(); self.secret = secrets.token_hex(16)
+
+    def _on_api_call(self, timestamp: float, method: str, params: dict, injected: bool) -> None:
+        if method == "getUpdates": self.polling_started.set()
+        if method in ANSWER_METHODS and str(params.get("chat_id", "")).isdigit():
+            future = self.waiting.pop(int(params["chat_id"]), None)
+            if future and not future.done(): future.set_result(timestamp)
+
+    def _message_update(self, chat_id: int, text: str) -> dict:
+        update_id = next(self.update_ids)
+        return {'update_id': update_id, 'message': {'message_id': update_id, 'date': int(time.time()), 'text': text,
+                'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': chat_id, 'is_bot': False, 'first_name': f"user{chat_id}"}}}
+
+    def _callback_update(self, chat_id: int, data: str) -> dict:
+        update_id = next(self.update_ids)
+        return {'update_id': update_id, 'callback_query': {'id': str(update_id), 'chat_instance': str(chat_id), 'data': data,
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': f"user{chat_id}"},
+                'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}, 'text': "..."}}}
+
+    async def _deliver(self, update: dict) -> None:
+        if self.args.mode == "polling": self.api.push_update(update); return
+        body = json.dumps(update).encode()
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.webhook_port)
+        writer.write((f"POST /telegram HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                      f"X-Telegram-Bot-Api-Secret-Token: {self.secret}\r\nConnection: close\r\n\r\n").encode("latin-1") + body)
+        await writer.drain(); await reader.read(); writer.close()
+
+    def _next_update(self, chat_id: int, action: str, words_added: int) -> dict:
+        if action == "add_word": return self._message_update(chat_id, _word(chat_id, words_added))
+        if action == "open_dictionary": return self._message_update(chat_id, "📚 Learning Dictionary")
+        if action == "next_page": return self._callback_update(chat_id, "dict_pg_n:2")
+        if action == "start_pack": return self._callback_update(chat_id, random.choice(PACK_CALLBACKS))
+        item_id = _item_id(chat_id, _word(chat_id, random.randrange(max(1, words_added))))
+        return self._callback_update(chat_id, f"{'clue_req' if action == 'clue' else 'ai_explain'}:{item_id}")
+
+    async def _run_user(self, chat_id: int) -> None:
+        actions, weights = list(ACTION_WEIGHTS), list(ACTION_WEIGHTS.values()); words_added = 0
+        for step in range(self.args.actions):
+            action = "add_word" if step == 0 else random.choices(actions, weights)[0]
+            future = asyncio.get_running_loop().create_future(); self.waiting[chat_id] = future
+            sent_at = time.monotonic(); await self._deliver(self._next_update(chat_id, action, words_added))
+            try: self.latencies[action].append(await asyncio.wait_for(future, self.args.timeout) - sent_at)
+            except asyncio.TimeoutError: self.timeouts[action] += 1; self.waiting.pop(chat_id, None)
+            if action == "add_word": words_added += 1
+
+    async def _wait_until_ready(self, bot_process) -> None:
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if bot_process.returncode is not None: sys.exit(f"Bot exited early with code {bot_process.returncode}; see --bot-log.")
+            if self.args.mode == "polling":
+                if self.polling_started.is_set(): return
+            else:
+                try: _, writer = await asyncio.open_connection("127.0.0.1", self.webhook_port); writer.close(); return
+                except OSError: pass
+            await asyncio.sleep(0.2)
+        sys.exit("Bot did not become ready within 60s.")
+
+    async def run(self) -> dict:
+        await self.api.start()
+        env = dict(os.environ, TELEGRAM_BOT_TOKEN="123456:LOADTEST", TELEGRAM_API_BASE_URL=self.api.base_url, BOT_RUN_MODE=self.args.mode,
+                   WEBHOOK_LISTEN_HOST="127.0.0.1", WEBHOOK_PORT=str(self.webhook_port), WEBHOOK_PATH="/telegram",
+                   WEBHOOK_SECRET_TOKEN=self.secret, METRICS_PORT="0", BOT_SHARDS=str(self.args.shards))
+        env.pop("WEBHOOK_URL", None)
+        with open(self.args.bot_log, "w") as bot_log:
+            bot_process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, cwd=REPO_DIR, env=env, stdout=bot_log, stderr=bot_log)
+            try:
+                await self._wait_until_ready(bot_process)
+                started = time.monotonic()
+                await asyncio.gather(*(self._run_user(FIRST_CHAT_ID + i) for i in range(self.args.users)))
+                elapsed = time.monotonic() - started; rss = _rss_kib(bot_process.pid)
+            finally:
+                if bot_process.returncode is None: bot_process.send_signal(signal.SIGINT)
+                await bot_process.wait(); await self.api.stop()
+        return self._report(elapsed, rss)
+
+    def _report(self, elapsed: float, rss: dict) -> dict:
+        def summary(values: list, timeouts: int) -> dict:
+            ordered = sorted(values)
+            return {'count': len(ordered), 'timeouts': timeouts, 'p50_ms': _quantile(ordered, 0.50) * 1000, 'p95_ms': _quantile(ordered, 0.95) * 1000,
+                    'p99_ms': _quantile(ordered, 0.99) * 1000, 'max_ms': (ordered[-1] * 1000 if ordered else 0.0)}
+        answered = [latency for values in self.latencies.values() for latency in values]
+        api_calls = {}
+        for _, method, _ in self.api.calls: api_calls[method] = api_calls.get(method, 0) + 1
+        return {'mode': self.args.mode, 'users': self.args.users, 'actions_per_user': self.args.actions, 'shards': self.args.shards,
+                'api_latency_ms': self.args.latency_ms, 'retry_after_rate': self.args.retry_after_rate,
+                'elapsed_s': elapsed, 'throughput_per_s': len(answered) / elapsed if elapsed else 0.0, 'timeouts': sum(self.timeouts.values()),
+                'injected_429': self.api.stats['injected_429'], 'overall': summary(answered, sum(self.timeouts.values())),
+                'per_action': {action: summary(values, self.timeouts[action]) for action, values in self.latencies.items()},
+                'api_calls': api_calls, 'bot_rss_kib': rss.get("VmRSS"), 'bot_peak_rss_kib': rss.get("VmHWM")}
+
+def print_report(report: dict) -> None:
+    print(f"{report['users']} users x {report['actions_per_user']} actions ({report['mode']}, {report['shards']} shard(s), "
+          f"API latency {report['api_latency_ms']:.0f}ms, 429 rate {report['retry_after_rate']})")
+    print(f"{'action':<16}{'count':>7}{'timeouts':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for action, stats in list(report['per_action'].items()) + [("overall", report['overall'])]:
+        print(f"{action:<16}{stats['count']:>7}{stats['timeouts']:>10}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print(f"throughput {report['throughput_per_s']:.1f} answers/s over {report['elapsed_s']:.1f}s, timeouts {report['timeouts']}, injected 429s {report['injected_429']}")
+    print(f"bot RSS {report['bot_rss_kib']} KiB (peak {report['bot_peak_rss_kib']} KiB); API calls {report['api_calls']}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--actions", type=int, default=10, help="actions per user")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every Bot API call")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="fraction of sendMessage/editMessageText answered with 429")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for an answer")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bot-log", default=os.devnull)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(); random.seed(args.seed)
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as out: json.dump(report, out, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Stress test for lost, duplicated or reordered updates under concurrent processing.
+
+Runs the bot against the fake Bot API like load_test.py. One chat sends a burst of --burst words in one
+go, then --users other chats each send --actions words without waiting for answers. Every word gets its
+own "Added"/"already in your dictionary" reply, so the test checks that each chat got exactly one reply
+per word, in the order sent. It also checks that the other chats weren't held up behind the burst: each
+of them must be fully answered before the burst chat has half of its answers. The burst chat's updates
+run one at a time, so with --latency-ms its second half alone takes burst/2 x latency. If the burst's
+waiting updates held the BOT_CONCURRENT_UPDATES slots (default 64), the other chats would only start
+near its end. Exits with status 1 if any check fails.
+
+    python benchmarks/stress_ordering.py --users 50 --actions 10 --burst 200 --latency-ms 20 --mode webhook
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+
+from load_test import FIRST_CHAT_ID, LoadTest
+
+BURST_CHAT_ID = FIRST_CHAT_ID - 1
+ANSWER_WORD = re.compile(r"'stress(\d+)x(\d+)'")
+
+class OrderingStressTest(LoadTest):
+    def __init__(self, args):
+        super().__init__(args)
+        self.answers: dict[int, list[int]] = {}; self.finished: dict[int, float] = {}; self.expected: dict[int, int] = {}
+        self.burst_answered_at: list[float] = []
+        self.started = None; self.burst_delivered = asyncio.Event(); self.burst = None
+
+    def _on_api_call(self, timestamp: float, method: str, params: dict, injected: bool) -> None:
+        if method == "getUpdates": self.polling_started.set()
+        if method != "sendMessage" or injected: return # A 429 is retried by the bot and answered again
+        match = ANSWER_WORD.search(str(params.get("text", "")))
+        if not match: return
+        chat_id, number = int(match.group(1)), int(match.group(2)); answers = self.answers.setdefault(chat_id, [])
+        answers.append(number)
+        if chat_id == BURST_CHAT_ID: self.burst_answered_at.append(timestamp)
+        if len(answers) == self.expected.get(chat_id):
+            self.finished[chat_id] = timestamp
+            future = self.waiting.pop(chat_id, None)
+            if future and not future.done(): future.set_result(timestamp)
+
+    async def _send_all(self, chat_id: int, count: int, delivered: asyncio.Event = None) -> None:
+        self.expected[chat_id] = count
+        future = asyncio.get_running_loop().create_future(); self.waiting[chat_id] = future
+        for number in range(count): await self._deliver(self._message_update(chat_id, f"stress{chat_id}x{number}"))
+        if delivered: delivered.set()
+        try: await asyncio.wait_for(future, self.args.timeout)
+        except asyncio.TimeoutError: self.waiting.pop(chat_id, None)
+
+    async def _run_user(self, chat_id: int) -> None:
+        if self.started is None: self.started = time.monotonic() # The fake API's timestamps are time.monotonic() too
+        if chat_id == FIRST_CHAT_ID: self.burst = asyncio.create_task(self._send_all(BURST_CHAT_ID, self.args.burst, self.burst_delivered))
+        await self.burst_delivered.wait() # The whole burst is queued before any other chat's update
+        await self._send_all(chat_id, self.args.actions)
+        if chat_id == FIRST_CHAT_ID: await self.burst
+
+    def _report(self, elapsed: float, rss: dict) -> dict:
+        started = self.started or 0.0; chats = {}
+        for chat_id, count in self.expected.items():
+            answers = self.answers.get(chat_id, [])
+            chats[chat_id] = {'sent': count, 'answered': len(answers), 'lost': len(set(range(count)) - set(answers)),
+                              'duplicated': len(answers) - len(set(answers)), 'out_of_order': sum(1 for a, b in zip(answers, answers[1:]) if b < a),
+                              'finished': self.finished.get(chat_id)}
+        burst_done = chats[BURST_CHAT_ID]['finished']; half = self.args.burst // 2
+        burst_half_done = self.burst_answered_at[half - 1] if half and len(self.burst_answered_at) >= half else None
+        others = [chat for chat_id, chat in chats.items() if chat_id != BURST_CHAT_ID]
+        blocked = [chat for chat in others if chat['finished'] is None or (burst_half_done is not None and chat['finished'] > burst_half_done)]
+        failures = {'lost': sum(c['lost'] for c in chats.values()), 'duplicated': sum(c['duplicated'] for c in chats.values()),
+                    'out_of_order': sum(c['out_of_order'] for c in chats.values()), 'blocked_behind_burst': len(blocked)}
+        others_done = sorted(chat['finished'] - started for chat in others if chat['finished'] is not None)
+        return {'mode': self.args.mode, 'shards': self.args.shards, 'users': self.args.users, 'actions_per_user': self.args.actions, 'burst': self.args.burst,
+                'api_latency_ms': self.args.latency_ms, 'retry_after_rate': self.args.retry_after_rate, 'elapsed_s': elapsed,
+                'burst_done_s': (burst_done - started) if burst_done is not None else None,
+                'burst_half_done_s': (burst_half_done - started) if burst_half_done is not None else None, 'others_last_done_s': others_done[-1] if others_done else None,
+                'failures': failures, 'passed': not any(failures.values()), 'bot_rss_kib': rss.get("VmRSS")}
+
+def print_report(report: dict) -> None:
+    print(f"burst of {report['burst']} + {report['users']} chats x {report['actions_per_user']} ({report['mode']}, {report['shards']} shard(s), "
+          f"API latency {report['api_latency_ms']:.0f}ms, 429 rate {report['retry_after_rate']})")
+    burst_done, others_done = report['burst_done_s'], report['others_last_done_s']
+    half_done = report['burst_half_done_s']
+    print(f"burst chat half answered after {half_done if half_done is None else f'{half_done:.2f}s'}, fully after {burst_done if burst_done is None else f'{burst_done:.2f}s'}, "
+          f"last other chat after {others_done if others_done is None else f'{others_done:.2f}s'}")
+    print(f"failures {report['failures']} -> {'PASS' if report['passed'] else 'FAIL'}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50, help="chats besides the burst chat")
+    parser.add_argument("--actions", type=int, default=10, help="words sent by each of those chats")
+    parser.add_argument("--burst", type=int, default=200, help="words sent at once by the burst chat")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="added to every Bot API call")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="fraction of sendMessage/editMessageText answered with 429")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for a chat's answers")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bot-log", default=os.devnull)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(); random.seed(args.seed)
+    report = asyncio.run(OrderingStressTest(args).run())
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as out: json.dump(report, out, indent=2)
+    sys.exit(0 if report['passed'] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Regression check for quiet-hours batches fired by a real JobQueue.
+
+Gives --chats chats quiet hours around the current hour, adds --items words to each (their first
+reminder is then held until the window ends), moves every job of those chats to "now" and lets the
+scheduler fire them in one tick. Each chat must get exactly one batch message listing all its words,
+every word must get exactly one unanswered review, no reminder may fail, and no batch or send slot
+may be left behind for the release that was sent. Exits with status 1 if any check fails.
+
+    python benchmarks/stress_quiet_batch.py --chats 5 --items 3
+"""
+import argparse
+import asyncio
+import datetime
+import sys
+import time
+
+from telegram.ext import Application, CallbackContext
+
+from _botmodule import StubRequest, load_bot_module
+
+FIRST_CHAT_ID = 100
+
+class RecordingRequest(StubRequest):
+    """StubRequest that also keeps the text of every sendMessage, by chat."""
+    def __init__(self): super().__init__(); self.texts: dict[int, list[str]] = {}
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith("/sendMessage"):
+            params = request_data.parameters; self.texts.setdefault(int(params["chat_id"]), []).append(params.get("text", ""))
+        return await super().do_request(url, method, request_data, **kwargs)
+
+async def run(args) -> dict:
+    bot = load_bot_module(); request = RecordingRequest()
+    app = Application.builder().token("123456:QUIET").request(request).updater(None).build()
+    chat_ids = list(range(FIRST_CHAT_ID, FIRST_CHAT_ID + args.chats)); failed_before = sum(bot.METRIC_REMINDERS_FAILED.values.values())
+    async with app:
+        await app.start()
+        hour = datetime.datetime.now(bot.DEFAULT_TZINFO).hour; items = {}
+        for chat_id in chat_ids:
+            context = CallbackContext(app, chat_id=chat_id, user_id=chat_id)
+            context.chat_data[bot.LOCAL_TIME_KEY] = {'tz': None, 'quiet': [hour, (hour + 2) % 24]}
+            for n in range(args.items): await bot.schedule_reminders_for_word(context, chat_id, f"quiet{chat_id}x{n}")
+            items[chat_id] = bot._get_item_table(context.chat_data)['items']
+        releases = {chat_id: {int(item['due']) for item in items[chat_id].values()} for chat_id in chat_ids}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for job in app.job_queue.jobs():
+            if job.chat_id in items: job.job.modify(next_run_time=now) # All due in the same scheduler tick
+        app.job_queue.scheduler.wakeup(); deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline and any(len(request.texts.get(chat_id, [])) < 1 for chat_id in chat_ids): await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5) # Room for any extra (wrong) messages to arrive
+        chats = {}
+        for chat_id in chat_ids:
+            texts = request.texts.get(chat_id, []); words = [text for text in texts if text.startswith(bot.QUIET_BATCH_PREFIX)]
+            chats[chat_id] = {'messages': len(texts), 'batch_lines': sum(text.count("\n• ") for text in words),
+                              'unanswered_reviews': [len(item['history']) for item in items[chat_id].values()],
+                              'leftover_batches': sorted(set(bot._QUIET_BATCHES.get(chat_id, {})) & releases[chat_id])}
+        failed = sum(bot.METRIC_REMINDERS_FAILED.values.values()) - failed_before
+        app.job_queue.scheduler.remove_all_jobs()
+        await app.stop()
+    failures = {'wrong_message_count': sum(1 for chat in chats.values() if chat['messages'] != 1),
+                'missing_from_batch': sum(args.items - chat['batch_lines'] for chat in chats.values() if chat['batch_lines'] < args.items),
+                'wrong_review_count': sum(1 for chat in chats.values() for reviews in chat['unanswered_reviews'] if reviews != 1),
+                'failed_reminders': int(failed), 'leftover_batches': sum(len(chat['leftover_batches']) for chat in chats.values())}
+    return {'chats': args.chats, 'items_per_chat': args.items, 'failures': failures, 'passed': not any(failures.values())}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--items", type=int, default=3, help="words held in each chat's batch")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for the batch messages")
+    report = asyncio.run(run(parser.parse_args()))
+    print(f"{report['chats']} chats x {report['items_per_chat']} held words: failures {report['failures']} -> {'PASS' if report['passed'] else 'FAIL'}")
+    sys.exit(0 if report['passed'] else 1)
+
+if __name__ == "__main__":
+    main()
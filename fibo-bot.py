@@ -203,7 +203,7 @@ async def schedule_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE)
         jobs_scheduled += 1
         if jobs_scheduled == 1:
              first_interval_minutes = int(interval / 60)
-        logger.info(f"Scheduled job '{job_name}' for chat {chat_id} to run in {interval} seconds.")
+    logger.info(f"Scheduled {jobs_scheduled} reminder jobs for message {message_id} in chat {chat_id}.")
 
     if jobs_scheduled > 0:
         await update.message.reply_text(
@@ -1,50 +1,190 @@
 import os
 import logging
+import logging.handlers
 import datetime
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, User, Chat, Message
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    MessageHandler,
-    filters,
-    ContextTypes,
-    JobQueue,
-    CallbackQueryHandler
-)
-import re
-import html
-import math
-import random # For random word feature
+import time
+import tracemalloc
+import contextlib
+
+# --- Startup Profiling ---
+# BOT_STARTUP_PROFILE=1 records wall time and traced memory of each import/initialization step
+# (including optional backends loaded later on first use) and logs a report when the bot starts.
+STARTUP_PROFILE_ENABLED = os.environ.get("BOT_STARTUP_PROFILE") == "1"
+if STARTUP_PROFILE_ENABLED: tracemalloc.start()
+_PROCESS_T0 = time.perf_counter()
+STARTUP_PROFILE: list[tuple[str, float, int]] = [] # (component, seconds, traced bytes)
+
+@contextlib.contextmanager
+def profile_startup_component(name: str):
+    traced_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0; started = time.perf_counter()
+    try: yield
+    finally:
+        traced_delta = tracemalloc.get_traced_memory()[0] - traced_before if tracemalloc.is_tracing() else 0
+        STARTUP_PROFILE.append((name, time.perf_counter() - started, traced_delta))
+        if STARTUP_PROFILE_ENABLED and logging.getLogger(__name__).hasHandlers():
+            logging.getLogger(__name__).info(f"Startup profile: {name} took {(time.perf_counter() - started) * 1000:.1f}ms, {traced_delta / 1024:.0f} KiB")
+
+with profile_startup_component("import stdlib"):
+    import asyncio
+    import atexit
+    import concurrent.futures
+    import hashlib
+    import hmac
+    import json
+    import signal
+    import sys
+    import threading
+    import traceback
+    import multiprocessing
+    import importlib
+    import importlib.util
+    import re
+    import html
+    import math
+    import pickle
+    import struct
+    import zlib
+    import random # For random word feature
+    import queue
+    import mmap
+    import bisect
+    import unicodedata
+    import zoneinfo
+    from array import array
+
+with profile_startup_component("import telegram"):
+    from telegram import Bot, Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, User, Chat, Message
+    from telegram.error import RetryAfter, TelegramError
+    from telegram.ext import (
+        Application,
+        CommandHandler,
+        MessageHandler,
+        filters,
+        ContextTypes,
+        JobQueue,
+        CallbackQueryHandler,
+        TypeHandler,
+        BaseUpdateProcessor,
+        BasePersistence,
+        PersistenceInput
+    )
 
 # --- Library Import Attempts & Flags ---
+# Optional backends are only located here (cheap); they are imported on first use. A flag turns
+# False if that import later fails, so it always reflects whether the feature can work.
 _initial_logger = logging.getLogger(__name__ + "_initial_check")
 if not _initial_logger.hasHandlers():
     _handler = logging.StreamHandler(); _formatter = logging.Formatter('%(asctime)s - Initial %(levelname)s - %(message)s')
     _handler.setFormatter(_formatter); _initial_logger.addHandler(_handler); _initial_logger.setLevel(logging.INFO)
 
-try:
-    import eng_to_ipa
-    ENG_TO_IPA_AVAILABLE = True
-    _initial_logger.info("eng_to_ipa library found.")
-except ImportError: ENG_TO_IPA_AVAILABLE = False; _initial_logger.warning("eng_to_ipa not found. Basic clues. `pip install eng_to_ipa`")
-
-try:
-    from translate import Translator
-    TRANSLATOR_AVAILABLE = True
-    _initial_logger.info("'translate' library found.")
-except ImportError: TRANSLATOR_AVAILABLE = False; _initial_logger.warning("'translate' not found. Translations disabled. `pip install translate`")
-
-try:
-    from openai import AsyncOpenAI
+with profile_startup_component("locate optional libraries"):
+    ENG_TO_IPA_AVAILABLE = importlib.util.find_spec("eng_to_ipa") is not None
+    TRANSLATOR_AVAILABLE = importlib.util.find_spec("translate") is not None
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-    if OPENAI_API_KEY: openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY); OPENAI_AVAILABLE = True; _initial_logger.info("OpenAI lib and key loaded.")
-    else: OPENAI_AVAILABLE = False; _initial_logger.warning("OPENAI_API_KEY env var not set. AI disabled.")
-except ImportError: OPENAI_AVAILABLE = False; _initial_logger.warning("OpenAI lib not found. AI disabled. `pip install openai`")
+    OPENAI_AVAILABLE = importlib.util.find_spec("openai") is not None and bool(OPENAI_API_KEY)
+    NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+if ENG_TO_IPA_AVAILABLE: _initial_logger.info("eng_to_ipa library found.")
+else: _initial_logger.warning("eng_to_ipa not found. Basic clues. `pip install eng_to_ipa`")
+if TRANSLATOR_AVAILABLE: _initial_logger.info("'translate' library found.")
+else: _initial_logger.warning("'translate' not found. Translations disabled. `pip install translate`")
+if OPENAI_AVAILABLE: _initial_logger.info("OpenAI lib and key found.")
+elif OPENAI_API_KEY: _initial_logger.warning("OpenAI lib not found. AI disabled. `pip install openai`")
+else: _initial_logger.warning("OPENAI_API_KEY env var not set. AI disabled.")
+if NUMPY_AVAILABLE: _initial_logger.info("numpy found. Batch SRS recomputation is vectorized.")
+else: _initial_logger.info("numpy not found. Batch SRS recomputation runs item by item. `pip install numpy`")
+
+_LAZY_MODULES: dict[str, object] = {}
+
+def _lazy_import(module_name: str, flag_name: str):
+    """Imports an optional module on first use; on failure clears its availability flag and returns None."""
+    if module_name not in _LAZY_MODULES:
+        try:
+            with profile_startup_component(f"lazy import {module_name}"): _LAZY_MODULES[module_name] = importlib.import_module(module_name)
+        except ImportError as e:
+            _LAZY_MODULES[module_name] = None; globals()[flag_name] = False
+            logging.getLogger(__name__).error(f"{module_name} failed to import, disabling it: {e}")
+    return _LAZY_MODULES[module_name]
+
+_openai_client = None
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None and OPENAI_AVAILABLE:
+        openai_module = _lazy_import("openai", "OPENAI_AVAILABLE")
+        if openai_module:
+            with profile_startup_component("openai client"): _openai_client = openai_module.AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
 
 # --- Configuration ---
-BOT_TOKEN = "Telegram bot token only here" # YOUR TOKEN
-
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO, force=True)
+BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "Telegram bot token only here") # YOUR TOKEN
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL") # e.g. "http://127.0.0.1:8081/bot" for a local fake Bot API
+
+# --- Run Mode ---
+BOT_RUN_MODE = os.environ.get("BOT_RUN_MODE", "polling") # "polling" or "webhook"
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL") # Public URL passed to setWebhook; unset = register it yourself
+WEBHOOK_LISTEN_HOST = os.environ.get("WEBHOOK_LISTEN_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN") # Checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_QUEUE_SIZE = int(os.environ.get("WEBHOOK_MAX_QUEUE_SIZE", "1000")) # Accepted-but-unfinished updates, queued or being processed; beyond this we answer 503
+BOT_CONCURRENT_UPDATES = int(os.environ.get("BOT_CONCURRENT_UPDATES", "64")) # Updates handled at once across chats; one chat is always in order
+WEBHOOK_CONCURRENCY = int(os.environ.get("WEBHOOK_CONCURRENCY", str(BOT_CONCURRENT_UPDATES))) # Workers parsing queued updates and handing them to the bot (or shards)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40")) # Simultaneous HTTP connections (also sent to setWebhook)
+WEBHOOK_MAX_BODY_BYTES = 1_000_000
+BOT_SHARDS = int(os.environ.get("BOT_SHARDS", "1")) # >1 = front dispatcher + this many worker processes, chats split by chat_id
+SHARD_POLL_TIMEOUT_SECONDS = 30
+
+# --- Logging ---
+# Records are handed to a queue and written by a QueueListener thread, so handlers never block on
+# log I/O. High-volume events pass extra=log_fields(category, chat_id, item_id); those are sampled
+# (LOG_SAMPLE_RATES, e.g. "schedule=0.1,dictionary=0.5") and rate limited per category before they
+# are queued. Uncategorized records and anything at WARNING or above always pass. Categorized
+# records use %-style arguments, so the message of a dropped record is never formatted.
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text") # "text" or "json"
+LOG_SAMPLE_RATES = {category.strip(): float(rate) for category, _, rate in (entry.partition("=") for entry in os.environ.get("LOG_SAMPLE_RATES", "pack_scheduler=0.1").split(",") if entry)}
+LOG_CATEGORY_RATE_LIMIT_PER_MINUTE = int(os.environ.get("LOG_CATEGORY_RATE_LIMIT_PER_MINUTE", "600")) # 0 = unlimited
+LOG_STRUCTURED_FIELDS = ("category", "chat_id", "item")
+
+def log_fields(category: str, chat_id: int = None, item_id: str = None) -> dict:
+    return {"category": category, "chat_id": chat_id, "item": item_id}
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": self.formatTime(record), "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        for field in LOG_STRUCTURED_FIELDS:
+            if getattr(record, field, None) is not None: entry[field] = getattr(record, field)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class CategorySamplingFilter(logging.Filter):
+    """Samples and rate limits categorized records; reports how many were suppressed once a minute."""
+    def __init__(self, sample_rates: dict[str, float], per_minute: int):
+        super().__init__(); self.sample_rates, self.per_minute = sample_rates, per_minute
+        self.windows: dict[str, list] = {} # category -> [window start, passed, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "category", None)
+        if category is None or record.levelno >= logging.WARNING: return True
+        if random.random() >= self.sample_rates.get(category, 1.0): return False
+        if not self.per_minute: return True
+        now = time.monotonic(); window = self.windows.setdefault(category, [now, 0, 0])
+        if now - window[0] >= 60:
+            if window[2]: record.msg, record.args = f"{record.getMessage()} (+{window[2]} '{category}' records suppressed by rate limit)", ()
+            window[:] = [now, 0, 0]
+        if window[1] >= self.per_minute: window[2] += 1; return False
+        window[1] += 1; return True
+
+def configure_logging() -> logging.handlers.QueueListener:
+    output_handler = logging.StreamHandler()
+    output_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == "json" else logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue); queue_handler.setFormatter(logging.Formatter("%(message)s")) # Merges args/traceback into msg
+    queue_handler.addFilter(CategorySamplingFilter(LOG_SAMPLE_RATES, LOG_CATEGORY_RATE_LIMIT_PER_MINUTE))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler], force=True)
+    listener = logging.handlers.QueueListener(log_queue, output_handler); listener.start()
+    atexit.register(listener.stop) # Flushes what is still queued
+    return listener
+
+LOG_LISTENER = configure_logging()
 logger = logging.getLogger(__name__)
 
 if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE": logger.critical("FATAL: Bot token not set!"); exit("Bot token error.")
@@ -54,33 +194,353 @@ REMINDER_INTERVALS_SECONDS = [
     37440*60, 48960*60, 69120*60, 86440*60, 115200*60, 144000*60
 ]
 
-# --- B2+ Pack ---
+# --- Metrics ---
+# In-process counters, gauges and latency histograms, served in Prometheus text format on
+# METRICS_HOST:METRICS_PORT/metrics (port 0 disables). Sharded workers use METRICS_PORT + 1 + shard.
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+class LatencyHistogram:
+    """Cumulative-friendly latency histogram: per-bucket counts plus total count and sum."""
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS_SECONDS):
+        self.buckets = buckets; self.counts = [0] * len(buckets); self.count = 0; self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1; self.count += 1; self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (0 when empty)."""
+        rank = q * self.count; seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= rank and seen: return bound
+        return 0.0
+
+class Metric:
+    """One metric family; `values` maps a tuple of label values to a float (counter/gauge) or LatencyHistogram."""
+    def __init__(self, name: str, help_text: str, kind: str, label_names: tuple = ()):
+        self.name, self.help_text, self.kind, self.label_names = name, help_text, kind, label_names
+        self.values: dict[tuple, float | LatencyHistogram] = {}
+        METRICS.append(self)
+
+    def _key(self, labels: dict) -> tuple: return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels); self.values[key] = self.values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels) -> None: self.values[self._key(labels)] = value
+
+    def observe(self, seconds: float, **labels) -> None:
+        key = self._key(labels)
+        if key not in self.values: self.values[key] = LatencyHistogram()
+        self.values[key].observe(seconds)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            labels = [f'{name}="{_escape_label(v)}"' for name, v in zip(self.label_names, key)]
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{{{','.join(labels)}}} {value}" if labels else f"{self.name} {value}"); continue
+            cumulative = 0
+            for bound, bucket_count in zip(value.buckets, value.counts):
+                cumulative += bucket_count; le = "+Inf" if bound == float('inf') else repr(bound)
+                bucket_labels = ",".join(labels + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            label_str = f"{{{','.join(labels)}}}" if labels else ""
+            lines += [f"{self.name}_sum{label_str} {value.total}", f"{self.name}_count{label_str} {value.count}"]
+        return lines
+
+def _escape_label(value: str) -> str: return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+METRICS: list[Metric] = []
+METRIC_REMINDERS_SCHEDULED = Metric("fibo_reminders_scheduled_total", "Reminder jobs scheduled.", "counter", ("source",))
+METRIC_REMINDERS_SENT = Metric("fibo_reminders_sent_total", "Reminders delivered.", "counter")
+METRIC_REMINDERS_FAILED = Metric("fibo_reminders_failed_total", "Reminders that failed to send.", "counter")
+METRIC_REMINDER_SEND_SECONDS = Metric("fibo_reminder_send_seconds", "Time to build and send one reminder.", "histogram")
+METRIC_SCHEDULER_JOBS = Metric("fibo_scheduler_jobs", "Jobs currently in the JobQueue.", "gauge")
+METRIC_ACTIVE_USERS = Metric("fibo_active_users", "Chats with at least one pending reminder.", "gauge")
+METRIC_HANDLER_SECONDS = Metric("fibo_handler_seconds", "Message handler latency.", "histogram", ("handler",))
+METRIC_CALLBACK_SECONDS = Metric("fibo_callback_seconds", "Callback query latency per route (count = calls).", "histogram", ("route",))
+METRIC_CACHE_REQUESTS = Metric("fibo_cache_requests_total", "Cache lookups by result.", "counter", ("cache", "result"))
+METRIC_EXTERNAL_API_SECONDS = Metric("fibo_external_api_seconds", "External API call latency.", "histogram", ("api",))
+METRIC_EXTERNAL_API_ERRORS = Metric("fibo_external_api_errors_total", "External API call errors.", "counter", ("api",))
+METRIC_PACK_ACTIVATIONS = Metric("fibo_pack_activations_total", "Vocabulary packs started by users.", "counter", ("pack",))
+METRIC_PACK_WORDS_ACTIVATED = Metric("fibo_pack_words_activated_total", "Pack words moved from pending to active.", "counter", ("pack",))
+
+def render_metrics(application: Application | None = None) -> str:
+    if application and application.job_queue: METRIC_SCHEDULER_JOBS.set(len(application.job_queue.jobs()))
+    METRIC_ACTIVE_USERS.set(len({chat_id for chat_id, items in _ITEM_JOBS.items() if any(items.values())} | _QUIET_BATCHES.keys()))
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+async def start_metrics_server(application: Application, port: int = METRICS_PORT):
+    """Serves GET /metrics; returns the asyncio server (None if disabled or the port is taken)."""
+    if not port: return None
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""): pass
+            parts = request_line.decode("latin-1").split(" ")
+            found = len(parts) > 1 and parts[1].split("?", 1)[0] == "/metrics"
+            body = render_metrics(application).encode() if found else b"Not Found\n"
+            writer.write((f"HTTP/1.1 {'200 OK' if found else '404 Not Found'}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                          f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError): pass
+        finally: writer.close()
+    try: server = await asyncio.start_server(handle, METRICS_HOST, port)
+    except OSError as e: logger.error(f"Metrics server could not bind {METRICS_HOST}:{port}: {e}"); return None
+    logger.info(f"Metrics on http://{METRICS_HOST}:{port}/metrics"); return server
+
+# --- Event Loop Lag ---
+# A task sleeps LOOP_LAG_INTERVAL_SECONDS at a time and records how late it wakes up. A watchdog
+# thread notices when that task has not run for LOOP_LAG_THRESHOLD_SECONDS and logs the loop
+# thread's current stack, i.e. the synchronous code that is blocking every chat.
+LOOP_LAG_INTERVAL_SECONDS = float(os.environ.get("LOOP_LAG_INTERVAL_SECONDS", "0.25"))
+LOOP_LAG_THRESHOLD_SECONDS = float(os.environ.get("LOOP_LAG_THRESHOLD_SECONDS", "0.5")) # 0 disables the monitor
+LOOP_LAG_BUCKETS_SECONDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))
+METRIC_LOOP_LAG_SECONDS = Metric("fibo_event_loop_lag_seconds", "How late the event loop ran a timer.", "histogram")
+METRIC_LOOP_BLOCKED = Metric("fibo_event_loop_blocked_total", "Times the loop was blocked past LOOP_LAG_THRESHOLD_SECONDS.", "counter")
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS, threshold: float = LOOP_LAG_THRESHOLD_SECONDS):
+        self.interval, self.threshold = interval, threshold
+        self.heartbeat = time.monotonic(); self.reported_heartbeat = None
+        self.stopped = threading.Event(); self.task = None
+
+    def start(self) -> "LoopLagMonitor":
+        self.loop_thread_id = threading.get_ident()
+        self.task = asyncio.create_task(self._measure(), name="loop_lag_monitor")
+        threading.Thread(target=self._watch, name="loop_lag_watchdog", daemon=True).start()
+        return self
+
+    def close(self) -> None:
+        self.stopped.set()
+        if self.task: self.task.cancel()
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self.heartbeat = time.monotonic(); expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            METRIC_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
+
+    def _watch(self) -> None:
+        while not self.stopped.wait(self.interval):
+            heartbeat = self.heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for < self.threshold or heartbeat == self.reported_heartbeat: continue
+            self.reported_heartbeat = heartbeat; METRIC_LOOP_BLOCKED.inc() # One report per stall
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(loop thread not found)\n"
+            logger.warning(f"Event loop blocked for {blocked_for:.2f}s so far. Loop thread stack:\n{stack}")
+
+async def start_monitoring(application: Application, metrics_port: int = METRICS_PORT) -> list:
+    """Starts the metrics endpoint and the loop lag monitor; pass the result to stop_monitoring."""
+    services = []
+    if (metrics_server := await start_metrics_server(application, metrics_port)): services.append(metrics_server)
+    if LOOP_LAG_THRESHOLD_SECONDS > 0: services.append(LoopLagMonitor().start())
+    return services
+
+def stop_monitoring(services: list) -> None:
+    for service in services: service.close()
+
+# --- Slow Update Profiling ---
+# SLOW_UPDATE_PROFILE=1 times every update and job. A sampled fraction (SLOW_UPDATE_SAMPLE_RATE) runs
+# under cProfile, and when such a run takes longer than SLOW_UPDATE_THRESHOLD_SECONDS its top
+# functions by cumulative time are written to a rotating file. cProfile is process-wide, so only one
+# run is profiled at a time and its report also includes other tasks that ran on the loop meanwhile.
+SLOW_UPDATE_PROFILE_ENABLED = os.environ.get("SLOW_UPDATE_PROFILE") == "1"
+SLOW_UPDATE_THRESHOLD_SECONDS = float(os.environ.get("SLOW_UPDATE_THRESHOLD_SECONDS", "0.5"))
+SLOW_UPDATE_SAMPLE_RATE = float(os.environ.get("SLOW_UPDATE_SAMPLE_RATE", "0.05"))
+SLOW_UPDATE_TOP_N = int(os.environ.get("SLOW_UPDATE_TOP_N", "25"))
+SLOW_UPDATE_LOG_FILE = os.environ.get("SLOW_UPDATE_LOG_FILE", "slow_updates.log")
+SLOW_UPDATE_LOG_MAX_BYTES = 5 * 1024 * 1024; SLOW_UPDATE_LOG_BACKUPS = 3
+METRIC_OPERATION_SECONDS = Metric("fibo_operation_seconds", "Update and job latency (SLOW_UPDATE_PROFILE mode).", "histogram", ("type", "name"))
+METRIC_SLOW_OPERATIONS = Metric("fibo_slow_operations_total", "Updates and jobs over SLOW_UPDATE_THRESHOLD_SECONDS.", "counter", ("type", "name"))
+_PROFILER_BUSY = False
+_SLOW_UPDATE_LOGGER: logging.Logger | None = None
+
+def _get_slow_update_logger() -> logging.Logger:
+    global _SLOW_UPDATE_LOGGER
+    if _SLOW_UPDATE_LOGGER is None:
+        handler = logging.handlers.RotatingFileHandler(SLOW_UPDATE_LOG_FILE, maxBytes=SLOW_UPDATE_LOG_MAX_BYTES, backupCount=SLOW_UPDATE_LOG_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        _SLOW_UPDATE_LOGGER = logging.getLogger(__name__ + ".slow_updates"); _SLOW_UPDATE_LOGGER.propagate = False
+        _SLOW_UPDATE_LOGGER.addHandler(handler); _SLOW_UPDATE_LOGGER.setLevel(logging.INFO)
+    return _SLOW_UPDATE_LOGGER
+
+async def run_profiled(operation_type: str, name: str, awaitable):
+    """Awaits `awaitable`, timing it and (when sampled) profiling it; slow runs are reported."""
+    global _PROFILER_BUSY
+    profiler = None
+    if not _PROFILER_BUSY and random.random() < SLOW_UPDATE_SAMPLE_RATE:
+        import cProfile
+        profiler = cProfile.Profile(); _PROFILER_BUSY = True; profiler.enable()
+    started = time.perf_counter()
+    try: return await awaitable
+    finally:
+        elapsed = time.perf_counter() - started
+        if profiler: profiler.disable(); _PROFILER_BUSY = False
+        METRIC_OPERATION_SECONDS.observe(elapsed, type=operation_type, name=name)
+        if elapsed >= SLOW_UPDATE_THRESHOLD_SECONDS:
+            METRIC_SLOW_OPERATIONS.inc(type=operation_type, name=name)
+            report = f"Slow {operation_type} '{name}': {elapsed * 1000:.0f}ms"
+            if profiler:
+                import io, pstats
+                stream = io.StringIO(); pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(SLOW_UPDATE_TOP_N)
+                report += f"\n{stream.getvalue()}"
+            else: report += " (not sampled)"
+            _get_slow_update_logger().info(report)
+
+def describe_update(update: object) -> str:
+    """Short name of what an update triggers: callback route, command, or message handler."""
+    if not isinstance(update, Update): return type(update).__name__
+    if update.callback_query: return resolve_callback_route(update.callback_query.data or "")[0] or "callback:unknown"
+    text = update.effective_message.text if update.effective_message else None
+    if not text: return "other"
+    if text.startswith("/"): return text.split()[0]
+    return REPLY_KEYBOARD_ROUTES.get(text, handle_user_message_for_scheduling).__name__
+
+def profiled_job(callback):
+    """Job callback decorator; a no-op unless SLOW_UPDATE_PROFILE is on."""
+    if not SLOW_UPDATE_PROFILE_ENABLED: return callback
+    async def run_timed(context: ContextTypes.DEFAULT_TYPE) -> None: await run_profiled("job", callback.__name__, callback(context))
+    run_timed.__name__ = callback.__name__
+    return run_timed
+
+# --- Vocabulary Packs ---
+# Pack files are read and sorted on first use, not at import.
 VOCABULARY_PACK_FILE = "vocabulary_pack_b2plus.txt"
-CURATED_VOCABULARY_PACK = []
-try:
-    with open(VOCABULARY_PACK_FILE, "r", encoding="utf-8") as f:
-        CURATED_VOCABULARY_PACK = sorted(list(set([line.strip() for line in f if line.strip()])))
-    if CURATED_VOCABULARY_PACK: _initial_logger.info(f"Loaded {len(CURATED_VOCABULARY_PACK)} words from {VOCABULARY_PACK_FILE}.")
-    else: _initial_logger.warning(f"{VOCABULARY_PACK_FILE} is empty. Curated pack feature will be limited.")
-except FileNotFoundError: _initial_logger.error(f"{VOCABULARY_PACK_FILE} not found! Curated pack feature disabled."); CURATED_VOCABULARY_PACK = []
-
-# --- Luxembourg Pack ---
 LUXEMBOURG_PACK_FILE = "20_luxembourg_language_phrases.txt"
-CURATED_LUXEMBOURG_PACK = []
-try:
-    with open(LUXEMBOURG_PACK_FILE, "r", encoding="utf-8") as f:
-        CURATED_LUXEMBOURG_PACK = sorted(list(set([line.strip() for line in f if line.strip()])))
-    if CURATED_LUXEMBOURG_PACK: _initial_logger.info(f"Loaded {len(CURATED_LUXEMBOURG_PACK)} phrases from {LUXEMBOURG_PACK_FILE}.")
-    else: _initial_logger.warning(f"{LUXEMBOURG_PACK_FILE} is empty or not found. Luxembourg pack feature will be limited.")
-except FileNotFoundError: _initial_logger.error(f"{LUXEMBOURG_PACK_FILE} not found! Luxembourg pack feature disabled."); CURATED_LUXEMBOURG_PACK = []
+_PACK_ITEMS_CACHE: dict[str, list[str]] = {}
+
+def load_pack_items(pack_file: str) -> list[str]:
+    """Sorted unique non-empty lines of a pack file ([] if missing), cached per file."""
+    if pack_file not in _PACK_ITEMS_CACHE:
+        with profile_startup_component(f"pack {pack_file}"):
+            try:
+                with open(pack_file, "r", encoding="utf-8") as f:
+                    _PACK_ITEMS_CACHE[pack_file] = sorted(list(set([line.strip() for line in f if line.strip()])))
+                if _PACK_ITEMS_CACHE[pack_file]: logger.info(f"Loaded {len(_PACK_ITEMS_CACHE[pack_file])} items from {pack_file}.")
+                else: logger.warning(f"{pack_file} is empty. Pack feature will be limited.")
+            except FileNotFoundError: logger.error(f"{pack_file} not found! Pack feature disabled."); _PACK_ITEMS_CACHE[pack_file] = []
+    return _PACK_ITEMS_CACHE[pack_file]
+
+# --- Translation Backends ---
+# Backends are tried in order; the first one that returns translations wins.
+# Local phrasebooks come first so pack phrases never touch the network.
+TRANSLATION_TARGET_LANGUAGES = {'es':'Spanish','fr':'French','de':'German','ru':'Russian'}
+LOCAL_PHRASEBOOK_FILES = [ # (path, source language, target language) of "phrase - translation" files
+    (LUXEMBOURG_PACK_FILE, 'lb', 'ru'),
+]
+PHRASEBOOK_SEPARATOR = " - "
+
+def _phrasebook_key(text: str) -> str:
+    """Lookup key for a phrase: NFKC, casefolded, punctuation dropped, whitespace collapsed."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(re.sub(r"[^\w\s'-]", " ", text).split())
+
+class LocalPhrasebookBackend:
+    """Offline lookups in a "phrase - translation" file.
+
+    The file is memory-mapped and a sorted (key, offset) index is built once at load time,
+    so a lookup is a binary search plus one slice of the mapping.
+    """
+    is_network = False
+
+    def __init__(self, path: str, source_lang: str, target_lang: str):
+        self.name = f"phrasebook:{os.path.basename(path)}"
+        self.source_lang, self.target_lang = source_lang, target_lang
+        self._keys: list[str] = []; self._offsets = array('Q'); self._mm = None
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0: return
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        entries = []; offset = 0
+        for raw_line in iter(self._mm.readline, b""):
+            phrase, sep, translation = raw_line.decode("utf-8", "replace").partition(PHRASEBOOK_SEPARATOR)
+            key = _phrasebook_key(phrase)
+            if sep and key and translation.strip(): entries.append((key, offset))
+            offset += len(raw_line)
+        entries.sort()
+        self._keys = [k for k, _ in entries]; self._offsets = array('Q', (o for _, o in entries))
+
+    def __len__(self) -> int: return len(self._keys)
+
+    def lookup(self, text: str) -> dict[str, str] | None:
+        key = _phrasebook_key(text.partition(PHRASEBOOK_SEPARATOR)[0])
+        i = bisect.bisect_left(self._keys, key)
+        if not key or i == len(self._keys) or self._keys[i] != key: return None
+        start = self._offsets[i]; end = self._mm.find(b"\n", start)
+        line = self._mm[start:end if end != -1 else len(self._mm)].decode("utf-8", "replace")
+        return {self.target_lang: line.partition(PHRASEBOOK_SEPARATOR)[2].strip()}
+
+class TranslateLibraryBackend:
+    """Network lookups through the `translate` library (English source). Failed languages map to None."""
+    name = "translate"; is_network = True
+
+    def __init__(self, source_lang: str = 'en', target_langs: dict = TRANSLATION_TARGET_LANGUAGES):
+        self.source_lang, self.target_langs = source_lang, target_langs
+
+    def lookup(self, text: str) -> dict[str, str | None] | None:
+        translate_module = _lazy_import("translate", "TRANSLATOR_AVAILABLE")
+        if not translate_module: return None
+        results = {}
+        for code, name in self.target_langs.items():
+            started = time.perf_counter()
+            try:
+                translation_result = translate_module.Translator(to_lang=code, from_lang=self.source_lang).translate(text)
+                if translation_result and translation_result.lower() != text.lower(): results[code] = html.unescape(translation_result)
+            except Exception as e:
+                logger.error(f"Trans Err:'{text}'-{name}:{e}",exc_info=False); results[code] = None
+                METRIC_EXTERNAL_API_ERRORS.inc(api="translate")
+            finally: METRIC_EXTERNAL_API_SECONDS.observe(time.perf_counter() - started, api="translate")
+        return results or None
+
+_TRANSLATION_BACKENDS: list | None = None
+
+def get_translation_backends() -> list:
+    """The backend chain, built on first use (phrasebook indexes first, then network)."""
+    global _TRANSLATION_BACKENDS
+    if _TRANSLATION_BACKENDS is None:
+        backends = []
+        for pb_path, pb_src, pb_tgt in LOCAL_PHRASEBOOK_FILES:
+            try:
+                with profile_startup_component(f"phrasebook index {pb_path}"): backend = LocalPhrasebookBackend(pb_path, pb_src, pb_tgt)
+                backends.append(backend); logger.info(f"Indexed {len(backend)} phrasebook entries from {pb_path}.")
+            except OSError as e: logger.error(f"Phrasebook {pb_path} unavailable: {e}")
+        if TRANSLATOR_AVAILABLE: backends.append(TranslateLibraryBackend())
+        _TRANSLATION_BACKENDS = backends
+    return _TRANSLATION_BACKENDS
+
+def lookup_local_translation(text: str) -> dict[str, str] | None:
+    """Translations from the offline backends only (no network I/O)."""
+    for backend in get_translation_backends():
+        if not backend.is_network and (found := backend.lookup(text)):
+            METRIC_CACHE_REQUESTS.inc(cache="phrasebook", result="hit"); return found
+    METRIC_CACHE_REQUESTS.inc(cache="phrasebook", result="miss"); return None
+
+def lookup_translations(text: str) -> tuple[dict[str, str | None] | None, str | None]:
+    """Walks the backend chain; returns (translations by language code, backend name) of the first hit."""
+    for backend in get_translation_backends():
+        found = backend.lookup(text)
+        if found: return found, backend.name
+    return None, None
 
 
 # --- Callback data prefixes ---
+# Item actions (delete/clue/AI) are followed by a short item ID from the chat's learning item table.
 CALLBACK_DELETE_REQUEST = "del_req:"
 CALLBACK_DELETE_CONFIRM = "del_conf:"
 CALLBACK_DELETE_CANCEL = "del_can:"
 CALLBACK_CLUE_REQUEST = "clue_req:"
 CALLBACK_AI_EXPLAIN = "ai_explain:"
+CALLBACK_REVIEW_REMEMBERED = "rev_ok:" # + item_id:review number
+CALLBACK_REVIEW_FORGOT = "rev_no:"
+CALLBACK_QUIZ_ANSWER = "quiz_ans:" # + quiz number:choice
+CALLBACK_QUIZ_NEXT = "quiz_next"
+CALLBACK_DIGEST_ANSWER = "dg_ans:" # + digest number:entry index:grade
+CALLBACK_DIGEST_PAGE = "dg_pg:" # + digest number:page
 CALLBACK_SORT_DICT = "sort_dict:"
 CALLBACK_DICT_PAGE_NEXT = "dict_pg_n:"
 CALLBACK_DICT_PAGE_PREV = "dict_pg_p:"
@@ -153,6 +613,83 @@ PACK_DESCRIPTIONS = {
 }
 GENERIC_NEXT_PACK_NOTE = "\n\nFuture vocabulary packs aim to offer even more comprehensive learning material, building upon the foundations established by current selections."
 
+# --- Local Time & Quiet Hours ---
+# "Today" is the chat's local day: /timezone sets an IANA zone (unset = DEFAULT_TIMEZONE). /quiet sets a
+# local window such as 22-8 in which no reminder is sent; reminders falling into it are held to the
+# window's end and then go out together as one message (one send instead of many, spread by zone).
+# Held items have no job of their own: the chat's one batch job per release delivers them all.
+DEFAULT_TIMEZONE = os.environ.get("DEFAULT_TIMEZONE", "UTC") # IANA zone of chats that haven't set one
+DEFAULT_TZINFO = zoneinfo.ZoneInfo(DEFAULT_TIMEZONE) # A real zone, so daily jobs and "today" follow its DST changes
+LOCAL_TIME_KEY = "local_time_v1" # chat_data: {'tz': IANA name or None, 'quiet': [start hour, end hour] or None}
+QUIET_BATCH_PREFIX = "🌅 Held during your quiet hours"
+QUIET_BATCH_MAX_BUTTONS = 20 # Items of a batch message that get their own ✅/❌ row
+QUIET_BATCH_JOB_PREFIX = "quiet_"
+METRIC_QUIET_DEFERRED = Metric("fibo_quiet_hours_deferred_total", "Reminders held until the end of quiet hours.", "counter")
+_QUIET_BATCHES: dict[int, dict[int, list]] = {} # chat_id -> release timestamp -> [booked send time, batch Job]; job.data['held'] = {item_id: original due}
+
+def chat_timezone(chat_data: dict | None) -> datetime.tzinfo:
+    name = (chat_data or {}).get(LOCAL_TIME_KEY, {}).get('tz')
+    return zoneinfo.ZoneInfo(name) if name else DEFAULT_TZINFO
+
+def local_now(chat_data: dict | None) -> datetime.datetime: return datetime.datetime.now(chat_timezone(chat_data))
+
+def local_day(ts: float, tz: datetime.tzinfo | None) -> int:
+    """Ordinal of the local calendar day `ts` falls on."""
+    return datetime.datetime.fromtimestamp(ts, tz).toordinal()
+
+def local_day_start(day: datetime.date, tz: datetime.tzinfo | None) -> float:
+    return datetime.datetime.combine(day, datetime.time.min, tz).timestamp()
+
+def quiet_release_time(chat_data: dict | None, ts: float) -> float | None:
+    """End of the chat's quiet window if `ts` falls inside it, else None."""
+    quiet = (chat_data or {}).get(LOCAL_TIME_KEY, {}).get('quiet')
+    if not quiet: return None
+    start, end = quiet; tz = chat_timezone(chat_data); local = datetime.datetime.fromtimestamp(ts, tz)
+    if start < end: inside, release_day = start <= local.hour < end, local.date()
+    else: inside, release_day = local.hour >= start or local.hour < end, local.date() + datetime.timedelta(days=local.hour >= start) # Window spans midnight
+    return datetime.datetime.combine(release_day, datetime.time(end), tz).timestamp() if inside else None
+
+def hold_for_quiet_batch(job_queue: JobQueue, chat_id: int, release: float, gap: float, item_id: str, held_due: float):
+    """Adds an item to the chat's batch for one release; the first item held for it books the send slot
+    and creates the batch job. Returns the batch job."""
+    release = int(release); batches = _QUIET_BATCHES.setdefault(chat_id, {})
+    if release not in batches:
+        send_at = book_send_slot(release, gap)
+        batches[release] = [send_at, job_queue.run_once(chat_serialized_job(send_quiet_batch), max(1.0, send_at - time.time()), chat_id=chat_id,
+                                                         data={'quiet_release': release, 'held': {}}, name=f"{QUIET_BATCH_JOB_PREFIX}{chat_id}_{release}")]
+    batch_job = batches[release][1]; batch_job.data['held'][item_id] = held_due
+    return batch_job
+
+def get_quiet_batch_job(chat_id: int, item_id: str):
+    """The batch job holding the item, or None."""
+    return next((batch[1] for batch in _QUIET_BATCHES.get(chat_id, {}).values() if item_id in batch[1].data['held']), None)
+
+def pop_quiet_batch(chat_id: int, release: int) -> None:
+    """Forgets one batch and gives back its send slot (its job ran or is being removed)."""
+    batches = _QUIET_BATCHES.get(chat_id, {}); batch = batches.pop(release, None)
+    if not batches: _QUIET_BATCHES.pop(chat_id, None)
+    if batch: release_send_second(int(batch[0]))
+
+def release_quiet_hold(chat_id: int, item_id: str) -> int:
+    """Takes the item out of its batch; the batch job and its slot go with the last item. Returns 1 if it was held."""
+    batch_job = get_quiet_batch_job(chat_id, item_id)
+    if batch_job is None: return 0
+    del batch_job.data['held'][item_id]
+    if not batch_job.data['held']: batch_job.schedule_removal(); pop_quiet_batch(chat_id, batch_job.data['quiet_release'])
+    return 1
+
+def apply_quiet_hours(job_queue: JobQueue, chat_id: int, chat_data: dict) -> int:
+    """Re-schedules items whose pending reminder falls into the (new) quiet window, and held ones from
+    their original due (at once if it has passed and is no longer quiet); returns how many moved."""
+    table = chat_data.get(ITEM_TABLE_KEY); moved = 0
+    if table: rebuild_due_days(chat_data) # Day buckets follow the zone
+    for item_id, item in (table['items'].items() if table else ()):
+        batch_job = get_quiet_batch_job(chat_id, item_id) if chat_id in _QUIET_BATCHES else None
+        if batch_job or (item.get('due') is not None and quiet_release_time(chat_data, item['due']) is not None):
+            held_due = batch_job.data['held'][item_id] if batch_job else None
+            remove_item_jobs(chat_id, item_id); schedule_next_review(job_queue, chat_id, chat_data, item_id, held_due); moved += 1
+    return moved
+
 # --- Learning Intensity ---
 INTENSITY_LEVELS = [ # Based on actual reminders scheduled for *today*
     (0, " отдыхайте сегодня", "😴"), # 0 reminders today
@@ -172,119 +709,608 @@ def get_learning_intensity(daily_reminders_count: int) -> tuple[str, str]:
     # This line should ideally not be reached if the last limit is float('inf')
     return INTENSITY_LEVELS[-1][1], INTENSITY_LEVELS[-1][2]
 
+def count_daily_reminders(job_queue: JobQueue | None, chat_id: int, chat_data: dict | None = None) -> int:
+    """Jobs of this chat due today (the chat's local day), the input to get_learning_intensity."""
+    if not job_queue: return 0
+    tz = chat_timezone(chat_data); today = datetime.datetime.now(tz).date(); daily_reminders_count = 0
+    if digest_time(chat_data): return chat_data.get(ITEM_TABLE_KEY, {}).get('due_days', {}).get(today.toordinal(), 0) # No per-reminder jobs
+    for job in job_queue.jobs():
+        if job.chat_id == chat_id and job.next_run_time and job.next_run_time.astimezone(tz).date() == today:
+            daily_reminders_count += len(job.data['held']) if job.data and 'held' in job.data else 1 # A quiet-hours batch delivers several
+    return daily_reminders_count
+
 
 # --- Helper Functions ---
 def count_vowels(text: str) -> int:
     return sum(1 for char in text if char in "aeiouAEIOU")
 
+def get_clue_word(item_text: str) -> str:
+    """The part of an item that Clue/Explain look up: the whole phrase if the phrasebook knows it, else its first word."""
+    phrasebook_phrase = item_text.partition(PHRASEBOOK_SEPARATOR)[0]
+    if lookup_local_translation(phrasebook_phrase): word = phrasebook_phrase # Whole phrase resolves offline
+    else: word = item_text.split(' ')[0] if ' ' in item_text else item_text
+    return re.sub(r'[^\w\s\'-]', '', word).strip()
+
 def get_clue_and_translations(word: str) -> str:
     word_cleaned = word.strip().lower(); phonetic_clue_str = "Phonetic Clue: Not available."; translations_str = "\n\nTranslations:\n"
     if not word_cleaned: return "N/A (empty word)"
-    if ENG_TO_IPA_AVAILABLE:
+    local_translations = lookup_local_translation(word)
+    ipa_module = _lazy_import("eng_to_ipa", "ENG_TO_IPA_AVAILABLE") if ENG_TO_IPA_AVAILABLE and not local_translations else None
+    if not ipa_module: phonetic_clue_str = f"Basic: {word_cleaned[0]}-{word_cleaned[-1]} V:{count_vowels(word_cleaned)}"
+    else:
         try:
             if not re.fullmatch(r"[a-zA-Z']+",word_cleaned.split(" ")[0]):
                  phonetic_clue_str=f"Basic: {word_cleaned[0]}-{word_cleaned[-1]} V:{count_vowels(word_cleaned)}"
             else:
-                 ipa=eng_to_ipa.convert(word_cleaned)
+                 ipa=ipa_module.convert(word_cleaned)
                  phonetic_clue_str = f"IPA: /{ipa}/" if ipa!=word_cleaned and '*' not in ipa else f"Basic: {word_cleaned[0]}-{word_cleaned[-1]} V:{count_vowels(word_cleaned)}"
         except Exception as e: logger.error(f"IPA Err:'{word_cleaned}':{e}"); phonetic_clue_str="Phonetic:Error"
-    else: phonetic_clue_str = f"Basic: {word_cleaned[0]}-{word_cleaned[-1]} V:{count_vowels(word_cleaned)}"
-    if TRANSLATOR_AVAILABLE:
-        langs={'es':'Spanish','fr':'French','de':'German','ru':'Russian'}; found,errs=False,False
-        for code,name in langs.items():
-            try:
-                translator = Translator(to_lang=code, from_lang='en')
-                translation_result = translator.translate(word_cleaned)
-                if translation_result and translation_result.lower() != word_cleaned:
-                    translations_str+=f"- {name}: {html.unescape(translation_result)}\n"; found=True
-            except Exception as e: logger.error(f"Trans Err:'{word_cleaned}'-{name}:{e}",exc_info=False);translations_str+=f"- {name}:Error\n";errs=True
-        if not found and not errs: translations_str+="No distinct translations."
-        elif not found and errs: translations_str+="Translation errors."
-    else: translations_str="\n\nTranslations:(Disabled)"
+    translations, backend_name = (local_translations, "phrasebook") if local_translations else lookup_translations(word_cleaned)
+    if not translations and not TRANSLATOR_AVAILABLE: translations_str = "\n\nTranslations:(Disabled)"
+    elif not translations: translations_str += "No distinct translations."
+    elif not any(translations.values()): translations_str += "Translation errors."
+    else:
+        for code, translation in translations.items():
+            name = TRANSLATION_TARGET_LANGUAGES.get(code, code)
+            translations_str += f"- {name}: {translation}\n" if translation else f"- {name}:Error\n"
+        if backend_name == "phrasebook": translations_str += "(from offline phrasebook)"
     return f"{phonetic_clue_str}{translations_str}"
 
 async def get_ai_explanation(word_or_phrase:str)->str:
+    openai_client = get_openai_client()
     if not OPENAI_AVAILABLE or not openai_client: return "AI unavailable."
     w=word_or_phrase.strip(); logger.info(f"AI for:'{w}'")
     if not w: return "Empty text."
+    started = time.perf_counter()
     try:
         p=f"Explain \"{w}\" simply for ESL. Main meaning & 1 example. Concise. If phrase, explain phrase."
         c=await openai_client.chat.completions.create(messages=[{"role":"system","content":"Helpful ESL assistant."}, {"role":"user","content":p}],model="gpt-3.5-turbo",max_tokens=150,temperature=0.7)
         r=c.choices[0].message.content; return r.strip() if r else "AI no explanation."
-    except Exception as e: logger.error(f"OpenAI Err:'{w}':{e}",exc_info=True); return "AI error."
-
-# --- NEW HELPER: Calculate Projected Pack Completion Date ---
-def calculate_projected_pack_completion_date(
-    user_specific_data: dict,
-    job_queue: JobQueue, 
-    chat_id: int,
-    current_intensity_modifier: float = 1.0, # Current modifier
-    new_intensity_modifier: float = None # If calculating for a new modifier
-) -> datetime.date | None:
-    
-    latest_date_obj = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
-
-    # 1. Find the latest next_run_time of any existing job for the user
-    if job_queue:
-        for job in job_queue.jobs():
-            if job.chat_id == chat_id and job.next_run_time and not job.removed:
-                current_job_time = job.next_run_time
-                if current_job_time.tzinfo is None: # Ensure offset-aware
-                    current_job_time = current_job_time.replace(tzinfo=datetime.timezone.utc)
-                else:
-                    current_job_time = current_job_time.astimezone(datetime.timezone.utc)
-                if current_job_time > latest_date_obj:
-                    latest_date_obj = current_job_time
-    
-    # Effective start date for simulating new pack word activations
-    sim_start_date = max(datetime.date.today(), latest_date_obj.date())
-
-    # Determine which modifier to use for MAX_PACK_WORDS_PER_DAY calculation
-    modifier_to_use = new_intensity_modifier if new_intensity_modifier is not None else current_intensity_modifier
-    
-    effective_max_daily = MAX_PACK_WORDS_PER_DAY
-    if modifier_to_use > 0:
-        effective_max_daily = max(1, round(MAX_PACK_WORDS_PER_DAY / modifier_to_use))
-    
-    # Aggregate all pending words from all active packs
-    all_pending_words_from_active_packs = []
-    pack_keys_to_check = [USER_PACK_DATA_KEY, USER_LUX_PACK_DATA_KEY] # Add other future pack keys here
-
-    for pack_key in pack_keys_to_check:
-        pack_info = user_specific_data.get(pack_key)
-        if pack_info and pack_info.get('status') == 'in_progress' and 'pack_words_status' in pack_info:
-            for item_status in pack_info['pack_words_status']:
-                if item_status.get('status') == 'pending':
-                    all_pending_words_from_active_packs.append(item_status['word'])
-    
-    if not all_pending_words_from_active_packs: # No pending words from packs
-        if latest_date_obj == datetime.datetime.min.replace(tzinfo=datetime.timezone.utc): # And no active jobs
-            return datetime.date.today() # Nothing scheduled, "completion" is today
-        return latest_date_obj.date() # Completion is tied to last active job
-
-    # Calculate how many days it will take to activate all remaining pending words
-    days_to_activate_remaining = math.ceil(len(all_pending_words_from_active_packs) / effective_max_daily)
-    
-    # Date when the last of these pending words gets activated
-    last_activation_date = sim_start_date
-    # Simulate day-by-day activation
-    # This is a rough estimate; a precise one would need to track daily counts across loop
-    for i in range(days_to_activate_remaining):
-        last_activation_date += datetime.timedelta(days=1) 
-        # A more precise simulation would check if a weekend or non-learning day, if that logic is ever added.
-
-    # Add the longest reminder interval to the last activation date
-    if REMINDER_INTERVALS_SECONDS:
-        max_reminder_duration_seconds = REMINDER_INTERVALS_SECONDS[-1]
-        projected_completion_datetime = datetime.datetime.combine(last_activation_date, datetime.time.min, tzinfo=datetime.timezone.utc) + \
-                                       datetime.timedelta(seconds=max_reminder_duration_seconds)
-        final_projected_date = projected_completion_datetime.date()
-    else:
-        final_projected_date = last_activation_date
-        
-    # The overall latest date is either the end of current jobs or end of future pack words
-    return max(final_projected_date, latest_date_obj.date())
-
+    except Exception as e: logger.error(f"OpenAI Err:'{w}':{e}",exc_info=True); METRIC_EXTERNAL_API_ERRORS.inc(api="openai"); return "AI error."
+    finally: METRIC_EXTERNAL_API_SECONDS.observe(time.perf_counter() - started, api="openai")
+
+# --- Learning Item Table ---
+# Reminder buttons carry a short item ID instead of the item text, so every button fits Telegram's
+# 64-byte callback_data limit and a tap resolves with one dict lookup. Items are deduplicated on a
+# canonical key ("Embrace", "embrace " and the B2+ pack's "embrace" are one item with one schedule), and
+# the ID is content-addressed: base36 of a 64-bit blake2b digest of (chat_id, key). The same item gets the
+# same ID, job name and callback data in every process and after a restart, and finding an item by its
+# text is a lookup in 'items' without a second index.
+ITEM_TABLE_KEY = "learning_items_v1" # chat_data: {'items': {item_id: {'text', 'pack_source', 'added', 'history', 'due', ...}}, 'srs_params', 'due_days'}
+ITEM_KEY_STRIP_ANNOTATIONS = os.environ.get("ITEM_KEY_STRIP_ANNOTATIONS", "1") != "0"
+ITEM_KEY_PART_OF_SPEECH = r"(?:adj|adv|n|v|vt|vi|pl|prep|conj|pron|phr ?v|phrasal verb|idiom|informal|formal)\.?"
+ITEM_KEY_ANNOTATION = re.compile(rf"\s*\({ITEM_KEY_PART_OF_SPEECH}(?:\s*\+\s*{ITEM_KEY_PART_OF_SPEECH})*\)$") # As in C1_English_16_words.txt, e.g. "(adj)" or "(adj+n)"
+_ITEM_JOBS: dict[int, dict[str, list]] = {} # chat_id -> item_id -> pending reminder Jobs (Jobs don't pickle, so kept off chat_data)
+
+def _to_base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"; out = ""
+    while True:
+        number, rem = divmod(number, 36); out = digits[rem] + out
+        if not number: return out
+
+def item_key(text: str) -> str:
+    """Canonical form of an item's text: NFKC, casefolded, whitespace collapsed and (unless
+    ITEM_KEY_STRIP_ANNOTATIONS=0) a trailing part-of-speech note such as "(adj)" or "(adj+n)" dropped."""
+    key = " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+    return ITEM_KEY_ANNOTATION.sub("", key) if ITEM_KEY_STRIP_ANNOTATIONS else key
+
+def item_id_for(chat_id: int, text: str) -> str:
+    """Stable ID of `text` in the chat (at most 13 base36 characters); texts with the same key share it."""
+    digest = hashlib.blake2b(f"{chat_id}\x00{item_key(text)}".encode("utf-8"), digest_size=8).digest()
+    return _to_base36(int.from_bytes(digest, "big"))
+
+def reminder_job_name(chat_id: int, item_id: str) -> str:
+    return f"rem_{chat_id}_{item_id}"
+
+def _get_item_table(chat_data: dict) -> dict:
+    return chat_data.setdefault(ITEM_TABLE_KEY, {'items': {}, 'srs_params': SRS_PARAMS, 'due_days': {}})
+
+def find_learning_item(chat_data: dict, chat_id: int, text: str) -> str | None:
+    """ID of the chat's item with the same canonical key as `text`, if any."""
+    item_id = item_id_for(chat_id, text)
+    return item_id if item_id in chat_data.get(ITEM_TABLE_KEY, {}).get('items', {}) else None
+
+def register_learning_item(chat_data: dict, chat_id: int, text: str, pack_source: str = None) -> str:
+    """Returns the item ID for `text` (or any text with the same key), adding the item if the chat
+    hasn't seen it yet. The first text and source an item was added with are the ones shown."""
+    table = _get_item_table(chat_data); item_id = item_id_for(chat_id, text)
+    if item_id not in table['items']: table['items'][item_id] = {'text': text, 'pack_source': pack_source}
+    return item_id
+
+def get_learning_item(chat_data: dict, item_id: str) -> dict | None:
+    return chat_data.get(ITEM_TABLE_KEY, {}).get('items', {}).get(item_id)
+
+def forget_learning_item(chat_data: dict, item_id: str) -> None:
+    table = chat_data.get(ITEM_TABLE_KEY)
+    item = table['items'].pop(item_id, None) if table else None
+    if item: set_item_due(chat_data, item, None)
+
+def set_item_due(chat_data: dict, item: dict, due: float | None) -> None:
+    """Records when the item's pending reminder fires and keeps the chat's per-local-day histogram in step."""
+    due_days = _get_item_table(chat_data).setdefault('due_days', {}); tz = chat_timezone(chat_data)
+    if item.get('due') is not None:
+        day = local_day(item['due'], tz); due_days[day] -= 1
+        if not due_days[day]: del due_days[day]
+    item['due'] = due
+    if due is not None: day = local_day(due, tz); due_days[day] = due_days.get(day, 0) + 1
+
+def rebuild_due_days(chat_data: dict) -> None:
+    """Recounts the per-day histogram, e.g. after the chat's time zone changed."""
+    table = _get_item_table(chat_data); tz = chat_timezone(chat_data); due_days = table['due_days'] = {}
+    for item in table['items'].values():
+        if item.get('due') is not None: day = local_day(item['due'], tz); due_days[day] = due_days.get(day, 0) + 1
+
+def track_item_job(chat_id: int, item_id: str, job) -> None:
+    _ITEM_JOBS.setdefault(chat_id, {}).setdefault(item_id, []).append(job)
+
+def untrack_item_job(job) -> None:
+    """Drops a reminder job from the index once it has fired."""
+    item_jobs = _ITEM_JOBS.get(job.chat_id, {}).get((job.data or {}).get('item_id'))
+    if item_jobs and job in item_jobs: item_jobs.remove(job)
+    release_send_slot(job)
+
+def get_item_jobs(chat_id: int, item_id: str) -> list:
+    """Pending jobs that will deliver the item: its own reminder, or the quiet-hours batch holding it."""
+    jobs = [j for j in _ITEM_JOBS.get(chat_id, {}).get(item_id, []) if not j.removed]
+    batch_job = get_quiet_batch_job(chat_id, item_id) if chat_id in _QUIET_BATCHES else None
+    return jobs + [batch_job] if batch_job else jobs
+
+def remove_item_jobs(chat_id: int, item_id: str) -> int:
+    """Schedules removal of every pending reminder of one item; returns how many were removed."""
+    removed_count = release_quiet_hold(chat_id, item_id) if chat_id in _QUIET_BATCHES else 0
+    for job in _ITEM_JOBS.get(chat_id, {}).pop(item_id, []):
+        if not job.removed: job.schedule_removal(); release_send_slot(job); removed_count += 1
+    return removed_count
+
+def forget_chat_items(chat_id: int, chat_data: dict) -> None:
+    for item_jobs in _ITEM_JOBS.pop(chat_id, {}).values():
+        for job in item_jobs: release_send_slot(job)
+    for release, (_, batch_job) in list(_QUIET_BATCHES.get(chat_id, {}).items()):
+        if not batch_job.removed: batch_job.schedule_removal()
+        pop_quiet_batch(chat_id, release)
+    chat_data.pop(ITEM_TABLE_KEY, None)
+
+# --- Adaptive Spaced Repetition ---
+# An item keeps one pending reminder job. Its next gap is replayed from the item's review history
+# (SM-2 style): "Remembered" multiplies the last gap by the item's ease and raises the ease, "Forgot"
+# lowers the ease and restarts from the one-day step, and an unanswered reminder walks the classic
+# REMINDER_INTERVALS_SECONDS ladder. An item retires once its gap passes SRS_RETIRE_GAP_SECONDS or it
+# has walked the whole ladder, so an easy word takes ~6 reminders instead of 14.
+SRS_INITIAL_EASE = float(os.environ.get("SRS_INITIAL_EASE", "2.5"))
+SRS_MIN_EASE = 1.3
+SRS_EASE_BONUS = float(os.environ.get("SRS_EASE_BONUS", "0.15")) # Added per "Remembered"
+SRS_EASE_PENALTY = float(os.environ.get("SRS_EASE_PENALTY", "0.2")) # Subtracted per "Forgot"
+SRS_RETIRE_GAP_SECONDS = int(os.environ.get("SRS_RETIRE_GAP_SECONDS", str(REMINDER_INTERVALS_SECONDS[-1])))
+SRS_LADDER_GAPS = [REMINDER_INTERVALS_SECONDS[0]] + [b - a for a, b in zip(REMINDER_INTERVALS_SECONDS, REMINDER_INTERVALS_SECONDS[1:])]
+SRS_RELEARN_STEP = 1 # Ladder step a forgotten item restarts from (the one-day gap)
+SRS_PARAMS = (SRS_INITIAL_EASE, SRS_EASE_BONUS, SRS_EASE_PENALTY, SRS_RETIRE_GAP_SECONDS, tuple(SRS_LADDER_GAPS))
+GRADE_REMEMBERED, GRADE_FORGOT, GRADE_UNANSWERED = "r", "f", "n"
+METRIC_REVIEW_ANSWERS = Metric("fibo_review_answers_total", "Reminder answers by grade.", "counter", ("grade",))
+METRIC_ITEMS_RETIRED = Metric("fibo_items_retired_total", "Items that finished their reminder schedule.", "counter")
+
+def srs_transition(ease: float, gap: float, step: int, grade: str) -> tuple[float, float | None, int]:
+    """State after one review: (ease, next gap in seconds or None once retired, next ladder step)."""
+    if grade == GRADE_FORGOT: return max(SRS_MIN_EASE, ease - SRS_EASE_PENALTY), SRS_LADDER_GAPS[SRS_RELEARN_STEP], SRS_RELEARN_STEP + 1
+    if step >= len(SRS_LADDER_GAPS): return ease, None, step
+    if grade == GRADE_REMEMBERED: ease += SRS_EASE_BONUS; gap = max(SRS_LADDER_GAPS[step], gap * ease)
+    else: gap = max(SRS_LADDER_GAPS[step], gap)
+    return ease, (gap if gap <= SRS_RETIRE_GAP_SECONDS else None), step + 1
+
+def review_state(item: dict) -> tuple[float, float | None, int, float | None]:
+    """(ease, gap, step, due timestamp) replayed from item['added'] and item['history']; gap/due are None once retired."""
+    ease, gap, step = SRS_INITIAL_EASE, SRS_LADDER_GAPS[0], 1; due = item['added'] + gap
+    for review_ts, grade in item['history']:
+        ease, gap, step = srs_transition(ease, gap, step, grade)
+        if gap is None: return ease, None, step, None
+        due = review_ts + gap
+    return ease, gap, step, due
+
+def unanswered_review_times(ease: float, gap: float | None, step: int, due: float | None) -> list[float]:
+    """Timestamps of the reminders still to come (the pending one first) if none of them gets an answer."""
+    review_times = []
+    while gap is not None:
+        review_times.append(due); ease, gap, step = srs_transition(ease, gap, step, GRADE_UNANSWERED)
+        if gap is not None: due += gap
+    return review_times
+
+class NumpyDeck:
+    """Review state of many items as parallel numpy arrays. Histories are replayed one position at a
+    time for the whole deck, so the Python-level loop runs per history length, not per item."""
+
+    def __init__(self, np, items: list[dict]):
+        self.np = np; size = len(items); histories = [item['history'] for item in items]; depth = max(map(len, histories), default=0)
+        grades = np.full((size, depth), "", dtype="<U1"); review_ts = np.zeros((size, depth))
+        for row, history in enumerate(histories):
+            if history: review_ts[row, :len(history)], grades[row, :len(history)] = zip(*history)
+        self.ladder = np.array(SRS_LADDER_GAPS, dtype=float)
+        self.ease = np.full(size, SRS_INITIAL_EASE); self.gap = np.full(size, self.ladder[0]); self.step = np.ones(size, dtype=int)
+        self.due = np.array([item['added'] for item in items], dtype=float) + self.gap; self.retired = np.zeros(size, dtype=bool)
+        for position in range(depth):
+            live = (grades[:, position] != "") & ~self.retired
+            self.advance(live, live & (grades[:, position] == GRADE_FORGOT), live & (grades[:, position] == GRADE_REMEMBERED))
+            self.due = np.where(live & ~self.retired, review_ts[:, position] + self.gap, self.due)
+
+    def advance(self, live, forgot, remembered) -> None:
+        """srs_transition for the `live` rows."""
+        np = self.np; last_step = len(self.ladder) - 1; floor = self.ladder[np.minimum(self.step, last_step)]
+        new_ease = np.where(forgot, np.maximum(SRS_MIN_EASE, self.ease - SRS_EASE_PENALTY), np.where(remembered, self.ease + SRS_EASE_BONUS, self.ease))
+        new_gap = np.where(forgot, self.ladder[SRS_RELEARN_STEP], np.maximum(floor, np.where(remembered, self.gap * new_ease, self.gap)))
+        self.retired = self.retired | (live & ~forgot & ((self.step > last_step) | (new_gap > SRS_RETIRE_GAP_SECONDS)))
+        self.ease, self.gap = np.where(live, new_ease, self.ease), np.where(live, new_gap, self.gap)
+        self.step = np.where(live, np.where(forgot, SRS_RELEARN_STEP + 1, self.step + 1), self.step)
+
+    def walk_unanswered(self) -> tuple:
+        """(reminders left per item, flat array of every remaining review timestamp) if nothing gets an answer. Consumes the state."""
+        np = self.np; reviews_left = np.zeros(len(self.due), dtype=int); review_times = []
+        pending = ~self.retired; no_grade = np.zeros(len(self.due), dtype=bool)
+        while pending.any():
+            reviews_left += pending; review_times.append(self.due[pending])
+            self.advance(pending, no_grade, no_grade); pending &= ~self.retired
+            self.due = np.where(pending, self.due + self.gap, self.due)
+        return reviews_left, (np.concatenate(review_times) if review_times else np.zeros(0))
+
+def _numpy_for_deck(item_count: int):
+    return _lazy_import("numpy", "NUMPY_AVAILABLE") if NUMPY_AVAILABLE and item_count else None
+
+def recompute_deck(items: dict) -> dict[str, tuple[float | None, int]]:
+    """item_id -> (due timestamp or None if retired, reviews left) for every scheduled item of a chat,
+    replayed from review histories. Vectorized over the deck with numpy when it is installed."""
+    item_ids = [item_id for item_id, item in items.items() if 'history' in item]
+    np = _numpy_for_deck(len(item_ids))
+    if np:
+        deck = NumpyDeck(np, [items[item_id] for item_id in item_ids]); dues = np.where(deck.retired, np.nan, deck.due).tolist()
+        reviews_left, _ = deck.walk_unanswered()
+        return {item_id: (None if math.isnan(due) else due, left) for item_id, due, left in zip(item_ids, dues, reviews_left.tolist())}
+    deck = {}
+    for item_id in item_ids:
+        ease, gap, step, due = review_state(items[item_id]); deck[item_id] = (due, len(unanswered_review_times(ease, gap, step, due)))
+    return deck
+
+def schedule_next_review(job_queue: JobQueue, chat_id: int, chat_data: dict, item_id: str, leveled_due: float | None = None):
+    """Schedules the item's next reminder from its review state, load-leveled within its tolerance
+    window (or at `leveled_due`, an earlier leveling result being restored); returns the Job that will
+    deliver it (the chat's digest job in digest mode), or None once the item retires."""
+    table = _get_item_table(chat_data); item = table['items'][item_id]
+    ease, gap, step, due = review_state(item)
+    if due is None: item.pop('srs_due', None); set_item_due(chat_data, item, None); METRIC_ITEMS_RETIRED.inc(); return None
+    item['srs_due'] = due # Unleveled, so reschedule_deck can tell whether the schedule is still current
+    due = max(leveled_due, time.time() + 60) if leveled_due is not None else level_due(table.get('due_days', {}), due, gap, chat_timezone(chat_data))
+    if digest_time(chat_data): set_item_due(chat_data, item, due); return get_digest_job(job_queue, chat_id, chat_data)
+    pack_source = item.get('pack_source'); release = quiet_release_time(chat_data, due)
+    if release is not None: # Delivered by the chat's batch job for that release, not by a job of its own
+        set_item_due(chat_data, item, release); METRIC_QUIET_DEFERRED.inc(); METRIC_REMINDERS_SCHEDULED.inc(source=pack_source or "user")
+        return hold_for_quiet_batch(job_queue, chat_id, release, gap, item_id, due)
+    send_at = book_send_slot(due, gap); set_item_due(chat_data, item, due)
+    message_id = item.get('message_id')
+    job_data = {'message_text': item['text'], 'item_id': item_id, 'original_message_id': message_id,
+                'learning_start_date': datetime.datetime.fromtimestamp(item['added'], chat_timezone(chat_data)).strftime("%Y-%m-%d"), 'is_pack_word': bool(pack_source),
+                'current_interval_index': step - 1, 'reviews_left': len(unanswered_review_times(ease, gap, step, due))}
+    job_data['send_slot'] = int(send_at)
+    if pack_source: job_data['pack_source'] = pack_source
+    reminder_job = job_queue.run_once(send_reminder, max(1.0, send_at - time.time()), chat_id=chat_id, data=job_data, name=reminder_job_name(chat_id, item_id))
+    track_item_job(chat_id, item_id, reminder_job); METRIC_REMINDERS_SCHEDULED.inc(source=pack_source or "user")
+    return reminder_job
+
+def reschedule_deck(job_queue: JobQueue, chat_id: int, chat_data: dict) -> int:
+    """Re-derives every item's pending reminder from its history in one batch (after the SRS settings
+    changed, or for items restored without jobs); returns how many reminders were moved, added or dropped.
+    An item whose SRS due didn't change keeps its leveled/smoothed/held job, or gets it back at its stored
+    due if it has none; digest chats have no item jobs, so only their dues are updated."""
+    table = _get_item_table(chat_data); changed = 0; digest = digest_time(chat_data)
+    for item_id, (due, _) in recompute_deck(table['items']).items():
+        item = table['items'][item_id]; pending = [] if digest else get_item_jobs(chat_id, item_id)
+        if due is None and item.get('due') is None and not pending: continue
+        same_due = due is not None and item.get('due') is not None and abs(item.get('srs_due', math.inf) - due) <= 60
+        if same_due and (digest or pending): continue
+        if pending: remove_item_jobs(chat_id, item_id)
+        schedule_next_review(job_queue, chat_id, chat_data, item_id, item['due'] if same_due else None); changed += 1
+    table['srs_params'] = SRS_PARAMS
+    return changed
+
+def ensure_deck_schedule(job_queue: JobQueue, chat_id: int, chat_data: dict) -> None:
+    """Batch-reschedules the chat once if its items were scheduled under different SRS settings."""
+    table = chat_data.get(ITEM_TABLE_KEY)
+    if table and table['items'] and table.get('srs_params', SRS_PARAMS) != SRS_PARAMS:
+        logger.info("SRS settings changed for chat %s; rescheduled %s items.", chat_id, reschedule_deck(job_queue, chat_id, chat_data), extra=log_fields("schedule", chat_id))
+
+# --- Per-Chat Serialization ---
+# Updates from different chats run concurrently, but everything touching one chat (its updates and
+# its pack scheduler jobs) runs one at a time in arrival order, so handlers can keep mutating
+# user_data/chat_data pack dicts across awaits without losing writes.
+_CHAT_LOCKS: dict[int, list] = {} # chat_id -> [asyncio.Lock, holders + waiters]; dropped when unused
+
+@contextlib.asynccontextmanager
+async def chat_serialized(chat_id: int | None):
+    if chat_id is None: yield; return
+    entry = _CHAT_LOCKS.setdefault(chat_id, [asyncio.Lock(), 0]); entry[1] += 1
+    try:
+        async with entry[0]: yield # asyncio.Lock wakes waiters FIFO, which keeps per-chat order
+    finally:
+        entry[1] -= 1
+        if not entry[1]: _CHAT_LOCKS.pop(chat_id, None)
+
+def update_chat_key(update: object) -> int | None:
+    if not isinstance(update, Update): return None
+    if update.effective_chat: return update.effective_chat.id
+    return update.effective_user.id if update.effective_user else None
+
+class PerChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Concurrent update processing with strict in-order processing within each chat.
+
+    An update takes its chat's turn before one of the max_concurrent_updates slots, so a burst from
+    one chat waits on its own lock instead of filling every slot while other chats queue behind it.
+    """
+
+    async def process_update(self, update: object, coroutine) -> None:
+        async with chat_serialized(update_chat_key(update)): await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if SLOW_UPDATE_PROFILE_ENABLED: await run_profiled("update", describe_update(update), coroutine)
+        else: await coroutine
+
+    async def initialize(self) -> None: pass
+
+    async def shutdown(self) -> None: pass
+
+def chat_serialized_job(callback):
+    """Wraps a job callback so it takes its chat's turn like an update would."""
+    async def run_serialized(context: ContextTypes.DEFAULT_TYPE) -> None:
+        async with chat_serialized(context.job.chat_id): await callback(context)
+    run_serialized.__name__ = callback.__name__
+    return run_serialized
+
+# --- Load Forecast ---
+# Reminders per day for one chat, from today until its last review: active items walk their
+# unanswered review ladder and pending pack words are activated at the pace each intensity modifier
+# allows, then follow the classic ladder. Every modifier asked about gets its own row of the same
+# pass, so a what-if costs no second scan. Vectorized with numpy when it is installed.
+FORECAST_PACK_KEYS = (USER_PACK_DATA_KEY, USER_LUX_PACK_DATA_KEY)
+
+def pack_words_per_day(intensity_modifier: float) -> int:
+    return max(1, round(MAX_PACK_WORDS_PER_DAY / intensity_modifier)) if intensity_modifier > 0 else MAX_PACK_WORDS_PER_DAY
+
+def _pending_pack_activations(user_data: dict, today_str: str) -> list[tuple[int, int]]:
+    """(pending words, words already activated today) per pack in progress; each pack has its own daily quota."""
+    activations = []
+    for pack_key in FORECAST_PACK_KEYS:
+        pack_info = user_data.get(pack_key)
+        if not pack_info or pack_info.get('status') != 'in_progress': continue
+        pending = sum(1 for word_status in pack_info.get('pack_words_status', []) if word_status.get('status') == 'pending')
+        if pending: activations.append((pending, pack_info.get('words_scheduled_today', 0) if pack_info.get('last_scheduled_date') == today_str else 0))
+    return activations
+
+def _summarize_forecast(intensity_modifier: float, daily_load: list[int], today: datetime.date) -> dict:
+    busy_days = [day for day, load in enumerate(daily_load) if load]
+    peak_day = max(range(len(daily_load)), key=daily_load.__getitem__) if busy_days else 0
+    return {'intensity_modifier': intensity_modifier, 'daily_load': daily_load,
+            'completion_date': today + datetime.timedelta(days=busy_days[-1] if busy_days else 0),
+            'peak_date': today + datetime.timedelta(days=peak_day), 'peak_load': daily_load[peak_day] if busy_days else 0}
+
+def forecast_review_load(chat_data: dict, user_data: dict, intensity_modifiers: tuple = (1.0,)) -> list[dict]:
+    """One forecast per intensity modifier: {'intensity_modifier', 'daily_load' (reminders per day, index 0 =
+    today), 'completion_date', 'peak_date', 'peak_load'}. Overdue reviews count for today."""
+    now = time.time(); tz = chat_timezone(chat_data); today = datetime.datetime.now(tz).date(); day_start = local_day_start(today, tz)
+    active_items = [item for item in chat_data.get(ITEM_TABLE_KEY, {}).get('items', {}).values() if 'history' in item]
+    packs = _pending_pack_activations(user_data, today.strftime("%Y-%m-%d"))
+    np = _numpy_for_deck(len(active_items) + len(packs))
+    if np:
+        _, review_times = NumpyDeck(np, active_items).walk_unanswered()
+        rows, days = [np.zeros(len(review_times), dtype=int)], [np.maximum(0, (review_times - day_start) // 86400).astype(int)]
+        ladder = np.array(REMINDER_INTERVALS_SECONDS, dtype=float)
+        for row, modifier in enumerate(intensity_modifiers):
+            per_day = pack_words_per_day(modifier)
+            for pending, activated_today in packs:
+                slot = np.arange(activated_today, activated_today + pending)
+                activation = now + (slot // per_day) * 86400 + (slot % per_day - activated_today * (slot < per_day)) * MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS
+                pack_days = ((activation[:, None] + ladder[None, :] - day_start) // 86400).astype(int).ravel()
+                rows.append(np.full(len(pack_days), row + 1)); days.append(pack_days)
+        rows, days = np.concatenate(rows), np.concatenate(days); length = int(days.max()) + 1 if len(days) else 1
+        grid = np.bincount(rows * length + days, minlength=(len(intensity_modifiers) + 1) * length).reshape(-1, length)
+        return [_summarize_forecast(modifier, (grid[0] + grid[row + 1]).tolist(), today) for row, modifier in enumerate(intensity_modifiers)]
+    item_days = [max(0, int((review_ts - day_start) // 86400)) for item in active_items for review_ts in unanswered_review_times(*review_state(item))]
+    forecasts = []
+    for modifier in intensity_modifiers:
+        per_day = pack_words_per_day(modifier); all_days = list(item_days)
+        for pending, activated_today in packs:
+            for slot in range(activated_today, activated_today + pending):
+                activation = now + (slot // per_day) * 86400 + (slot % per_day - (activated_today if slot < per_day else 0)) * MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS
+                all_days.extend(int((activation + offset - day_start) // 86400) for offset in REMINDER_INTERVALS_SECONDS)
+        daily_load = [0] * (max(all_days) + 1 if all_days else 1)
+        for day in all_days: daily_load[day] += 1
+        forecasts.append(_summarize_forecast(modifier, daily_load, today))
+    return forecasts
+
+
+# --- Load Leveling ---
+# Words added in a burst would otherwise hit the same days at every ladder step. Each reminder may
+# move up to LOAD_LEVELING_TOLERANCE of its gap either way (a 1-day gap by a few hours, a 20-day gap by
+# days) onto the day with the fewest pending reminders, from the chat's 'due_days' histogram. A new
+# pack word waits while the forecast of its first week already reaches PACK_DEFER_DAILY_REMINDERS.
+LOAD_LEVELING_TOLERANCE = float(os.environ.get("LOAD_LEVELING_TOLERANCE", "0.2")) # 0 = reminders fire exactly on schedule
+PACK_DEFER_DAILY_REMINDERS = int(os.environ.get("PACK_DEFER_DAILY_REMINDERS", str(INTENSITY_LEVELS[-2][0]))) # Above this a day is "Extreme"; 0 = never defer
+PACK_DEFER_LOOKAHEAD_SECONDS = 7 * 86400 # New word's reminders checked against the forecast
+METRIC_PACK_ACTIVATIONS_DEFERRED = Metric("fibo_pack_activations_deferred_total", "Pack word activations postponed by load leveling.", "counter", ("pack",))
+
+def level_due(due_days: dict, due: float, gap: float, tz: datetime.tzinfo | None = None) -> float:
+    """`due` moved within ±LOAD_LEVELING_TOLERANCE × gap onto the least loaded local day (ties: the nearest day)."""
+    slack = gap * LOAD_LEVELING_TOLERANCE; low, high = max(due - slack, time.time() + 60), due + slack
+    if low >= high: return due
+    due_day = local_day(due, tz); best, best_key = due, (due_days.get(due_day, 0), 0)
+    for day in range(local_day(low, tz), local_day(high, tz) + 1):
+        key = (due_days.get(day, 0), abs(day - due_day))
+        if key < best_key: best, best_key = min(max(due + (day - due_day) * 86400, low), high), key # Same time of day, kept inside the window
+    return best
+
+def pack_activation_deferred(chat_data: dict, pack_source: str, chat_id: int) -> bool:
+    """True if activating another pack word now would push a day of its first week over PACK_DEFER_DAILY_REMINDERS."""
+    if PACK_DEFER_DAILY_REMINDERS <= 0: return False
+    daily_load = forecast_review_load(chat_data, {})[0]['daily_load'] # Active items only; this word is what's being decided
+    new_word_days = {int(offset // 86400) for offset in REMINDER_INTERVALS_SECONDS if offset <= PACK_DEFER_LOOKAHEAD_SECONDS}
+    busiest = max((daily_load[day] for day in new_word_days if day < len(daily_load)), default=0)
+    if busiest < PACK_DEFER_DAILY_REMINDERS: return False
+    METRIC_PACK_ACTIVATIONS_DEFERRED.inc(pack=pack_source)
+    logger.info("Chat %s: deferring %s pack word, %s reminders already due on one of its first days.", chat_id, pack_source, busiest, extra=log_fields("pack_scheduler", chat_id))
+    return True
+
+# --- Send Smoothing ---
+# Leveling picks the day; this picks the second. Reminders of users who joined together (or were
+# rescheduled by one deploy) would otherwise fire in the same seconds. Every reminder books a slot in
+# a process-wide per-second budget of SEND_CAPACITY_PER_SECOND sends and is pushed to the first second
+# with room, at most min(SEND_JITTER_MAX_SECONDS, SEND_JITTER_GAP_FRACTION x gap) late, so the
+# 1-minute first reminder moves by seconds at most. Slots are given back when the job fires or is removed.
+SEND_CAPACITY_PER_SECOND = int(os.environ.get("SEND_CAPACITY_PER_SECOND", "25")) # Below Telegram's ~30 messages/s; 0 = no smoothing
+SEND_JITTER_MAX_SECONDS = int(os.environ.get("SEND_JITTER_MAX_SECONDS", "300"))
+SEND_JITTER_GAP_FRACTION = float(os.environ.get("SEND_JITTER_GAP_FRACTION", "0.05"))
+_SEND_SLOTS: dict[int, int] = {} # epoch second -> reminders booked in it
+METRIC_REMINDERS_SMOOTHED = Metric("fibo_reminders_smoothed_total", "Reminders moved to a later second because theirs was full.", "counter")
+METRIC_SEND_SMOOTHING_DELAY = Metric("fibo_send_smoothing_delay_seconds_total", "Total delay added by send smoothing.", "counter")
+
+def book_send_slot(due: float, gap: float) -> float:
+    """Fire time for a reminder due at `due`: the first second within its allowed jitter that is under
+    SEND_CAPACITY_PER_SECOND (the least booked one if all are full). The slot stays booked until released."""
+    if SEND_CAPACITY_PER_SECOND <= 0: return due
+    first = int(due); last = first + int(min(SEND_JITTER_MAX_SECONDS, gap * SEND_JITTER_GAP_FRACTION)); best = first
+    for second in range(first, last + 1):
+        booked = _SEND_SLOTS.get(second, 0)
+        if booked < SEND_CAPACITY_PER_SECOND: best = second; break
+        if booked < _SEND_SLOTS[best]: best = second
+    _SEND_SLOTS[best] = _SEND_SLOTS.get(best, 0) + 1
+    if best == first: return due
+    METRIC_REMINDERS_SMOOTHED.inc(); METRIC_SEND_SMOOTHING_DELAY.inc(best - due)
+    return float(best)
+
+def release_send_second(second: int | None) -> None:
+    if second is None or second not in _SEND_SLOTS: return
+    _SEND_SLOTS[second] -= 1
+    if not _SEND_SLOTS[second]: del _SEND_SLOTS[second]
+
+def release_send_slot(job) -> None:
+    """Gives back the slot booked for a reminder job (when it fired or was removed)."""
+    release_send_second((job.data or {}).pop('send_slot', None))
+
+def pack_scheduler_first_run() -> float:
+    """Seconds until a new pack scheduler job first runs, spread over one interval so the jobs of packs
+    started together don't tick in the same second forever after."""
+    return 5 + random.uniform(0, MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS / 2)
+
+# --- Daily Digest ---
+# Opt-in with /digest 8:30: the chat then has one run_daily job instead of one job per reminder. It
+# sends everything due by the end of the local day as one message, paged in place with DIGEST_PAGE_SIZE
+# items per page and a compact ✅/❌ row per item. Items keep their 'due' in the item table, so the SRS,
+# leveling (which now evens out digest sizes) and the dictionary still see them. Each chat's digest is
+# offset by up to SEND_JITTER_MAX_SECONDS past the chosen minute, so the same choice doesn't fire at once.
+DIGEST_JOB_PREFIX = "digest_"
+DIGEST_PAGE_SIZE = 8
+DIGEST_STATE_KEY = "digest_v1" # chat_data: {'number', 'page', 'entries': [[item_id, review number, text, grade or ""]]} of the last digest
+DIGEST_PREFIX = "📬 Daily digest"
+DIGEST_MARKS = {"": "•", GRADE_REMEMBERED: "✅", GRADE_FORGOT: "❌", "-": "⚪"} # "-" = superseded before it was answered
+METRIC_DIGESTS_SENT = Metric("fibo_digests_sent_total", "Daily digest messages sent.", "counter")
+_DIGEST_JOBS: dict[int, object] = {} # chat_id -> its daily digest Job
+
+def digest_time(chat_data: dict | None) -> list | None:
+    """[hour, minute] of the chat's daily digest, or None when reminders are sent one by one."""
+    return (chat_data or {}).get(LOCAL_TIME_KEY, {}).get('digest')
+
+def schedule_digest_job(job_queue: JobQueue, chat_id: int, chat_data: dict):
+    """(Re)creates the chat's daily digest job, or only removes it when digest mode is off; returns the job."""
+    old_job = _DIGEST_JOBS.pop(chat_id, None)
+    if old_job and not old_job.removed: old_job.schedule_removal()
+    at = digest_time(chat_data)
+    if not at: return None
+    seconds = (at[0] * 3600 + at[1] * 60 + chat_id % max(1, SEND_JITTER_MAX_SECONDS)) % 86400
+    tz = chat_timezone(chat_data)
+    _DIGEST_JOBS[chat_id] = job_queue.run_daily(chat_serialized_job(send_digest), datetime.time(seconds // 3600, seconds // 60 % 60, seconds % 60, tzinfo=tz), chat_id=chat_id, name=f"{DIGEST_JOB_PREFIX}{chat_id}")
+    return _DIGEST_JOBS[chat_id]
+
+def get_digest_job(job_queue: JobQueue, chat_id: int, chat_data: dict):
+    job = _DIGEST_JOBS.get(chat_id)
+    return job if job and not job.removed else schedule_digest_job(job_queue, chat_id, chat_data) # Gone after /terminate or a restart
+
+def render_digest_page(digest: dict) -> tuple[str, InlineKeyboardMarkup]:
+    entries = digest['entries']; pages = max(1, math.ceil(len(entries) / DIGEST_PAGE_SIZE)); page = digest['page'] = min(digest['page'], pages - 1)
+    first = page * DIGEST_PAGE_SIZE; shown = entries[first:first + DIGEST_PAGE_SIZE]; answered = sum(1 for entry in entries if entry[3])
+    lines = [f"{DIGEST_PREFIX}: {len(entries)} items, {answered} answered (page {page + 1}/{pages})"] + [f"{DIGEST_MARKS[entry[3]]} {entry[2]}" for entry in shown]
+    rows = [[InlineKeyboardButton(f"✅ {entry[2][:24]}", callback_data=f"{CALLBACK_DIGEST_ANSWER}{digest['number']}:{index}:{GRADE_REMEMBERED}"),
+             InlineKeyboardButton("❌", callback_data=f"{CALLBACK_DIGEST_ANSWER}{digest['number']}:{index}:{GRADE_FORGOT}")]
+            for index, entry in enumerate(shown, first) if not entry[3]]
+    nav = ([InlineKeyboardButton("◀️", callback_data=f"{CALLBACK_DIGEST_PAGE}{digest['number']}:{page - 1}")] if page else []) + \
+          ([InlineKeyboardButton("▶️", callback_data=f"{CALLBACK_DIGEST_PAGE}{digest['number']}:{page + 1}")] if page + 1 < pages else [])
+    return "\n".join(lines), InlineKeyboardMarkup(rows + ([nav] if nav else []))
+
+# --- Quiz ---
+# Multiple-choice questions about the chat's scheduled items. Items of a "phrase - translation" pack ask
+# for the meaning; every other item asks which option is on the user's list. Wrong options come from a
+# distractor index built once per pack when it is first used: answers grouped by (length, vowel count),
+# then length, then length band, then the whole pack, so a question is a few dict lookups and one small random sample. A
+# wrong answer counts as "Forgot"; a right one answers the item's pending reminder as "Remembered".
+QUIZ_PACK_FILES = {'b2plus': VOCABULARY_PACK_FILE, 'luxembourg': LUXEMBOURG_PACK_FILE}
+QUIZ_DEFAULT_PACK = 'b2plus' # Distractors for the user's own items
+QUIZ_CHOICES = 4
+QUIZ_STATE_KEY = "quiz_v1" # chat_data: {'number', 'item_id', 'options', 'answer'} of the open question
+METRIC_QUIZ_ANSWERS = Metric("fibo_quiz_answers_total", "Quiz answers by result.", "counter", ("result",))
+
+class QuizDistractorIndex:
+    """Candidate answers of one pack grouped by shape, coarsest group last."""
+
+    def __init__(self, answers: list[str], has_meanings: bool):
+        self.has_meanings = has_meanings; self.groups: list[dict] = [{}, {}, {}, {}]
+        for answer in answers:
+            for level, key in enumerate(self._keys(answer)): self.groups[level].setdefault(key, []).append(answer)
+
+    @staticmethod
+    def _keys(answer: str) -> tuple:
+        return (len(answer), count_vowels(answer)), len(answer), len(answer) // 4, None
+
+    def __len__(self) -> int: return len(self.groups[3].get(None, ()))
+
+    def sample(self, answer: str, count: int, exclude=lambda candidate: False) -> list[str]:
+        """Up to `count` answers shaped like `answer`, none equal to it or `exclude`d."""
+        picked: list[str] = []
+        for level, key in enumerate(self._keys(answer)):
+            group = self.groups[level].get(key, ())
+            for candidate in random.sample(group, min(len(group), count + 2)):
+                if candidate != answer and candidate not in picked and not exclude(candidate): picked.append(candidate)
+                if len(picked) == count: return picked
+        return picked
+
+_QUIZ_INDEXES: dict[str, QuizDistractorIndex] = {}
+
+def get_quiz_index(pack_source: str) -> QuizDistractorIndex:
+    if pack_source not in _QUIZ_INDEXES:
+        lines = load_pack_items(QUIZ_PACK_FILES[pack_source])
+        meanings = [line.partition(PHRASEBOOK_SEPARATOR)[2].strip() for line in lines]
+        has_meanings = bool(lines) and all(meanings)
+        _QUIZ_INDEXES[pack_source] = QuizDistractorIndex(meanings if has_meanings else lines, has_meanings)
+    return _QUIZ_INDEXES[pack_source]
+
+def build_quiz_question(chat_data: dict, chat_id: int) -> dict | None:
+    """A new question about a random scheduled item ({'item_id', 'question', 'options', 'answer'}), or None
+    if the chat has no scheduled items or no distractors are available."""
+    table = chat_data.get(ITEM_TABLE_KEY)
+    candidates = [item_id for item_id, item in table['items'].items() if item.get('due') is not None] if table else []
+    if not candidates: return None
+    item_id = random.choice(candidates); item = table['items'][item_id]
+    index = get_quiz_index(item.get('pack_source') if item.get('pack_source') in QUIZ_PACK_FILES else QUIZ_DEFAULT_PACK)
+    prompt, _, meaning = item['text'].partition(PHRASEBOOK_SEPARATOR)
+    if index.has_meanings and meaning.strip(): question, answer, exclude = f"What does “{prompt.strip()}” mean?", meaning.strip(), lambda candidate: False
+    else: question, answer, exclude = "Which of these is on your learning list?", item['text'], lambda candidate: item_id_for(chat_id, candidate) in table['items']
+    options = index.sample(answer, QUIZ_CHOICES - 1, exclude)
+    if not options: return None
+    options.insert(random.randrange(len(options) + 1), answer)
+    return {'item_id': item_id, 'question': question, 'options': options, 'answer': options.index(answer)}
+
+def record_quiz_answer(job_queue: JobQueue, chat_id: int, chat_data: dict, item_id: str, correct: bool):
+    """Feeds a quiz answer into the item's schedule; returns the rescheduled Job (None if retired), or
+    False if the answer changed nothing (right answer while no reminder awaits one)."""
+    item = get_learning_item(chat_data, item_id)
+    if not item or 'history' not in item: return False
+    history = item['history']; now = int(time.time())
+    if correct:
+        if not history or history[-1][1] != GRADE_UNANSWERED: return False
+        history[-1] = [now, GRADE_REMEMBERED]; METRIC_REVIEW_ANSWERS.inc(grade=GRADE_REMEMBERED)
+    else: history.append([now, GRADE_FORGOT]); METRIC_REVIEW_ANSWERS.inc(grade=GRADE_FORGOT)
+    ensure_deck_schedule(job_queue, chat_id, chat_data); remove_item_jobs(chat_id, item_id)
+    return schedule_next_review(job_queue, chat_id, chat_data, item_id)
 
 def generate_dictionary_text(
     chat_id: int,
@@ -293,7 +1319,7 @@ def generate_dictionary_text(
     intensity_name: str, 
     intensity_emoji: str, 
     page_number: int = 1, items_per_page: int = WORDS_PER_PAGE,
-    sort_key_func=None, sort_reverse=False
+    sort_key_func=None, sort_reverse=False, chat_data: dict | None = None
 ) -> tuple[str, list, int, int]:
     if not job_queue: return "Cannot access schedule.", [], 1, 1
     now_datetime = datetime.datetime.now()
@@ -311,12 +1337,23 @@ def generate_dictionary_text(
             status = f"{status_prefix}{status_detail}"
             if msg_txt not in active_display_map:
                 active_display_map[msg_txt] = {'reminders_left': 0, 'next_run_dt': job.next_run_time, 'job_data': job_data_item, 'status': status}
-            active_display_map[msg_txt]['reminders_left'] += 1
+            active_display_map[msg_txt]['reminders_left'] += job_data_item.get('reviews_left', 1) # Chained reviews carry their own estimate
             if job.next_run_time and \
                (active_display_map[msg_txt]['next_run_dt'] is None or \
                 job.next_run_time < active_display_map[msg_txt]['next_run_dt']):
                 active_display_map[msg_txt]['next_run_dt'] = job.next_run_time
-            processed_active_words.add(msg_txt)
+            processed_active_words.add(item_key(msg_txt))
+
+    digest = digest_time(chat_data); held = {item_id for _, batch_job in _QUIET_BATCHES.get(chat_id, {}).values() for item_id in batch_job.data['held']}
+    if digest or held: # Digest and held items have no job of their own; their next review is in the item table
+        for item_id, item in chat_data.get(ITEM_TABLE_KEY, {}).get('items', {}).items():
+            if item.get('due') is None or item['text'] in active_display_map or not (digest or item_id in held): continue
+            pack_source = item.get('pack_source'); ease, gap, step, due = review_state(item)
+            active_display_map[item['text']] = {'reminders_left': len(unanswered_review_times(ease, gap, step, due)), 'next_run_dt': datetime.datetime.fromtimestamp(item['due'], datetime.timezone.utc),
+                                                'job_data': {'message_text': item['text'], 'item_id': item_id, 'is_pack_word': bool(pack_source), 'pack_source': pack_source, 'current_interval_index': step - 1,
+                                                             'learning_start_date': datetime.datetime.fromtimestamp(item['added'], chat_timezone(chat_data)).strftime("%Y-%m-%d")},
+                                                'status': f"active_pack_{pack_source}" if pack_source else "active_user"}
+            processed_active_words.add(item_key(item['text']))
 
     for msg_txt, data in active_display_map.items():
         display_items_list.append((msg_txt, data['reminders_left'], data['next_run_dt'], data['job_data'], data['status'], None))
@@ -325,7 +1362,7 @@ def generate_dictionary_text(
     if user_b2_pack_info and 'pack_words_status' in user_b2_pack_info:
         for pack_word_obj in user_b2_pack_info['pack_words_status']:
             word, status, est_start_date = pack_word_obj['word'], pack_word_obj['status'], pack_word_obj.get('estimated_start_date')
-            if status == 'pending' and word not in processed_active_words:
+            if status == 'pending' and item_key(word) not in processed_active_words:
                 display_items_list.append((word, len(REMINDER_INTERVALS_SECONDS), None,
                                            {'is_pack_word': True, 'pack_source': 'b2plus', 'learning_start_date': est_start_date, 'message_text':word},
                                            'pending_pack_b2plus', est_start_date))
@@ -334,7 +1371,7 @@ def generate_dictionary_text(
     if user_lux_pack_info and 'pack_words_status' in user_lux_pack_info:
         for pack_word_obj in user_lux_pack_info['pack_words_status']:
             word, status, est_start_date = pack_word_obj['word'], pack_word_obj['status'], pack_word_obj.get('estimated_start_date')
-            if status == 'pending' and word not in processed_active_words:
+            if status == 'pending' and item_key(word) not in processed_active_words:
                 display_items_list.append((word, len(REMINDER_INTERVALS_SECONDS), None,
                                            {'is_pack_word': True, 'pack_source': 'luxembourg', 'learning_start_date': est_start_date, 'message_text':word},
                                            'pending_pack_luxembourg', est_start_date))
@@ -422,29 +1459,120 @@ def generate_dictionary_text(
     response_text += "\n_These are your learning items._"
     return response_text, display_items_list, current_page_for_display, total_pages_for_display
 
+def reminder_action_buttons(item_id: str, msg_txt: str) -> list:
+    buttons = [InlineKeyboardButton("🗑️ Delete", callback_data=f"{CALLBACK_DELETE_REQUEST}{item_id}")]
+    if get_clue_word(msg_txt):
+        buttons.append(InlineKeyboardButton("💡 Clue/Translate", callback_data=f"{CALLBACK_CLUE_REQUEST}{item_id}"))
+        if OPENAI_AVAILABLE: buttons.append(InlineKeyboardButton("✨ Explain (AI)", callback_data=f"{CALLBACK_AI_EXPLAIN}{item_id}"))
+    return buttons
+
+@profiled_job
 async def send_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
     job = context.job
     if not job or not job.data or 'message_text' not in job.data: logger.warning(f"Job {job.name or 'N/A'} missing data."); return
+    untrack_item_job(job); started = time.perf_counter()
     try:
         msg_txt, chat_id = job.data['message_text'], job.chat_id
         pack_source = job.data.get('pack_source')
-        buttons = []; delete_callback_data_content = f"{pack_source}:{msg_txt}" if pack_source else msg_txt
-        cb_del = f"{CALLBACK_DELETE_REQUEST}{delete_callback_data_content}"
-        if len(cb_del.encode()) <= 64: buttons.append(InlineKeyboardButton("🗑️ Delete", callback_data=cb_del))
-        word_for_clue_ai = msg_txt.split(' ')[0] if ' ' in msg_txt else msg_txt
-        word_for_clue_ai_clean = re.sub(r'[^\w\s\'-]', '', word_for_clue_ai).strip()
-        if word_for_clue_ai_clean:
-            cb_clue = f"{CALLBACK_CLUE_REQUEST}{word_for_clue_ai_clean}"
-            if len(cb_clue.encode()) <= 64: buttons.append(InlineKeyboardButton("💡 Clue/Translate", callback_data=cb_clue))
-            if OPENAI_AVAILABLE:
-                cb_ai = f"{CALLBACK_AI_EXPLAIN}{word_for_clue_ai_clean}"
-                if len(cb_ai.encode()) <= 64: buttons.append(InlineKeyboardButton("✨ Explain (AI)", callback_data=cb_ai))
-        kbd = InlineKeyboardMarkup([buttons]) if buttons else None
+        item_id = job.data.get('item_id') or register_learning_item(context.chat_data, chat_id, msg_txt, pack_source)
+        rows = [reminder_action_buttons(item_id, msg_txt)]
+        item = get_learning_item(context.chat_data, item_id)
+        if item is not None and 'history' in item: # Counted as unanswered until a button says otherwise
+            item['history'].append([int(time.time()), GRADE_UNANSWERED]); review_number = len(item['history'])
+            schedule_next_review(context.job_queue, chat_id, context.chat_data, item_id)
+            rows.insert(0, [InlineKeyboardButton("✅ Remembered", callback_data=f"{CALLBACK_REVIEW_REMEMBERED}{item_id}:{review_number}"),
+                            InlineKeyboardButton("❌ Forgot", callback_data=f"{CALLBACK_REVIEW_FORGOT}{item_id}:{review_number}")])
         reminder_prefix = "🔔 Reminder"
         if pack_source == 'b2plus': reminder_prefix += " (B2+)"
         elif pack_source == 'luxembourg': reminder_prefix += " (Luxembourg)"
-        await context.bot.send_message(chat_id=chat_id, text=f"{reminder_prefix}: {msg_txt}", reply_markup=kbd)
-    except Exception as e: logger.error(f"Err send_reminder job {job.name or 'N/A'}:{e}",exc_info=True)
+        await context.bot.send_message(chat_id=chat_id, text=f"{reminder_prefix}: {msg_txt}", reply_markup=InlineKeyboardMarkup(rows))
+        METRIC_REMINDERS_SENT.inc()
+    except Exception as e: logger.error(f"Err send_reminder job {job.name or 'N/A'}:{e}",exc_info=True); METRIC_REMINDERS_FAILED.inc()
+    finally: METRIC_REMINDER_SEND_SECONDS.observe(time.perf_counter() - started)
+
+@profiled_job
+async def send_quiet_batch(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """The batch job of one quiet-hours release: every reminder of the chat held for it, as one message."""
+    job = context.job; chat_id, held = job.chat_id, job.data['held']; now = int(time.time())
+    pop_quiet_batch(chat_id, job.data['quiet_release']); lines, rows = [], []
+    for item_id in list(held):
+        item = get_learning_item(context.chat_data, item_id)
+        if item is None or 'history' not in item: continue
+        item['history'].append([now, GRADE_UNANSWERED]); review_number = len(item['history'])
+        schedule_next_review(context.job_queue, chat_id, context.chat_data, item_id); lines.append(f"• {item['text']}")
+        if len(rows) < QUIET_BATCH_MAX_BUTTONS:
+            rows.append([InlineKeyboardButton(f"✅ {item['text'][:24]}", callback_data=f"{CALLBACK_REVIEW_REMEMBERED}{item_id}:{review_number}"),
+                         InlineKeyboardButton("❌", callback_data=f"{CALLBACK_REVIEW_FORGOT}{item_id}:{review_number}")])
+    held.clear()
+    if not lines: return
+    try:
+        await context.bot.send_message(chat_id=chat_id, text=f"{QUIET_BATCH_PREFIX} ({len(lines)}):\n" + "\n".join(lines), reply_markup=InlineKeyboardMarkup(rows))
+        METRIC_REMINDERS_SENT.inc(len(lines))
+        logger.info("Quiet-hours batch for chat %s: %s reminders in one message.", chat_id, len(lines), extra=log_fields("schedule", chat_id))
+    except Exception as e: logger.error(f"Err send_quiet_batch chat {chat_id}:{e}", exc_info=True); METRIC_REMINDERS_FAILED.inc(len(lines))
+
+async def send_digest(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """The chat's daily digest job: everything due by the end of the local day, as one paged message."""
+    chat_id, chat_data = context.job.chat_id, context.chat_data; table = chat_data.get(ITEM_TABLE_KEY)
+    tz = chat_timezone(chat_data); end_of_day = local_day_start(datetime.datetime.now(tz).date() + datetime.timedelta(days=1), tz); now = int(time.time())
+    ensure_deck_schedule(context.job_queue, chat_id, chat_data); entries = []
+    for item_id, item in (list(table['items'].items()) if table else ()):
+        if item.get('due') is None or item['due'] >= end_of_day or 'history' not in item: continue
+        item['history'].append([now, GRADE_UNANSWERED]); entries.append([item_id, len(item['history']), item['text'], ""])
+        schedule_next_review(context.job_queue, chat_id, chat_data, item_id)
+    if not entries: return
+    digest = chat_data[DIGEST_STATE_KEY] = {'number': chat_data.get(DIGEST_STATE_KEY, {}).get('number', 0) + 1, 'page': 0, 'entries': entries}
+    text, keyboard = render_digest_page(digest)
+    try:
+        await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard)
+        METRIC_DIGESTS_SENT.inc(); METRIC_REMINDERS_SENT.inc(len(entries))
+        logger.info("Digest for chat %s: %s reminders in one message.", chat_id, len(entries), extra=log_fields("schedule", chat_id))
+    except Exception as e: logger.error(f"Err send_digest chat {chat_id}:{e}", exc_info=True); METRIC_REMINDERS_FAILED.inc(len(entries))
+
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/digest 8:30 switches the chat to one daily message with everything due that day; /digest off."""
+    chat_id = update.effective_chat.id; settings = context.chat_data.setdefault(LOCAL_TIME_KEY, {'tz': None, 'quiet': None})
+    at = re.fullmatch(r"(\d{1,2})(?::(\d{2}))?", context.args[0]) if context.args else None
+    table = context.chat_data.get(ITEM_TABLE_KEY, {'items': {}})
+    if context.args and context.args[0].lower() == "off" and settings.get('digest'):
+        settings['digest'] = None; schedule_digest_job(context.job_queue, chat_id, context.chat_data)
+        for item_id, item in table['items'].items():
+            if item.get('due') is not None: schedule_next_review(context.job_queue, chat_id, context.chat_data, item_id)
+        logger.info("Digest mode off for chat %s.", chat_id, extra=log_fields("schedule", chat_id))
+    elif at and int(at[1]) < 24 and int(at[2] or 0) < 60:
+        settings['digest'] = [int(at[1]), int(at[2] or 0)]; schedule_digest_job(context.job_queue, chat_id, context.chat_data)
+        for item_id in table['items']: remove_item_jobs(chat_id, item_id) # Their 'due' stays; the digest picks them up
+        logger.info("Digest mode at %s for chat %s.", settings['digest'], chat_id, extra=log_fields("schedule", chat_id))
+    elif context.args and context.args[0].lower() != "off": await update.message.reply_text("Use /digest 8:30 (local time) or /digest off."); return
+    if not settings.get('digest'): await update.message.reply_text("🔔 Reminders are sent one by one. Use /digest 8:30 to get them all in one daily message."); return
+    await update.message.reply_text(f"📬 Daily digest at {settings['digest'][0]:02d}:{settings['digest'][1]:02d} ({settings['tz'] or DEFAULT_TIMEZONE}): "
+                                    "one message with everything due that day. /digest off to go back to single reminders.")
+
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/timezone [Area/City] shows or sets the zone used for quiet hours and for "today"."""
+    settings = context.chat_data.setdefault(LOCAL_TIME_KEY, {'tz': None, 'quiet': None})
+    if context.args:
+        try: zoneinfo.ZoneInfo(context.args[0])
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            await update.message.reply_text(f"Unknown time zone '{context.args[0]}'. Use a name like Europe/Luxembourg or America/New_York."); return
+        settings['tz'] = context.args[0]; apply_quiet_hours(context.job_queue, update.effective_chat.id, context.chat_data)
+        if digest_time(context.chat_data): schedule_digest_job(context.job_queue, update.effective_chat.id, context.chat_data)
+    await update.message.reply_text(f"🕒 Time zone: {settings['tz'] or DEFAULT_TIMEZONE} (it's {local_now(context.chat_data):%H:%M} there). Change it with /timezone Area/City.")
+
+async def quiet_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/quiet 22-8 holds reminders between those local hours and sends them together at the end; /quiet off."""
+    chat_id = update.effective_chat.id; settings = context.chat_data.setdefault(LOCAL_TIME_KEY, {'tz': None, 'quiet': None})
+    window = re.fullmatch(r"(\d{1,2})-(\d{1,2})", context.args[0]) if context.args else None
+    if context.args and context.args[0].lower() == "off":
+        settings['quiet'] = None; moved = apply_quiet_hours(context.job_queue, chat_id, context.chat_data)
+        logger.info("Quiet hours off for chat %s; %s held reminders back at their due time.", chat_id, moved, extra=log_fields("schedule", chat_id))
+    elif window and int(window[1]) < 24 and int(window[2]) < 24 and window[1] != window[2]:
+        settings['quiet'] = [int(window[1]), int(window[2])]
+        moved = apply_quiet_hours(context.job_queue, chat_id, context.chat_data)
+        logger.info("Quiet hours %s for chat %s; %s reminders held.", settings['quiet'], chat_id, moved, extra=log_fields("schedule", chat_id))
+    elif context.args: await update.message.reply_text("Use /quiet 22-8 (local hours, start-end) or /quiet off."); return
+    if not settings['quiet']: await update.message.reply_text("🌙 Quiet hours are off. Set them with /quiet 22-8 (local hours)."); return
+    await update.message.reply_text(f"🌙 Quiet hours: {settings['quiet'][0]}:00–{settings['quiet'][1]}:00 ({settings['tz'] or DEFAULT_TIMEZONE}). Reminders due then arrive together when they end.")
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
@@ -463,7 +1591,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
     random_quiz_text = (
         f"- **`{RANDOM_WORD_BUTTON_TEXT}`:** Get a random word from your active learning list.\n"
-        f"- **`{RUN_QUIZ_BUTTON_TEXT}`:** (Coming Soon!) Test your knowledge.\n"
+        f"- **`{RUN_QUIZ_BUTTON_TEXT}`:** Multiple-choice questions about your scheduled items. Wrong answers bring the item back tomorrow; right ones count as '✅ Remembered' for its latest reminder.\n"
     )
     intensity_help = "- **Intensity Setting:** (In `Learning Dictionary`) Adjust how many reminders you get. Lower intensity is often better for forming habits.\n"
     help_text = (
@@ -473,7 +1601,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "**How it works:**\n"
         "1. **Send Word/Phrase:** Type any English word/phrase you want to learn.\n"
         "2. **Reminders:** I'll schedule reminders (e.g., 1 min, 1 day, 2 days...). \n"
-        "3. **Recall:** Actively recall meaning on reminder.\n\n"
+        "3. **Recall:** Actively recall meaning on reminder, then tap '✅ Remembered' or '❌ Forgot'. Remembered words come back less and less often and retire early; forgotten ones come back tomorrow.\n\n"
         "**Features:**\n"
         f"- **`{LEARNING_DICT_BUTTON_TEXT}`:** View paginated list of active AND planned items. Also includes options to Terminate, Export, or check Intensity.\n"
         f"{packs_info_text}"
@@ -483,6 +1611,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "- **Clue & Translate:** '💡 Clue/Translate' for phonetic hint & translations.\n"
         f"{ai_text}"
         "- **Sort Dictionary:** '🔃 Sort (Ease)' button to sort your learning list by a heuristic for pronunciation ease (length, then vowel count).\n"
+        "- **Quiet Hours:** /timezone Europe/Luxembourg sets your time zone; /quiet 22-8 holds reminders overnight and sends them together in the morning (/quiet off).\n"
+        "- **Daily Digest:** /digest 8:30 gets you one message a day with everything due, paged, with ✅/❌ per item (/digest off).\n"
         "**Tips:** Add items promptly. Keep phrases short for easier recall.\n\n"
         "Happy learning! 🚀 /start" )
     await update.message.reply_text(help_text, reply_markup=REPLY_KEYBOARD, parse_mode='Markdown')
@@ -496,16 +1626,9 @@ async def show_dictionary_command_wrapper(update: Update, context: ContextTypes.
     chat_specific_settings = context.chat_data
     user_specific_data = context.user_data
     
-    daily_reminders_count = 0
-    if context.job_queue:
-        today = datetime.date.today()
-        for job in context.job_queue.jobs():
-            if job.chat_id == chat_id and job.next_run_time:
-                job_next_run_date = job.next_run_time.astimezone(datetime.timezone.utc).date()
-                if job_next_run_date == today:
-                    daily_reminders_count += 1
+    daily_reminders_count = count_daily_reminders(context.job_queue, chat_id, context.chat_data)
     intensity_name, intensity_emoji = get_learning_intensity(daily_reminders_count)
-    logger.info(f"Chat {chat_id}: Daily reminders = {daily_reminders_count}, Intensity = {intensity_name} {intensity_emoji}")
+    logger.info("Chat %s: Daily reminders = %s, Intensity = %s %s", chat_id, daily_reminders_count, intensity_name, intensity_emoji, extra=log_fields("dictionary", chat_id))
 
     if sort_key_func is not None:
         chat_specific_settings['dict_sort_key_name'] = sort_type_str
@@ -522,7 +1645,7 @@ async def show_dictionary_command_wrapper(update: Update, context: ContextTypes.
         chat_id, user_specific_data, context.job_queue,
         intensity_name, intensity_emoji, 
         page_number=page_number, items_per_page=WORDS_PER_PAGE,
-        sort_key_func=sort_key_func, sort_reverse=sort_reverse
+        sort_key_func=sort_key_func, sort_reverse=sort_reverse, chat_data=context.chat_data
     )
     chat_specific_settings['all_dict_items_for_export'] = all_items_for_export
 
@@ -561,58 +1684,48 @@ async def show_dictionary_command_wrapper(update: Update, context: ContextTypes.
         await update.message.reply_text("Dictionary Options:", reply_markup=keyboard) 
         
     chat_specific_settings['dict_current_page'] = current_page_displayed
-    logger.info(f"Showed dict chat {chat_id}, page {current_page_displayed}/{total_pages}, sort: {sort_type_str}")
+    logger.info("Showed dict chat %s, page %s/%s, sort: %s", chat_id, current_page_displayed, total_pages, sort_type_str, extra=log_fields("dictionary", chat_id))
 
 async def schedule_reminders_for_word(
     context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_message: str,
     original_message_id: int = None, is_pack_word: bool = False, pack_source_id: str = None
     ):
-    logger.info(f"Internal scheduling for: '{user_message}' for chat {chat_id}, pack_word: {is_pack_word}, source: {pack_source_id}")
     if not context.job_queue: logger.warning(f"No JobQueue for chat {chat_id}."); return False
-    active_jobs_for_word = sum(1 for j in context.job_queue.jobs() if
-                               j and j.chat_id == chat_id and
-                               j.data and j.data.get('message_text') == user_message
-                               and not j.removed)
-    if active_jobs_for_word > 0:
-        logger.info(f"Word/phrase '{user_message}' already has {active_jobs_for_word} active reminders.")
+    item_id = register_learning_item(context.chat_data, chat_id, user_message, pack_source_id if is_pack_word else None)
+    logger.info("Internal scheduling for: '%s' for chat %s, pack_word: %s, source: %s", user_message, chat_id, is_pack_word, pack_source_id, extra=log_fields("schedule", chat_id, item_id))
+    item = get_learning_item(context.chat_data, item_id)
+    if item.get('due') is not None or get_item_jobs(chat_id, item_id): # Same key already scheduled (also in digest mode, which has no item jobs)
+        logger.info("Word/phrase '%s' is already scheduled as '%s'.", user_message, item['text'], extra=log_fields("schedule", chat_id, item_id))
         if is_pack_word and pack_source_id:
             user_data_for_this_user = context.user_data; target_pack_data_key = None
             if pack_source_id == 'b2plus': target_pack_data_key = USER_PACK_DATA_KEY
             elif pack_source_id == 'luxembourg': target_pack_data_key = USER_LUX_PACK_DATA_KEY
             if target_pack_data_key and target_pack_data_key in user_data_for_this_user:
                 pack_status_list = user_data_for_this_user.get(target_pack_data_key, {}).get('pack_words_status', [])
-                for item in pack_status_list:
-                    if item.get('word') == user_message and item.get('status') != 'active':
-                        item['status'] = 'active'; item['actual_start_date'] = datetime.datetime.now().strftime("%Y-%m-%d")
-                        logger.info(f"Updated status for pack item '{user_message}' from pack '{pack_source_id}' to 'active'.")
+                for pack_entry in pack_status_list:
+                    if pack_entry.get('word') == user_message and pack_entry.get('status') != 'active':
+                        pack_entry['status'] = 'active'; pack_entry['actual_start_date'] = local_now(context.chat_data).strftime("%Y-%m-%d")
+                        logger.info("Updated status for pack item '%s' from pack '%s' to 'active'.", user_message, pack_source_id, extra=log_fields("schedule", chat_id, item_id))
                         break
         return False
-    learning_start_date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-    job_data = {'message_text': user_message, 'original_message_id': original_message_id,
-                'learning_start_date': learning_start_date_str, 'is_pack_word': is_pack_word}
-    if is_pack_word and pack_source_id: job_data['pack_source'] = pack_source_id
-    scheduled_count = 0; safe_msg_base = re.sub(r'\W+','_',user_message)[:20]
-    for i, interval_seconds in enumerate(REMINDER_INTERVALS_SECONDS):
-        msg_id_part = original_message_id if original_message_id else f"pack_{hash(user_message) & 0xffffffff}"
-        job_name = f"rem_{chat_id}_{msg_id_part}_{safe_msg_base}_{i}"
-        current_job_data_for_interval = job_data.copy(); current_job_data_for_interval['current_interval_index'] = i
-        context.job_queue.run_once(send_reminder, datetime.timedelta(seconds=interval_seconds),
-                                   chat_id=chat_id, data=current_job_data_for_interval, name=job_name)
-        scheduled_count += 1
-    if scheduled_count > 0: logger.info(f"Scheduled {scheduled_count} for '{user_message}'."); return True
+    ensure_deck_schedule(context.job_queue, chat_id, context.chat_data)
+    item.update(added=time.time(), history=[], message_id=original_message_id) # (Re)starts the item's review schedule
+    if schedule_next_review(context.job_queue, chat_id, context.chat_data, item_id): logger.info("Scheduled first review of '%s'.", user_message, extra=log_fields("schedule", chat_id, item_id)); return True
     else: logger.warning(f"No reminders scheduled for '{user_message}'."); return False
 
 async def handle_user_message_for_scheduling(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id,user_msg,msg_id = update.effective_chat.id,update.message.text.strip(),update.message.message_id
     if not user_msg: logger.info(f"Empty msg from {chat_id}."); return
-    logger.info(f"User added: '{user_msg}' from {update.effective_user.username} in {chat_id}")
+    logger.info("User added: '%s' from %s in %s", user_msg, update.effective_user.username, chat_id, extra=log_fields("schedule", chat_id))
     success = await schedule_reminders_for_word(context, chat_id, user_msg, original_message_id=msg_id, is_pack_word=False, pack_source_id=None)
     if success:
         first_min = int(REMINDER_INTERVALS_SECONDS[0]/60) if REMINDER_INTERVALS_SECONDS else 0
         first_txt = f"First in ~{first_min} min." if first_min > 0 else "First scheduled."
-        await update.message.reply_text(f"✅ Added '{user_msg}'!\n{first_txt} Total {len(REMINDER_INTERVALS_SECONDS)}.", reply_markup=REPLY_KEYBOARD)
+        if digest_time(context.chat_data): first_txt = "First in your next daily digest."
+        await update.message.reply_text(f"✅ Added '{user_msg}'!\n{first_txt} Up to {len(REMINDER_INTERVALS_SECONDS)} reminders, fewer if you tap ✅ Remembered.", reply_markup=REPLY_KEYBOARD)
     else: await update.message.reply_text(f"ℹ️ '{user_msg}' might already be in your dictionary or an error occurred.", reply_markup=REPLY_KEYBOARD)
 
+@profiled_job
 async def process_curated_pack_for_user(context: ContextTypes.DEFAULT_TYPE) -> None: # B2+
     job = context.job; chat_id = job.chat_id; user_id = job.user_id
     user_data_for_chat = context.user_data
@@ -626,17 +1739,18 @@ async def process_curated_pack_for_user(context: ContextTypes.DEFAULT_TYPE) -> N
 
     pack_data = user_data_for_chat[USER_PACK_DATA_KEY]
     pack_words_status_list = pack_data.get('pack_words_status', [])
-    today_str = datetime.datetime.now().strftime("%Y-%m-%d")
+    today_str = local_now(context.chat_data).strftime("%Y-%m-%d")
     if pack_data.get("last_scheduled_date") != today_str: pack_data["words_scheduled_today"] = 0; pack_data["last_scheduled_date"] = today_str
     
     if pack_data.get("words_scheduled_today", 0) >= effective_max_pack_words_today: 
-        logger.info(f"User {user_id} (chat {chat_id}): Max B2+ pack words ({effective_max_pack_words_today} effective) for today due to intensity modifier {user_intensity_modifier}.")
+        logger.info("User %s (chat %s): Max B2+ pack words (%s effective) for today due to intensity modifier %s.", user_id, chat_id, effective_max_pack_words_today, user_intensity_modifier, extra=log_fields("pack_scheduler", chat_id))
         return
         
     current_time = datetime.datetime.now().timestamp()
     if pack_data.get("last_pack_word_scheduled_time", 0.0) > 0.0 and \
        (current_time - pack_data["last_pack_word_scheduled_time"]) < MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS:
-        logger.info(f"User {user_id} (chat {chat_id}): Not enough delay since last B2+ pack word."); return
+        logger.info("User %s (chat %s): Not enough delay since last B2+ pack word.", user_id, chat_id, extra=log_fields("pack_scheduler", chat_id)); return
+    if pack_activation_deferred(context.chat_data, 'b2plus', chat_id): return
     word_to_schedule_info = None
     for word_status_obj in pack_words_status_list:
         if word_status_obj.get('status') == 'pending': word_to_schedule_info = word_status_obj; break
@@ -647,10 +1761,11 @@ async def process_curated_pack_for_user(context: ContextTypes.DEFAULT_TYPE) -> N
             pack_data['status'] = 'completed'
         job.schedule_removal(); return
     word_to_schedule = word_to_schedule_info['word']
-    logger.info(f"User {user_id} (chat {chat_id}): Attempting to activate B2+ pack word '{word_to_schedule}'.")
+    logger.info("User %s (chat %s): Attempting to activate B2+ pack word '%s'.", user_id, chat_id, word_to_schedule, extra=log_fields("pack_scheduler", chat_id))
     newly_scheduled_jobs = await schedule_reminders_for_word(context, chat_id, word_to_schedule, is_pack_word=True, pack_source_id='b2plus')
     if newly_scheduled_jobs :
-        word_to_schedule_info['status'] = 'active'; word_to_schedule_info['actual_start_date'] = datetime.datetime.now().strftime("%Y-%m-%d")
+        word_to_schedule_info['status'] = 'active'; word_to_schedule_info['actual_start_date'] = local_now(context.chat_data).strftime("%Y-%m-%d")
+        METRIC_PACK_WORDS_ACTIVATED.inc(pack='b2plus')
         pack_data["words_scheduled_today"] = pack_data.get("words_scheduled_today", 0) + 1
         pack_data["last_pack_word_scheduled_time"] = current_time
         num_active_or_completed = sum(1 for w in pack_words_status_list if w.get('status') != 'pending' and w.get('status') != 'cancelled_by_user')
@@ -662,7 +1777,7 @@ async def process_curated_pack_for_user(context: ContextTypes.DEFAULT_TYPE) -> N
 async def add_curated_words_command(update: Update, context: ContextTypes.DEFAULT_TYPE, called_from_callback: bool = False) -> None: # B2+
     chat_id = update.effective_chat.id; user_id = update.effective_user.id
     user_data_for_chat = context.user_data
-    if not CURATED_VOCABULARY_PACK:
+    if not load_pack_items(VOCABULARY_PACK_FILE):
         await context.bot.send_message(chat_id, "B2+ Curated pack unavailable.", reply_markup=REPLY_KEYBOARD if not called_from_callback else None)
         return
     if USER_PACK_DATA_KEY in user_data_for_chat:
@@ -680,8 +1795,8 @@ async def add_curated_words_command(update: Update, context: ContextTypes.DEFAUL
         effective_max_daily_for_new_pack = max(1, round(MAX_PACK_WORDS_PER_DAY / user_intensity_modifier))
 
     pack_words_status_list = []
-    current_est_date = datetime.date.today(); words_for_curr_date = 0
-    for i,word in enumerate(CURATED_VOCABULARY_PACK):
+    current_est_date = local_now(context.chat_data).date(); words_for_curr_date = 0
+    for i,word in enumerate(load_pack_items(VOCABULARY_PACK_FILE)):
         if words_for_curr_date >= effective_max_daily_for_new_pack: 
             current_est_date+=datetime.timedelta(days=1); words_for_curr_date=0
         pack_words_status_list.append({'word':word,'status':'pending','estimated_start_date':current_est_date.strftime("%Y-%m-%d"),'actual_start_date':None})
@@ -689,9 +1804,10 @@ async def add_curated_words_command(update: Update, context: ContextTypes.DEFAUL
     user_data_for_chat[USER_PACK_DATA_KEY] = {"pack_words_status":pack_words_status_list,"words_scheduled_today":0,"last_scheduled_date":"","last_pack_word_scheduled_time":0.0,"status":"in_progress"}
     job_name = f"{PACK_SCHEDULER_JOB_NAME_PREFIX}{chat_id}"
     for job_item in context.job_queue.get_jobs_by_name(job_name): job_item.schedule_removal()
-    context.job_queue.run_repeating(process_curated_pack_for_user, interval=MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS/2, first=5, chat_id=chat_id, user_id=user_id, name=job_name)
+    context.job_queue.run_repeating(chat_serialized_job(process_curated_pack_for_user), interval=MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS/2, first=pack_scheduler_first_run(), chat_id=chat_id, user_id=user_id, name=job_name)
+    METRIC_PACK_ACTIVATIONS.inc(pack='b2plus')
     
-    total_words = len(CURATED_VOCABULARY_PACK)
+    total_words = len(load_pack_items(VOCABULARY_PACK_FILE))
     days_intro = math.ceil(total_words / effective_max_daily_for_new_pack)
     await context.bot.send_message(chat_id, f"Great! B2+ Pack ({total_words} words) added. Up to {effective_max_daily_for_new_pack} will be activated daily based on your intensity setting. ~{days_intro} days for all to activate. Check '📚 Learning Dictionary'!", reply_markup=REPLY_KEYBOARD if not called_from_callback else None)
     logger.info(f"B2+ Curated pack for user {user_id} (chat {chat_id}). Job '{job_name}' on.")
@@ -710,6 +1826,7 @@ async def add_curated_words_command(update: Update, context: ContextTypes.DEFAUL
     context.job = original_job
     logger.info(f"Initial B2+ pack proc for user {user_id} (chat {chat_id}) done.")
 
+@profiled_job
 async def process_luxembourg_pack_for_user(context: ContextTypes.DEFAULT_TYPE) -> None:
     job = context.job; chat_id = job.chat_id; user_id = job.user_id
     user_data_for_chat = context.user_data
@@ -723,17 +1840,18 @@ async def process_luxembourg_pack_for_user(context: ContextTypes.DEFAULT_TYPE) -
 
     pack_data = user_data_for_chat[USER_LUX_PACK_DATA_KEY]
     pack_words_status_list = pack_data.get('pack_words_status', [])
-    today_str = datetime.datetime.now().strftime("%Y-%m-%d")
+    today_str = local_now(context.chat_data).strftime("%Y-%m-%d")
     if pack_data.get("last_scheduled_date") != today_str: pack_data["words_scheduled_today"] = 0; pack_data["last_scheduled_date"] = today_str
     
     if pack_data.get("words_scheduled_today", 0) >= effective_max_pack_words_today: 
-        logger.info(f"User {user_id} (chat {chat_id}): Max Luxembourg pack items ({effective_max_pack_words_today} effective) for today due to intensity modifier {user_intensity_modifier}.")
+        logger.info("User %s (chat %s): Max Luxembourg pack items (%s effective) for today due to intensity modifier %s.", user_id, chat_id, effective_max_pack_words_today, user_intensity_modifier, extra=log_fields("pack_scheduler", chat_id))
         return
         
     current_time = datetime.datetime.now().timestamp()
     if pack_data.get("last_pack_word_scheduled_time", 0.0) > 0.0 and \
        (current_time - pack_data["last_pack_word_scheduled_time"]) < MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS:
-        logger.info(f"User {user_id} (chat {chat_id}): Not enough delay since last Luxembourg pack item."); return
+        logger.info("User %s (chat %s): Not enough delay since last Luxembourg pack item.", user_id, chat_id, extra=log_fields("pack_scheduler", chat_id)); return
+    if pack_activation_deferred(context.chat_data, 'luxembourg', chat_id): return
     word_to_schedule_info = None
     for word_status_obj in pack_words_status_list:
         if word_status_obj.get('status') == 'pending': word_to_schedule_info = word_status_obj; break
@@ -744,10 +1862,11 @@ async def process_luxembourg_pack_for_user(context: ContextTypes.DEFAULT_TYPE) -
             pack_data['status'] = 'completed'
         job.schedule_removal(); return
     phrase_to_schedule = word_to_schedule_info['word']
-    logger.info(f"User {user_id} (chat {chat_id}): Attempting to activate Luxembourg pack item '{phrase_to_schedule}'.")
+    logger.info("User %s (chat %s): Attempting to activate Luxembourg pack item '%s'.", user_id, chat_id, phrase_to_schedule, extra=log_fields("pack_scheduler", chat_id))
     newly_scheduled_jobs = await schedule_reminders_for_word(context, chat_id, phrase_to_schedule, is_pack_word=True, pack_source_id='luxembourg')
     if newly_scheduled_jobs :
-        word_to_schedule_info['status'] = 'active'; word_to_schedule_info['actual_start_date'] = datetime.datetime.now().strftime("%Y-%m-%d")
+        word_to_schedule_info['status'] = 'active'; word_to_schedule_info['actual_start_date'] = local_now(context.chat_data).strftime("%Y-%m-%d")
+        METRIC_PACK_WORDS_ACTIVATED.inc(pack='luxembourg')
         pack_data["words_scheduled_today"] = pack_data.get("words_scheduled_today", 0) + 1
         pack_data["last_pack_word_scheduled_time"] = current_time
         num_active_or_completed = sum(1 for w in pack_words_status_list if w.get('status') != 'pending' and w.get('status') != 'cancelled_by_user')
@@ -759,7 +1878,7 @@ async def process_luxembourg_pack_for_user(context: ContextTypes.DEFAULT_TYPE) -
 async def add_luxembourg_pack_command(update: Update, context: ContextTypes.DEFAULT_TYPE, called_from_callback: bool = False) -> None:
     chat_id = update.effective_chat.id; user_id = update.effective_user.id
     user_data_for_chat = context.user_data
-    if not CURATED_LUXEMBOURG_PACK:
+    if not load_pack_items(LUXEMBOURG_PACK_FILE):
         await context.bot.send_message(chat_id, "The Luxembourg Phrases pack is currently unavailable.", reply_markup=REPLY_KEYBOARD if not called_from_callback else None)
         return
     if USER_LUX_PACK_DATA_KEY in user_data_for_chat:
@@ -777,8 +1896,8 @@ async def add_luxembourg_pack_command(update: Update, context: ContextTypes.DEFA
         effective_max_daily_for_new_pack = max(1, round(MAX_PACK_WORDS_PER_DAY / user_intensity_modifier))
 
     pack_words_status_list = []
-    current_est_date = datetime.date.today(); words_for_curr_date = 0
-    for i, phrase in enumerate(CURATED_LUXEMBOURG_PACK):
+    current_est_date = local_now(context.chat_data).date(); words_for_curr_date = 0
+    for i, phrase in enumerate(load_pack_items(LUXEMBOURG_PACK_FILE)):
         if words_for_curr_date >= effective_max_daily_for_new_pack: 
             current_est_date += datetime.timedelta(days=1); words_for_curr_date = 0
         pack_words_status_list.append({'word': phrase, 'status': 'pending', 'estimated_start_date': current_est_date.strftime("%Y-%m-%d"), 'actual_start_date': None})
@@ -786,9 +1905,10 @@ async def add_luxembourg_pack_command(update: Update, context: ContextTypes.DEFA
     user_data_for_chat[USER_LUX_PACK_DATA_KEY] = {"pack_words_status": pack_words_status_list, "words_scheduled_today": 0, "last_scheduled_date": "", "last_pack_word_scheduled_time": 0.0, "status": "in_progress"}
     job_name = f"{LUX_PACK_SCHEDULER_JOB_NAME_PREFIX}{chat_id}"
     for job_item in context.job_queue.get_jobs_by_name(job_name): job_item.schedule_removal()
-    context.job_queue.run_repeating(process_luxembourg_pack_for_user, interval=MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS / 2, first=5, chat_id=chat_id, user_id=user_id, name=job_name)
+    context.job_queue.run_repeating(chat_serialized_job(process_luxembourg_pack_for_user), interval=MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS / 2, first=pack_scheduler_first_run(), chat_id=chat_id, user_id=user_id, name=job_name)
+    METRIC_PACK_ACTIVATIONS.inc(pack='luxembourg')
     
-    total_items = len(CURATED_LUXEMBOURG_PACK)
+    total_items = len(load_pack_items(LUXEMBOURG_PACK_FILE))
     days_intro = math.ceil(total_items / effective_max_daily_for_new_pack)
     await context.bot.send_message(chat_id, f"Great! Luxembourg Phrases Pack ({total_items} items) added. Up to {effective_max_daily_for_new_pack} will be activated daily based on your intensity. ~{days_intro} days for all items to activate. Check '📚 Learning Dictionary'!", reply_markup=REPLY_KEYBOARD if not called_from_callback else None)
     logger.info(f"Luxembourg Phrases pack for user {user_id} (chat {chat_id}). Job '{job_name}' on.")
@@ -820,20 +1940,13 @@ async def sergei_pack_placeholder_command(update: Update, context: ContextTypes.
 async def random_word_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id; user_specific_data = context.user_data
     
-    daily_reminders_count = 0 # Calculate for context if needed, or pass dummy
-    if context.job_queue:
-        today = datetime.date.today()
-        for job in context.job_queue.jobs():
-            if job.chat_id == chat_id and job.next_run_time:
-                job_next_run_date = job.next_run_time.astimezone(datetime.timezone.utc).date()
-                if job_next_run_date == today:
-                    daily_reminders_count += 1
+    daily_reminders_count = count_daily_reminders(context.job_queue, chat_id, context.chat_data)
     intensity_name, intensity_emoji = get_learning_intensity(daily_reminders_count)
 
     _, all_items_list, _, _ = generate_dictionary_text(
         chat_id, user_specific_data, context.job_queue,
         intensity_name, intensity_emoji, 
-        page_number=1, items_per_page=float('inf')
+        page_number=1, items_per_page=float('inf'), chat_data=context.chat_data
     )
     active_words = [item[0] for item in all_items_list if item[4].startswith('active_')]
     unique_active_words = list(set(active_words))
@@ -845,10 +1958,20 @@ async def random_word_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Your active learning dictionary is empty. Add some items first!", reply_markup=REPLY_KEYBOARD)
         logger.info(f"Random item requested for chat {chat_id}, but dictionary is empty.")
 
-async def run_quiz_placeholder_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+def quiz_message(chat_data: dict, chat_id: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Text and keyboard of a new quiz question, stored as the chat's open question."""
+    quiz = build_quiz_question(chat_data, chat_id)
+    if not quiz: return "📝 Nothing to quiz yet. Add a few words or start a pack, then try again!", None
+    number = chat_data.get(QUIZ_STATE_KEY, {}).get('number', 0) + 1
+    chat_data[QUIZ_STATE_KEY] = {'number': number, 'item_id': quiz['item_id'], 'options': quiz['options'], 'answer': quiz['answer']}
+    keyboard = [[InlineKeyboardButton(option, callback_data=f"{CALLBACK_QUIZ_ANSWER}{number}:{choice}")] for choice, option in enumerate(quiz['options'])]
+    return f"📝 {quiz['question']}", InlineKeyboardMarkup(keyboard)
+
+async def run_quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
-    logger.info(f"User {chat_id} clicked placeholder button: {RUN_QUIZ_BUTTON_TEXT}")
-    await update.message.reply_text("📝 The Quiz feature will be available soon! Keep learning!", reply_markup=REPLY_KEYBOARD)
+    text, keyboard = quiz_message(context.chat_data, chat_id)
+    logger.info(f"Quiz for chat {chat_id}: {'question sent' if keyboard else 'no items'}")
+    await update.message.reply_text(text, reply_markup=keyboard or REPLY_KEYBOARD)
 
 async def show_vocabulary_packs_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
@@ -892,319 +2015,1009 @@ async def show_vocabulary_packs_command(update: Update, context: ContextTypes.DE
     ])
     await context.bot.send_message(chat_id=chat_id, text=lux_description_short, reply_markup=lux_keyboard, parse_mode='Markdown')
 
-async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query; await query.answer(); callback_data_full = query.data; chat_id = query.message.chat.id
-    logger.info(f"Callback from chat {chat_id} (user: {query.from_user.id}): {callback_data_full}")
-    
-    class SimplifiedUpdate:
-        def __init__(self, effective_chat, effective_user):
-            self.effective_chat = effective_chat
-            self.effective_user = effective_user
-    simplified_update_obj = SimplifiedUpdate(effective_chat=query.message.chat, effective_user=query.from_user)
-    
+class SimplifiedUpdate:
+    """Just enough of an Update for command handlers invoked from a callback query."""
+    def __init__(self, effective_chat, effective_user):
+        self.effective_chat = effective_chat
+        self.effective_user = effective_user
+
+def _cb_start_pack(pack_command):
+    async def start_pack(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+        await query.edit_message_reply_markup(reply_markup=None)
+        await pack_command(SimplifiedUpdate(effective_chat=query.message.chat, effective_user=query.from_user), context, called_from_callback=True)
+    return start_pack
+
+def _cb_pack_description(title: str, description_key: str):
+    async def describe_pack(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+        desc = f"{title}\n\n{PACK_DESCRIPTIONS[description_key]}{GENERIC_NEXT_PACK_NOTE}"
+        await context.bot.send_message(chat_id=query.message.chat.id, text=desc, parse_mode='Markdown', reply_to_message_id=query.message.message_id)
+    return describe_pack
+
+async def _cb_delete_request(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    item_id = payload; item = get_learning_item(context.chat_data, item_id)
+    if not item: await query.edit_message_text(f"{query.message.text}\n\n⚠️ This item is no longer in your schedule.", reply_markup=None); return
+    kbd = InlineKeyboardMarkup([[InlineKeyboardButton("✅ Yes",callback_data=f"{CALLBACK_DELETE_CONFIRM}{item_id}"), InlineKeyboardButton("❌ No",callback_data=f"{CALLBACK_DELETE_CANCEL}{item_id}")]])
+    await query.edit_message_text(f"❓ Remove \"{item['text']}\" from learning schedule?\n(Original: {query.message.text})", reply_markup=kbd)
+
+async def _cb_delete_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    chat_id = query.message.chat.id
+    item_id = payload; item = get_learning_item(context.chat_data, item_id)
+    if not item: await query.edit_message_text("ℹ️ This item was already removed.", reply_markup=None); return
+    word_to_delete, pack_source_confirm = item['text'], item.get('pack_source')
+    if not context.job_queue: await query.edit_message_text("❌ Error: No schedule access.",reply_markup=None); return
+    word_updated_in_pack = False; pack_name_updated = ""; target_pack_data_key = None
+    if pack_source_confirm == 'b2plus': target_pack_data_key = USER_PACK_DATA_KEY; pack_name_updated = "B2+ Pack"
+    elif pack_source_confirm == 'luxembourg': target_pack_data_key = USER_LUX_PACK_DATA_KEY; pack_name_updated = "Luxembourg Phrases Pack"
+    if target_pack_data_key and target_pack_data_key in context.user_data:
+        pack_data_store = context.user_data.get(target_pack_data_key, {})
+        if 'pack_words_status' in pack_data_store:
+            for pack_word_obj in pack_data_store['pack_words_status']:
+                if pack_word_obj['word'] == word_to_delete:
+                    pack_word_obj['status'] = 'cancelled_by_user'; word_updated_in_pack = True
+                    logger.info(f"Marked '{word_to_delete}' as cancelled in {pack_name_updated} for user {query.from_user.id}"); break
+    removed_jobs_count = remove_item_jobs(chat_id, item_id); forget_learning_item(context.chat_data, item_id)
+    logger.info(f"Removed {removed_jobs_count} jobs for item {item_id} '{word_to_delete}'")
+    response_msg = f"✅ \"{word_to_delete}\" "
+    if removed_jobs_count > 0: response_msg += f"({removed_jobs_count} reminders) removed from schedule."
+    elif word_updated_in_pack: response_msg += f"marked as cancelled in {pack_name_updated}."
+    else: response_msg += "not found active or planned."
+    if word_updated_in_pack and removed_jobs_count > 0: response_msg += f" Status also updated in {pack_name_updated}."
+    await query.edit_message_text(response_msg, reply_markup=None)
+
+async def _cb_delete_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    item = get_learning_item(context.chat_data, payload)
+    word_display = item['text'] if item else "?"
+    orig_txt_match = re.search(r"\(Original: (.*)\)", query.message.text,re.DOTALL)
+    orig_txt = orig_txt_match.group(1).strip() if orig_txt_match else f"🔔 Reminder: {word_display}"
+    await query.edit_message_text(f"{orig_txt}\n\n❌ Deletion cancelled.", reply_markup=None)
+
+async def _cb_intensity_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    chat_id = query.message.chat.id
+    daily_reminders_count = count_daily_reminders(context.job_queue, chat_id, context.chat_data)
+    current_intensity_name, current_intensity_emoji = get_learning_intensity(daily_reminders_count)
+
+    intensity_message = (
+        f"⚙️ **Learning Intensity**\n\n"
+        f"Your current intensity (based on today's reminders): {current_intensity_emoji} {current_intensity_name} ({daily_reminders_count} reminders today).\n\n"
+        "We generally recommend keeping your learning intensity up to a 'Medium' level. "
+        "A lower, consistent intensity often makes it easier to build a strong learning habit.\n\n"
+        "Adjusting the number of *new pack words* added daily can help manage future intensity."
+    )
+    kbd = InlineKeyboardMarkup([[InlineKeyboardButton("📉 Adjust New Pack Word Pace", callback_data=CALLBACK_DECREASE_INTENSITY)]])
+    # Send as a new message in reply to the original dictionary message
+    await context.bot.send_message(chat_id=chat_id, text=intensity_message, reply_markup=kbd, parse_mode='Markdown', reply_to_message_id=query.message.message_id)
+    await query.answer() 
+
+async def _cb_decrease_intensity(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    user_intensity_modifier = context.user_data.get(USER_INTENSITY_MODIFIER_KEY, 1.0)
+
+    # Propose to double the modifier (halve the speed)
+    # If modifier is already high (e.g., meaning 1 word per day or less), this might not change much
+    proposed_new_modifier = user_intensity_modifier * 2.0 
+    # Cap modifier to avoid extremely slow rates if MAX_PACK_WORDS_PER_DAY is already low
+    if (MAX_PACK_WORDS_PER_DAY / proposed_new_modifier) < 1 and MAX_PACK_WORDS_PER_DAY >= 1:
+         proposed_new_modifier = user_intensity_modifier * (MAX_PACK_WORDS_PER_DAY / max(1, round(MAX_PACK_WORDS_PER_DAY / user_intensity_modifier))) # Make it such that it results in 1 word
+         if proposed_new_modifier <= user_intensity_modifier: # If no change or worse, keep current
+             proposed_new_modifier = user_intensity_modifier
+
+
+    current_forecast, new_forecast = forecast_review_load(context.chat_data, context.user_data, (user_intensity_modifier, proposed_new_modifier))
+    date_current_str = current_forecast['completion_date'].strftime("%Y-%m-%d")
+    date_new_str = new_forecast['completion_date'].strftime("%Y-%m-%d")
+
+    decrease_message = (
+        f"Currently, your settings lead to new pack words being added at a certain pace. "
+        f"With this pace, your planned vocabulary is projected to complete its full reminder cycle around: **{date_current_str}**. "
+        f"Busiest day ahead: {current_forecast['peak_date'].strftime('%Y-%m-%d')} with {current_forecast['peak_load']} reminders.\n\n"
+        f"We can slow down the introduction of *new pack words*. "
+    )
+
+    if date_new_str != date_current_str:
+        decrease_message += (
+            f"If adjusted, this would extend the projected completion to approximately: **{date_new_str}**, "
+            f"with at most {new_forecast['peak_load']} reminders on any day.\n\n"
+            "This change only affects how quickly *new items from packs* are added to your learning schedule. "
+            "It does **not** change reminders for items already active in your dictionary.\n\n"
+            "Are you OK to apply this adjustment?"
+        )
+        kbd = InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"✅ Yes, slow to {proposed_new_modifier:.1f}x modifier", callback_data=f"{CALLBACK_DECREASE_INTENSITY_CONFIRM}{proposed_new_modifier}")],
+            [InlineKeyboardButton("❌ No, keep current pace", callback_data=CALLBACK_DECREASE_INTENSITY_CANCEL)]
+        ])
+    else:
+        decrease_message += (
+            "Your current pace for adding new pack words is already very slow, or no new pack words are pending for active packs. "
+            "No further slowdown is applicable via this option at the moment."
+        )
+        kbd = InlineKeyboardMarkup([[InlineKeyboardButton("Okay", callback_data=CALLBACK_DECREASE_INTENSITY_CANCEL)]])
+
+    # Edit the message that contained the "Adjust New Pack Word Pace" button
+    await query.edit_message_text(text=decrease_message, reply_markup=kbd, parse_mode='Markdown')
+
+async def _cb_decrease_intensity_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
     try:
-        if callback_data_full.startswith(CALLBACK_DELETE_REQUEST):
-            data_content = callback_data_full[len(CALLBACK_DELETE_REQUEST):]; pack_source_delete = None; word_to_delete_action = data_content
-            if ":" in data_content: pack_source_delete, word_to_delete_action = data_content.split(":", 1)
-            cb_confirm = f"{CALLBACK_DELETE_CONFIRM}{data_content}"; cb_cancel = f"{CALLBACK_DELETE_CANCEL}{data_content}"
-            if len(cb_confirm.encode()) > 64 or len(cb_cancel.encode()) > 64: await query.edit_message_text(f"{query.message.text}\n\n⚠️ Item identifier too long for confirmation.", reply_markup=None); return
-            kbd = InlineKeyboardMarkup([[InlineKeyboardButton("✅ Yes",callback_data=cb_confirm), InlineKeyboardButton("❌ No",callback_data=cb_cancel)]])
-            await query.edit_message_text(f"❓ Remove \"{word_to_delete_action}\" from learning schedule?\n(Original: {query.message.text})", reply_markup=kbd)
-        
-        elif callback_data_full.startswith(CALLBACK_DELETE_CONFIRM):
-            data_content = callback_data_full[len(CALLBACK_DELETE_CONFIRM):]; pack_source_confirm = None; word_to_delete = data_content
-            if ":" in data_content: pack_source_confirm, word_to_delete = data_content.split(":", 1)
-            if not context.job_queue: await query.edit_message_text("❌ Error: No schedule access.",reply_markup=None); return
-            word_updated_in_pack = False; pack_name_updated = ""; target_pack_data_key = None
-            if pack_source_confirm == 'b2plus': target_pack_data_key = USER_PACK_DATA_KEY; pack_name_updated = "B2+ Pack"
-            elif pack_source_confirm == 'luxembourg': target_pack_data_key = USER_LUX_PACK_DATA_KEY; pack_name_updated = "Luxembourg Phrases Pack"
-            if target_pack_data_key and target_pack_data_key in context.user_data:
-                pack_data_store = context.user_data.get(target_pack_data_key, {})
-                if 'pack_words_status' in pack_data_store:
-                    for pack_word_obj in pack_data_store['pack_words_status']:
-                        if pack_word_obj['word'] == word_to_delete:
-                            pack_word_obj['status'] = 'cancelled_by_user'; word_updated_in_pack = True
-                            logger.info(f"Marked '{word_to_delete}' as cancelled in {pack_name_updated} for user {query.from_user.id}"); break
-            removed_jobs_count = 0
-            for j in list(context.job_queue.jobs()):
-                if j and j.chat_id == chat_id and j.data and j.data.get('message_text') == word_to_delete and not j.removed:
-                    logger.info(f"Removing job '{j.name}' for word '{word_to_delete}'"); j.schedule_removal(); removed_jobs_count += 1
-            response_msg = f"✅ \"{word_to_delete}\" "
-            if removed_jobs_count > 0: response_msg += f"({removed_jobs_count} reminders) removed from schedule."
-            elif word_updated_in_pack: response_msg += f"marked as cancelled in {pack_name_updated}."
-            else: response_msg += "not found active or planned."
-            if word_updated_in_pack and removed_jobs_count > 0: response_msg += f" Status also updated in {pack_name_updated}."
-            await query.edit_message_text(response_msg, reply_markup=None)
-        
-        elif callback_data_full.startswith(CALLBACK_DELETE_CANCEL):
-            data_content = callback_data_full[len(CALLBACK_DELETE_CANCEL):]
-            word_display = data_content.split(":",1)[-1] if ":" in data_content else data_content
-            orig_txt_match = re.search(r"\(Original: (.*)\)", query.message.text,re.DOTALL)
-            orig_txt = orig_txt_match.group(1).strip() if orig_txt_match else f"🔔 Reminder: {word_display}"
-            await query.edit_message_text(f"{orig_txt}\n\n❌ Deletion cancelled.", reply_markup=None)
-        
-        elif callback_data_full == CALLBACK_START_B2_PACK:
-            await query.edit_message_reply_markup(reply_markup=None)
-            await add_curated_words_command(simplified_update_obj, context, called_from_callback=True)
-        elif callback_data_full == CALLBACK_START_LUX_PACK:
-            await query.edit_message_reply_markup(reply_markup=None)
-            await add_luxembourg_pack_command(simplified_update_obj, context, called_from_callback=True)
-        elif callback_data_full == CALLBACK_START_JULIE_PACK:
-            await query.edit_message_reply_markup(reply_markup=None)
-            await julie_pack_placeholder_command(simplified_update_obj, context, called_from_callback=True)
-        elif callback_data_full == CALLBACK_START_SERGEI_PACK:
-            await query.edit_message_reply_markup(reply_markup=None)
-            await sergei_pack_placeholder_command(simplified_update_obj, context, called_from_callback=True)
-
-        elif callback_data_full == CALLBACK_DESC_B2_PACK:
-            desc = f"🇬🇧 **B2+ English Pack Description**\n\n{PACK_DESCRIPTIONS['b2plus']}{GENERIC_NEXT_PACK_NOTE}"
-            await context.bot.send_message(chat_id=chat_id, text=desc, parse_mode='Markdown', reply_to_message_id=query.message.message_id)
-        elif callback_data_full == CALLBACK_DESC_LUX_PACK:
-            desc = f"🇱🇺 **Luxembourg Phrases Pack Description**\n\n{PACK_DESCRIPTIONS['luxembourg']}{GENERIC_NEXT_PACK_NOTE}"
-            await context.bot.send_message(chat_id=chat_id, text=desc, parse_mode='Markdown', reply_to_message_id=query.message.message_id)
-        elif callback_data_full == CALLBACK_DESC_JULIE_PACK:
-            desc = f"🎓 **Julie Stolyarchuk's Pack Description**\n\n{PACK_DESCRIPTIONS['julie']}{GENERIC_NEXT_PACK_NOTE}"
-            await context.bot.send_message(chat_id=chat_id, text=desc, parse_mode='Markdown', reply_to_message_id=query.message.message_id)
-        elif callback_data_full == CALLBACK_DESC_SERGEI_PACK:
-            desc = f"🧑‍🏫 **@sergeitheteacher's New Pack Description**\n\n{PACK_DESCRIPTIONS['sergei']}{GENERIC_NEXT_PACK_NOTE}"
-            await context.bot.send_message(chat_id=chat_id, text=desc, parse_mode='Markdown', reply_to_message_id=query.message.message_id)
-        
-        elif callback_data_full == CALLBACK_INTENSITY_SETTINGS:
-            daily_reminders_count = 0
-            if context.job_queue:
-                today = datetime.date.today()
-                for job in context.job_queue.jobs():
-                    if job.chat_id == chat_id and job.next_run_time:
-                        job_next_run_date = job.next_run_time.astimezone(datetime.timezone.utc).date()
-                        if job_next_run_date == today:
-                            daily_reminders_count += 1
-            current_intensity_name, current_intensity_emoji = get_learning_intensity(daily_reminders_count)
-
-            intensity_message = (
-                f"⚙️ **Learning Intensity**\n\n"
-                f"Your current intensity (based on today's reminders): {current_intensity_emoji} {current_intensity_name} ({daily_reminders_count} reminders today).\n\n"
-                "We generally recommend keeping your learning intensity up to a 'Medium' level. "
-                "A lower, consistent intensity often makes it easier to build a strong learning habit.\n\n"
-                "Adjusting the number of *new pack words* added daily can help manage future intensity."
-            )
-            kbd = InlineKeyboardMarkup([[InlineKeyboardButton("📉 Adjust New Pack Word Pace", callback_data=CALLBACK_DECREASE_INTENSITY)]])
-            # Send as a new message in reply to the original dictionary message
-            await context.bot.send_message(chat_id=chat_id, text=intensity_message, reply_markup=kbd, parse_mode='Markdown', reply_to_message_id=query.message.message_id)
-            await query.answer() 
-
-        elif callback_data_full == CALLBACK_DECREASE_INTENSITY:
-            user_intensity_modifier = context.user_data.get(USER_INTENSITY_MODIFIER_KEY, 1.0)
-            
-            date_current_intensity = calculate_projected_pack_completion_date(context.user_data, context.job_queue, chat_id, current_intensity_modifier=user_intensity_modifier)
-            
-            # Propose to double the modifier (halve the speed)
-            # If modifier is already high (e.g., meaning 1 word per day or less), this might not change much
-            proposed_new_modifier = user_intensity_modifier * 2.0 
-            # Cap modifier to avoid extremely slow rates if MAX_PACK_WORDS_PER_DAY is already low
-            if (MAX_PACK_WORDS_PER_DAY / proposed_new_modifier) < 1 and MAX_PACK_WORDS_PER_DAY >= 1:
-                 proposed_new_modifier = user_intensity_modifier * (MAX_PACK_WORDS_PER_DAY / max(1, round(MAX_PACK_WORDS_PER_DAY / user_intensity_modifier))) # Make it such that it results in 1 word
-                 if proposed_new_modifier <= user_intensity_modifier: # If no change or worse, keep current
-                     proposed_new_modifier = user_intensity_modifier
-
-
-            date_new_intensity = calculate_projected_pack_completion_date(context.user_data, context.job_queue, chat_id, new_intensity_modifier=proposed_new_modifier)
-
-            date_current_str = date_current_intensity.strftime("%Y-%m-%d") if date_current_intensity else "N/A"
-            date_new_str = date_new_intensity.strftime("%Y-%m-%d") if date_new_intensity else "N/A (or no change)"
-
-            decrease_message = (
-                f"Currently, your settings lead to new pack words being added at a certain pace. "
-                f"With this pace, your planned vocabulary is projected to complete its full reminder cycle around: **{date_current_str}**.\n\n"
-                f"We can slow down the introduction of *new pack words*. "
-            )
-            
-            if date_new_str != "N/A (or no change)" and date_new_str != date_current_str:
-                decrease_message += (
-                    f"If adjusted, this would extend the projected completion to approximately: **{date_new_str}**.\n\n"
-                    "This change only affects how quickly *new items from packs* are added to your learning schedule. "
-                    "It does **not** change reminders for items already active in your dictionary.\n\n"
-                    "Are you OK to apply this adjustment?"
-                )
-                kbd = InlineKeyboardMarkup([
-                    [InlineKeyboardButton(f"✅ Yes, slow to {proposed_new_modifier:.1f}x modifier", callback_data=f"{CALLBACK_DECREASE_INTENSITY_CONFIRM}{proposed_new_modifier}")],
-                    [InlineKeyboardButton("❌ No, keep current pace", callback_data=CALLBACK_DECREASE_INTENSITY_CANCEL)]
-                ])
-            else:
-                decrease_message += (
-                    "Your current pace for adding new pack words is already very slow, or no new pack words are pending for active packs. "
-                    "No further slowdown is applicable via this option at the moment."
-                )
-                kbd = InlineKeyboardMarkup([[InlineKeyboardButton("Okay", callback_data=CALLBACK_DECREASE_INTENSITY_CANCEL)]])
-            
-            # Edit the message that contained the "Adjust New Pack Word Pace" button
-            await query.edit_message_text(text=decrease_message, reply_markup=kbd, parse_mode='Markdown')
+        new_modifier = float(payload)
+        context.user_data[USER_INTENSITY_MODIFIER_KEY] = new_modifier
+        await query.edit_message_text(
+            f"✅ Pace for adding new pack words has been adjusted. Your new intensity modifier is {new_modifier:.1f}x (meaning {1/new_modifier:.2f} times the base speed, or effectively {max(1,round(MAX_PACK_WORDS_PER_DAY/new_modifier))} words/day from new packs).\n"
+            "This will affect future scheduling of new items from packs.",
+            reply_markup=None, parse_mode='Markdown'
+        )
+        logger.info(f"User {query.from_user.id} set intensity modifier to {new_modifier}")
+    except (IndexError, ValueError) as e:
+        logger.error(f"Error parsing new modifier from callback: {query.data} - {e}")
+        await query.edit_message_text("😕 Error applying change. Invalid modifier.", reply_markup=None)
+
+async def _cb_decrease_intensity_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    await query.edit_message_text("👌 Pace for adding new pack words remains unchanged.", reply_markup=None)
+
+async def _cb_terminate_request(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    kbd = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Yes, Terminate ALL", callback_data=CALLBACK_TERMINATE_VOCAB_CONFIRM)],
+        [InlineKeyboardButton("❌ No, Cancel", callback_data=CALLBACK_TERMINATE_VOCAB_CANCEL)]
+    ])
+    await query.edit_message_text(
+        "❓ **WARNING!** Are you sure you want to terminate your entire vocabulary?\n"
+        "This will remove ALL your learned words/phrases and reset ALL pack progress. This action CANNOT be undone.",
+        reply_markup=kbd, parse_mode='Markdown'
+    )
 
+async def _cb_terminate_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    chat_id = query.message.chat.id
+    logger.info(f"User {query.from_user.id} in chat {chat_id} confirmed vocabulary termination.")
+    jobs_removed_count = 0
+    if context.job_queue:
+        all_jobs = list(context.job_queue.jobs()) 
+        for job in all_jobs:
+            if job.chat_id == chat_id: 
+                job.schedule_removal()
+                jobs_removed_count +=1
+
+    forget_chat_items(chat_id, context.chat_data)
+    packs_cleared_count = 0
+    for pack_key in ALL_USER_PACK_DATA_KEYS:
+        if pack_key in context.user_data:
+            del context.user_data[pack_key]
+            packs_cleared_count += 1
+
+    if 'dict_sort_key_name' in context.chat_data: del context.chat_data['dict_sort_key_name']
+    if 'dict_sort_reverse' in context.chat_data: del context.chat_data['dict_sort_reverse']
+    if 'dict_current_page' in context.chat_data: del context.chat_data['dict_current_page']
+    if 'all_dict_items_for_export' in context.chat_data: del context.chat_data['all_dict_items_for_export']
+
+    await query.edit_message_text(
+        f"✅ Vocabulary terminated. {jobs_removed_count} reminders removed. {packs_cleared_count} packs reset.",
+        reply_markup=None
+    )
+    await context.bot.send_message(chat_id, "Your learning dictionary is now empty. You can start fresh!", reply_markup=REPLY_KEYBOARD)
+
+async def _cb_terminate_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    chat_id = query.message.chat.id
+    current_page = context.chat_data.get('dict_current_page', 1)
+    # We need to recalculate intensity for the dictionary view
+    daily_reminders_count_term_cancel = count_daily_reminders(context.job_queue, chat_id, context.chat_data)
+    intensity_name_tc, intensity_emoji_tc = get_learning_intensity(daily_reminders_count_term_cancel)
+
+    dictionary_text_tc, _, _, _ = generate_dictionary_text(
+        chat_id, context.user_data, context.job_queue,
+        intensity_name_tc, intensity_emoji_tc,
+        page_number=current_page, chat_data=context.chat_data
+    )
+    # Re-show dictionary, but use the original keyboard from show_dictionary_command_wrapper
+    # This is a bit tricky, ideally show_dictionary_command_wrapper should be fully callable
+    # For now, just edit the text back to the dictionary content.
+    # The keyboard would need to be reconstructed. A simpler way is to just send a new message.
+    await query.edit_message_text(dictionary_text_tc, parse_mode='Markdown') # Keyboard will be lost
+    await query.answer("Termination cancelled.")
+
+async def _cb_export_vocab(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    chat_id = query.message.chat.id
+    logger.info(f"User {query.from_user.id} in chat {chat_id} requested vocabulary export.")
+    daily_reminders_count_export = count_daily_reminders(context.job_queue, chat_id, context.chat_data)
+    intensity_name_ex, intensity_emoji_ex = get_learning_intensity(daily_reminders_count_export)
+
+    _, all_items_tuples, _, _ = generate_dictionary_text(
+        chat_id, context.user_data, context.job_queue,
+        intensity_name_ex, intensity_emoji_ex, 
+        page_number=1, items_per_page=float('inf'), chat_data=context.chat_data
+    )
+    if not all_items_tuples:
+        await context.bot.send_message(chat_id, "Your learning dictionary is empty. Nothing to export.", reply_to_message_id=query.message.message_id)
+        return
+    word_list = [item[0] for item in all_items_tuples]
+    if not word_list: 
+         await context.bot.send_message(chat_id, "Your learning dictionary is empty. Nothing to export.", reply_to_message_id=query.message.message_id)
+         return
+    export_string = "[" + ", ".join(f'"{html.escape(w)}"' for w in word_list) + "]"
+    max_len = 4000 
+    if len(export_string) > max_len:
+        export_string = export_string[:max_len-20] + "... (list truncated)]"
+        await context.bot.send_message(chat_id, f"Your vocabulary list is very long! Here's a truncated version:\n\n{export_string}", reply_to_message_id=query.message.message_id)
+    else:
+        await context.bot.send_message(chat_id, f"Your vocabulary list:\n\n{export_string}", reply_to_message_id=query.message.message_id)
+    await query.answer("Vocabulary list sent!")
+
+async def _cb_clue_request(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    chat_id = query.message.chat.id
+    item = get_learning_item(context.chat_data, payload)
+    if not item: await context.bot.send_message(chat_id=chat_id, text="ℹ️ This item is no longer in your schedule.", reply_to_message_id=query.message.message_id); return
+    word = get_clue_word(item['text']); logger.info(f"Clue/Translate for '{word}'"); info_txt = get_clue_and_translations(word)
+    await context.bot.send_message(chat_id=chat_id, text=f"💡 Info for \"{word}\":\n{info_txt}", reply_to_message_id=query.message.message_id)
+
+def _format_gap(seconds: float) -> str:
+    return f"~{seconds / 86400:.0f} days" if seconds >= 86400 * 1.5 else f"~{seconds / 3600:.0f} hours" if seconds >= 3600 else f"~{seconds / 60:.0f} min"
+
+def answer_review(job_queue: JobQueue, chat_id: int, chat_data: dict, item_id: str, review_number: str, grade: str):
+    """Grades the item's reminder number `review_number` if it is still the latest and unanswered; returns
+    the next Job (None once the item retires), or False if it was already answered or superseded."""
+    item = get_learning_item(chat_data, item_id)
+    if not item or 'history' not in item or str(len(item['history'])) != review_number or item['history'][-1][1] != GRADE_UNANSWERED: return False
+    ensure_deck_schedule(job_queue, chat_id, chat_data)
+    item['history'][-1] = [int(time.time()), grade]; METRIC_REVIEW_ANSWERS.inc(grade=grade)
+    remove_item_jobs(chat_id, item_id); return schedule_next_review(job_queue, chat_id, chat_data, item_id)
+
+def review_outcome(item: dict, next_job) -> str:
+    ease, gap, step, due = review_state(item)
+    if not next_job: return "you've learned it, no more reminders. 🎉"
+    return f"next reminder in {_format_gap(gap)}, {len(unanswered_review_times(ease, gap, step, due))} left at most."
+
+def _cb_review_answer(grade: str):
+    async def review_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+        chat_id = query.message.chat.id; item_id, _, review_number = payload.partition(":")
+        item = get_learning_item(context.chat_data, item_id)
+        batch_rows = None # A quiet-hours batch keeps the rows of its other items
+        if query.message.text.startswith(QUIET_BATCH_PREFIX) and query.message.reply_markup:
+            batch_rows = [row for row in query.message.reply_markup.inline_keyboard if all(button.callback_data.partition(":")[2] != payload for button in row)]
+        if not item or 'history' not in item:
+            await query.edit_message_text(f"{query.message.text}\n\n⚠️ This item is no longer in your schedule.", reply_markup=InlineKeyboardMarkup(batch_rows) if batch_rows else None); return
+        keyboard = InlineKeyboardMarkup(batch_rows if batch_rows is not None else [reminder_action_buttons(item_id, item['text'])])
+        next_job = answer_review(context.job_queue, chat_id, context.chat_data, item_id, review_number, grade)
+        if next_job is False:
+            await query.edit_message_text(f"{query.message.text}\n\nℹ️ Already answered (or a newer reminder was sent).", reply_markup=keyboard); return
+        verdict = ("✅ Remembered" if grade == GRADE_REMEMBERED else "❌ Forgot") + (f" {item['text']}" if batch_rows is not None else "")
+        outcome = review_outcome(item, next_job)
+        logger.info("Review of item %s in chat %s: %s, next job %s", item_id, chat_id, grade, next_job.name if next_job else None, extra=log_fields("callback", chat_id, item_id))
+        await query.edit_message_text(f"{query.message.text}\n\n{verdict}: {outcome}", reply_markup=keyboard)
+    return review_answer
+
+async def _cb_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    chat_id = query.message.chat.id; number, _, choice = payload.partition(":")
+    quiz = context.chat_data.get(QUIZ_STATE_KEY)
+    next_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("➡️ Next question", callback_data=CALLBACK_QUIZ_NEXT)]])
+    if not quiz or str(quiz['number']) != number or not choice.isdigit():
+        await query.edit_message_text(f"{query.message.text}\n\nℹ️ This question was already answered.", reply_markup=next_keyboard); return
+    del context.chat_data[QUIZ_STATE_KEY]
+    correct = int(choice) == quiz['answer']; METRIC_QUIZ_ANSWERS.inc(result="right" if correct else "wrong")
+    next_job = record_quiz_answer(context.job_queue, chat_id, context.chat_data, quiz['item_id'], correct)
+    verdict = "✅ Right!" if correct else f"❌ It was: {quiz['options'][quiz['answer']]}"
+    if next_job is False: outcome = ""
+    elif next_job: outcome = f"\nNext reminder of this item in {_format_gap(review_state(get_learning_item(context.chat_data, quiz['item_id']))[1])}."
+    else: outcome = "\nYou've learned it, no more reminders. 🎉"
+    logger.info("Quiz answer in chat %s for item %s: %s", chat_id, quiz['item_id'], 'right' if correct else 'wrong', extra=log_fields("callback", chat_id, quiz['item_id']))
+    await query.edit_message_text(f"{query.message.text}\n\n{verdict}{outcome}", reply_markup=next_keyboard)
+
+async def _cb_digest_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    chat_id = query.message.chat.id; number, index, grade = (payload.split(":") + ["", "", ""])[:3]
+    digest = context.chat_data.get(DIGEST_STATE_KEY)
+    if not digest or str(digest['number']) != number or not index.isdigit() or int(index) >= len(digest['entries']) or grade not in (GRADE_REMEMBERED, GRADE_FORGOT):
+        await query.edit_message_text(f"{query.message.text}\n\nℹ️ This digest was replaced by a newer one.", reply_markup=None); return
+    entry = digest['entries'][int(index)]
+    if not entry[3]:
+        entry[3] = grade if answer_review(context.job_queue, chat_id, context.chat_data, entry[0], str(entry[1]), grade) is not False else "-"
+        logger.info("Digest answer in chat %s for item %s: %s", chat_id, entry[0], entry[3], extra=log_fields("callback", chat_id, entry[0]))
+    text, keyboard = render_digest_page(digest)
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+async def _cb_digest_page(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    number, _, page = payload.partition(":"); digest = context.chat_data.get(DIGEST_STATE_KEY)
+    if not digest or str(digest['number']) != number or not page.isdigit():
+        await query.edit_message_text(f"{query.message.text}\n\nℹ️ This digest was replaced by a newer one.", reply_markup=None); return
+    digest['page'] = int(page); text, keyboard = render_digest_page(digest)
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+async def _cb_quiz_next(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    text, keyboard = quiz_message(context.chat_data, query.message.chat.id)
+    await context.bot.send_message(query.message.chat.id, text, reply_markup=keyboard)
+
+async def _cb_ai_explain(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    chat_id = query.message.chat.id
+    item = get_learning_item(context.chat_data, payload)
+    if not item: await context.bot.send_message(chat_id=chat_id, text="ℹ️ This item is no longer in your schedule.", reply_to_message_id=query.message.message_id); return
+    word_to_explain = get_clue_word(item['text']); logger.info(f"AI Explanation for '{word_to_explain}'"); await context.bot.send_chat_action(chat_id=chat_id, action="typing"); ai_explanation_text = await get_ai_explanation(word_to_explain)
+    await context.bot.send_message(chat_id=chat_id, text=f"✨ AI for \"{word_to_explain}\":\n\n{ai_explanation_text}", reply_to_message_id=query.message.message_id, parse_mode='Markdown' )
+
+async def _cb_sort_dict(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    sort_type_requested = payload; logger.info("Sort dict type: %s", sort_type_requested, extra=log_fields("dictionary", update.effective_chat.id))
+    sort_key_to_apply,reverse_sort_to_apply = None,False
+    if sort_type_requested=="ease_asc": sort_key_to_apply=lambda item:(len(item[0]),count_vowels(item[0])); reverse_sort_to_apply=False
+    elif sort_type_requested=="ease_desc": sort_key_to_apply=lambda item:(len(item[0]),count_vowels(item[0])); reverse_sort_to_apply=True
+    elif sort_type_requested=="default": sort_key_to_apply=lambda item:item[0].lower(); reverse_sort_to_apply=False
+    else: logger.warning(f"Unrec sort type '{sort_type_requested}'"); sort_key_to_apply=lambda item:item[0].lower(); reverse_sort_to_apply=False; sort_type_requested="default"
+    await show_dictionary_command_wrapper(update, context, page_number=1, sort_key_func=sort_key_to_apply, sort_reverse=reverse_sort_to_apply, sort_type_str=sort_type_requested)
+
+async def _cb_dict_page(update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str) -> None:
+    requested_page = int(payload)
+    logger.info("Dictionary pagination requested. Requested page: %s", requested_page, extra=log_fields("dictionary", update.effective_chat.id))
+    await show_dictionary_command_wrapper(update, context, page_number=requested_page)
+
+# --- Callback Router ---
+# Prefix routes are keyed by their token including the trailing ":" and exact routes by the full
+# callback_data, so dispatch is one dict lookup on query.data.partition(":").
+CALLBACK_STATS_LOG_INTERVAL_SECONDS = int(os.environ.get("CALLBACK_STATS_LOG_INTERVAL_SECONDS", "3600"))
+
+CALLBACK_ROUTES = {
+    CALLBACK_DELETE_REQUEST: _cb_delete_request,
+    CALLBACK_DELETE_CONFIRM: _cb_delete_confirm,
+    CALLBACK_DELETE_CANCEL: _cb_delete_cancel,
+    CALLBACK_START_B2_PACK: _cb_start_pack(add_curated_words_command),
+    CALLBACK_START_LUX_PACK: _cb_start_pack(add_luxembourg_pack_command),
+    CALLBACK_START_JULIE_PACK: _cb_start_pack(julie_pack_placeholder_command),
+    CALLBACK_START_SERGEI_PACK: _cb_start_pack(sergei_pack_placeholder_command),
+    CALLBACK_DESC_B2_PACK: _cb_pack_description("🇬🇧 **B2+ English Pack Description**", 'b2plus'),
+    CALLBACK_DESC_LUX_PACK: _cb_pack_description("🇱🇺 **Luxembourg Phrases Pack Description**", 'luxembourg'),
+    CALLBACK_DESC_JULIE_PACK: _cb_pack_description("🎓 **Julie Stolyarchuk's Pack Description**", 'julie'),
+    CALLBACK_DESC_SERGEI_PACK: _cb_pack_description("🧑‍🏫 **@sergeitheteacher's New Pack Description**", 'sergei'),
+    CALLBACK_INTENSITY_SETTINGS: _cb_intensity_settings,
+    CALLBACK_DECREASE_INTENSITY: _cb_decrease_intensity,
+    CALLBACK_DECREASE_INTENSITY_CONFIRM: _cb_decrease_intensity_confirm,
+    CALLBACK_DECREASE_INTENSITY_CANCEL: _cb_decrease_intensity_cancel,
+    CALLBACK_TERMINATE_VOCAB_REQUEST: _cb_terminate_request,
+    CALLBACK_TERMINATE_VOCAB_CONFIRM: _cb_terminate_confirm,
+    CALLBACK_TERMINATE_VOCAB_CANCEL: _cb_terminate_cancel,
+    CALLBACK_EXPORT_VOCAB: _cb_export_vocab,
+    CALLBACK_CLUE_REQUEST: _cb_clue_request,
+    CALLBACK_AI_EXPLAIN: _cb_ai_explain,
+    CALLBACK_REVIEW_REMEMBERED: _cb_review_answer(GRADE_REMEMBERED),
+    CALLBACK_REVIEW_FORGOT: _cb_review_answer(GRADE_FORGOT),
+    CALLBACK_QUIZ_ANSWER: _cb_quiz_answer,
+    CALLBACK_QUIZ_NEXT: _cb_quiz_next,
+    CALLBACK_DIGEST_ANSWER: _cb_digest_answer,
+    CALLBACK_DIGEST_PAGE: _cb_digest_page,
+    CALLBACK_SORT_DICT: _cb_sort_dict,
+    CALLBACK_DICT_PAGE_NEXT: _cb_dict_page,
+    CALLBACK_DICT_PAGE_PREV: _cb_dict_page,
+}
 
-        elif callback_data_full.startswith(CALLBACK_DECREASE_INTENSITY_CONFIRM):
-            try:
-                new_modifier_str = callback_data_full.split(":")[1]
-                new_modifier = float(new_modifier_str)
-                context.user_data[USER_INTENSITY_MODIFIER_KEY] = new_modifier
-                await query.edit_message_text(
-                    f"✅ Pace for adding new pack words has been adjusted. Your new intensity modifier is {new_modifier:.1f}x (meaning {1/new_modifier:.2f} times the base speed, or effectively {max(1,round(MAX_PACK_WORDS_PER_DAY/new_modifier))} words/day from new packs).\n"
-                    "This will affect future scheduling of new items from packs.",
-                    reply_markup=None, parse_mode='Markdown'
-                )
-                logger.info(f"User {query.from_user.id} set intensity modifier to {new_modifier}")
-            except (IndexError, ValueError) as e:
-                logger.error(f"Error parsing new modifier from callback: {callback_data_full} - {e}")
-                await query.edit_message_text("😕 Error applying change. Invalid modifier.", reply_markup=None)
-
-        elif callback_data_full == CALLBACK_DECREASE_INTENSITY_CANCEL:
-            await query.edit_message_text("👌 Pace for adding new pack words remains unchanged.", reply_markup=None)
-
-        elif callback_data_full == CALLBACK_TERMINATE_VOCAB_REQUEST:
-            kbd = InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Yes, Terminate ALL", callback_data=CALLBACK_TERMINATE_VOCAB_CONFIRM)],
-                [InlineKeyboardButton("❌ No, Cancel", callback_data=CALLBACK_TERMINATE_VOCAB_CANCEL)]
-            ])
-            await query.edit_message_text(
-                "❓ **WARNING!** Are you sure you want to terminate your entire vocabulary?\n"
-                "This will remove ALL your learned words/phrases and reset ALL pack progress. This action CANNOT be undone.",
-                reply_markup=kbd, parse_mode='Markdown'
-            )
-        elif callback_data_full == CALLBACK_TERMINATE_VOCAB_CONFIRM:
-            logger.info(f"User {query.from_user.id} in chat {chat_id} confirmed vocabulary termination.")
-            jobs_removed_count = 0
-            if context.job_queue:
-                all_jobs = list(context.job_queue.jobs()) 
-                for job in all_jobs:
-                    if job.chat_id == chat_id: 
-                        job.schedule_removal()
-                        jobs_removed_count +=1
-            
-            packs_cleared_count = 0
-            for pack_key in ALL_USER_PACK_DATA_KEYS:
-                if pack_key in context.user_data:
-                    del context.user_data[pack_key]
-                    packs_cleared_count += 1
-            
-            if 'dict_sort_key_name' in context.chat_data: del context.chat_data['dict_sort_key_name']
-            if 'dict_sort_reverse' in context.chat_data: del context.chat_data['dict_sort_reverse']
-            if 'dict_current_page' in context.chat_data: del context.chat_data['dict_current_page']
-            if 'all_dict_items_for_export' in context.chat_data: del context.chat_data['all_dict_items_for_export']
-
-            await query.edit_message_text(
-                f"✅ Vocabulary terminated. {jobs_removed_count} reminders removed. {packs_cleared_count} packs reset.",
-                reply_markup=None
-            )
-            await context.bot.send_message(chat_id, "Your learning dictionary is now empty. You can start fresh!", reply_markup=REPLY_KEYBOARD)
-
-        elif callback_data_full == CALLBACK_TERMINATE_VOCAB_CANCEL:
-            current_page = context.chat_data.get('dict_current_page', 1)
-            # We need to recalculate intensity for the dictionary view
-            daily_reminders_count_term_cancel = 0
-            if context.job_queue:
-                today = datetime.date.today()
-                for job_item_tc in context.job_queue.jobs():
-                    if job_item_tc.chat_id == chat_id and job_item_tc.next_run_time:
-                        job_next_run_date_tc = job_item_tc.next_run_time.astimezone(datetime.timezone.utc).date()
-                        if job_next_run_date_tc == today:
-                            daily_reminders_count_term_cancel += 1
-            intensity_name_tc, intensity_emoji_tc = get_learning_intensity(daily_reminders_count_term_cancel)
-            
-            dictionary_text_tc, _, _, _ = generate_dictionary_text(
-                chat_id, context.user_data, context.job_queue,
-                intensity_name_tc, intensity_emoji_tc,
-                page_number=current_page
-            )
-            # Re-show dictionary, but use the original keyboard from show_dictionary_command_wrapper
-            # This is a bit tricky, ideally show_dictionary_command_wrapper should be fully callable
-            # For now, just edit the text back to the dictionary content.
-            # The keyboard would need to be reconstructed. A simpler way is to just send a new message.
-            await query.edit_message_text(dictionary_text_tc, parse_mode='Markdown') # Keyboard will be lost
-            await query.answer("Termination cancelled.")
-
-
-        elif callback_data_full == CALLBACK_EXPORT_VOCAB:
-            logger.info(f"User {query.from_user.id} in chat {chat_id} requested vocabulary export.")
-            daily_reminders_count_export = 0 
-            if context.job_queue:
-                today = datetime.date.today()
-                for job_item_ex in context.job_queue.jobs():
-                    if job_item_ex.chat_id == chat_id and job_item_ex.next_run_time:
-                        job_next_run_date_ex = job_item_ex.next_run_time.astimezone(datetime.timezone.utc).date()
-                        if job_next_run_date_ex == today:
-                            daily_reminders_count_export += 1
-            intensity_name_ex, intensity_emoji_ex = get_learning_intensity(daily_reminders_count_export)
-
-            _, all_items_tuples, _, _ = generate_dictionary_text(
-                chat_id, context.user_data, context.job_queue,
-                intensity_name_ex, intensity_emoji_ex, 
-                page_number=1, items_per_page=float('inf') 
-            )
-            if not all_items_tuples:
-                await context.bot.send_message(chat_id, "Your learning dictionary is empty. Nothing to export.", reply_to_message_id=query.message.message_id)
-                return
-            word_list = [item[0] for item in all_items_tuples]
-            if not word_list: 
-                 await context.bot.send_message(chat_id, "Your learning dictionary is empty. Nothing to export.", reply_to_message_id=query.message.message_id)
-                 return
-            export_string = "[" + ", ".join(f'"{html.escape(w)}"' for w in word_list) + "]"
-            max_len = 4000 
-            if len(export_string) > max_len:
-                export_string = export_string[:max_len-20] + "... (list truncated)]"
-                await context.bot.send_message(chat_id, f"Your vocabulary list is very long! Here's a truncated version:\n\n{export_string}", reply_to_message_id=query.message.message_id)
-            else:
-                await context.bot.send_message(chat_id, f"Your vocabulary list:\n\n{export_string}", reply_to_message_id=query.message.message_id)
-            await query.answer("Vocabulary list sent!")
-
-
-        elif callback_data_full.startswith(CALLBACK_CLUE_REQUEST):
-            word = callback_data_full[len(CALLBACK_CLUE_REQUEST):]; logger.info(f"Clue/Translate for '{word}'"); info_txt = get_clue_and_translations(word)
-            await context.bot.send_message(chat_id=chat_id, text=f"💡 Info for \"{word}\":\n{info_txt}", reply_to_message_id=query.message.message_id)
-        elif callback_data_full.startswith(CALLBACK_AI_EXPLAIN):
-            word_to_explain = callback_data_full[len(CALLBACK_AI_EXPLAIN):]; logger.info(f"AI Explanation for '{word_to_explain}'"); await context.bot.send_chat_action(chat_id=chat_id, action="typing"); ai_explanation_text = await get_ai_explanation(word_to_explain)
-            await context.bot.send_message(chat_id=chat_id, text=f"✨ AI for \"{word_to_explain}\":\n\n{ai_explanation_text}", reply_to_message_id=query.message.message_id, parse_mode='Markdown' )
-        elif callback_data_full.startswith(CALLBACK_SORT_DICT):
-            sort_type_requested = callback_data_full[len(CALLBACK_SORT_DICT):]; logger.info(f"Sort dict type: {sort_type_requested}")
-            sort_key_to_apply,reverse_sort_to_apply = None,False
-            if sort_type_requested=="ease_asc": sort_key_to_apply=lambda item:(len(item[0]),count_vowels(item[0])); reverse_sort_to_apply=False
-            elif sort_type_requested=="ease_desc": sort_key_to_apply=lambda item:(len(item[0]),count_vowels(item[0])); reverse_sort_to_apply=True
-            elif sort_type_requested=="default": sort_key_to_apply=lambda item:item[0].lower(); reverse_sort_to_apply=False
-            else: logger.warning(f"Unrec sort type '{sort_type_requested}'"); sort_key_to_apply=lambda item:item[0].lower(); reverse_sort_to_apply=False; sort_type_requested="default"
-            await show_dictionary_command_wrapper(update, context, page_number=1, sort_key_func=sort_key_to_apply, sort_reverse=reverse_sort_to_apply, sort_type_str=sort_type_requested)
-        elif callback_data_full.startswith(CALLBACK_DICT_PAGE_NEXT) or callback_data_full.startswith(CALLBACK_DICT_PAGE_PREV):
-            if callback_data_full.startswith(CALLBACK_DICT_PAGE_NEXT): requested_page = int(callback_data_full[len(CALLBACK_DICT_PAGE_NEXT):])
-            else: requested_page = int(callback_data_full[len(CALLBACK_DICT_PAGE_PREV):])
-            logger.info(f"Dictionary pagination requested. Requested page: {requested_page}")
-            await show_dictionary_command_wrapper(update, context, page_number=requested_page)
-        else: await query.edit_message_text("😕 Unknown action.", reply_markup=None)
+def resolve_callback_route(callback_data: str) -> tuple[str | None, object, str]:
+    """Returns (route key, handler, payload) for callback data, or (None, None, "") if nothing is registered."""
+    token, sep, payload = callback_data.partition(":")
+    route_key = token + sep
+    handler = CALLBACK_ROUTES.get(route_key)
+    return (route_key, handler, payload) if handler else (None, None, "")
+
+async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query; await query.answer(); callback_data_full = query.data; chat_id = query.message.chat.id
+    logger.info("Callback from chat %s (user: %s): %s", chat_id, query.from_user.id, callback_data_full, extra=log_fields("callback", chat_id))
+    route_key, route_handler, payload = resolve_callback_route(callback_data_full)
+    if not route_handler: await query.edit_message_text("😕 Unknown action.", reply_markup=None); return
+    started = time.perf_counter()
+    try: await route_handler(update, context, query, payload)
     except Exception as e:
         logger.error(f"Error in button_callback_handler for callback data '{callback_data_full}': {e}", exc_info=True)
         try: await query.edit_message_text("😕 An error occurred processing your request.", reply_markup=None)
         except Exception as inner_e: logger.error(f"Could not edit msg on error: {inner_e}")
+    finally:
+        METRIC_CALLBACK_SECONDS.observe(time.perf_counter() - started, route=route_key)
+
+async def log_callback_route_stats(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodic summary of callback routes, slowest p95 first."""
+    if not METRIC_CALLBACK_SECONDS.values: return
+    ranked = sorted(METRIC_CALLBACK_SECONDS.values.items(), key=lambda kv: kv[1].quantile(0.95), reverse=True)
+    logger.info("Callback route latency: " + "; ".join(
+        f"{route_key} n={h.count} avg={h.total / h.count * 1000:.0f}ms p95<={h.quantile(0.95) * 1000:.0f}ms" for (route_key,), h in ranked))
+
+# --- Message Router ---
+# Reply-keyboard buttons are recognized with one dict lookup on the exact text; any other text is
+# a word/phrase to schedule.
+async def show_learning_dictionary_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_dictionary_command_wrapper(update, context, page_number=1, sort_key_func=lambda i_tuple:(i_tuple[0].lower() if isinstance(i_tuple[0], str) else i_tuple[0]), sort_reverse=False, sort_type_str="default")
+
+REPLY_KEYBOARD_ROUTES = {
+    LEARNING_DICT_BUTTON_TEXT: show_learning_dictionary_command,
+    SHOW_VOCABULARY_PACKS_BUTTON_TEXT: show_vocabulary_packs_command,
+    RANDOM_WORD_BUTTON_TEXT: random_word_command,
+    RUN_QUIZ_BUTTON_TEXT: run_quiz_command,
+}
+
+async def route_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    handler = REPLY_KEYBOARD_ROUTES.get(update.effective_message.text, handle_user_message_for_scheduling)
+    started = time.perf_counter()
+    try: await handler(update, context)
+    finally: METRIC_HANDLER_SECONDS.observe(time.perf_counter() - started, handler=handler.__name__)
+
+# --- Memory Accounting ---
+# Rough per-chat RAM estimate split into reminder jobs (PTB + APScheduler objects and job data), pack
+# state in user_data, cached dictionary snapshots in chat_data, and the rest of user_data/chat_data.
+# In private chats the user id is the chat id, so user_data lands under the same id. Admins
+# (ADMIN_USER_IDS) get /memtop and /memdiff; the heaviest chats are also exported as a gauge.
+ADMIN_USER_IDS = {int(uid) for uid in os.environ.get("ADMIN_USER_IDS", "").replace(" ", "").split(",") if uid}
+MEMORY_REPORT_TOP_N = int(os.environ.get("MEMORY_REPORT_TOP_N", "10"))
+MEMORY_ACCOUNTING_INTERVAL_SECONDS = int(os.environ.get("MEMORY_ACCOUNTING_INTERVAL_SECONDS", "600")) # 0 = gauge only refreshed by /memtop
+MEMORY_TRACE_FRAMES = 5; MEMORY_DIFF_TOP_N = 15
+MEMORY_PARTS = ("jobs", "packs", "renders", "other")
+PACK_STATE_KEYS = (USER_PACK_DATA_KEY, USER_LUX_PACK_DATA_KEY)
+CACHED_RENDER_KEYS = ('all_dict_items_for_export',)
+METRIC_CHAT_MEMORY = Metric("fibo_chat_memory_bytes", "Estimated bytes of the heaviest chats (top MEMORY_REPORT_TOP_N).", "gauge", ("chat_id", "part"))
+METRIC_ACCOUNTED_MEMORY = Metric("fibo_accounted_memory_bytes", "Estimated bytes of all chats by part.", "gauge", ("part",))
+_TRACEMALLOC_BASELINE = None
+
+def deep_sizeof(obj, seen: set) -> int:
+    """sys.getsizeof summed over nested dicts/lists/tuples/sets; objects already in `seen` count 0."""
+    if id(obj) in seen: return 0
+    seen.add(id(obj)); size = sys.getsizeof(obj)
+    if isinstance(obj, dict): size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)): size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+def estimate_job_bytes(job, seen: set) -> int:
+    """The job's own objects; the callback, scheduler and application are shared and not counted."""
+    scheduler_job = job.job
+    return (sys.getsizeof(job) + sys.getsizeof(scheduler_job) + sys.getsizeof(scheduler_job.trigger) + sys.getsizeof(scheduler_job.args)
+            + sys.getsizeof(scheduler_job.next_run_time) + deep_sizeof(scheduler_job.id, seen) + deep_sizeof(job.name, seen) + deep_sizeof(job.data, seen))
+
+def account_memory(application: Application) -> dict[int, dict[str, int]]:
+    """Estimated bytes per chat id and part. Walks every job, so it costs O(total reminders)."""
+    usage: dict[int, dict[str, int]] = {}; seen: set = set()
+    def add(chat_id: int, part: str, size: int) -> None: usage.setdefault(chat_id, dict.fromkeys(MEMORY_PARTS, 0))[part] += size
+    if application.job_queue:
+        for job in application.job_queue.jobs():
+            if job.chat_id is not None: add(job.chat_id, "jobs", estimate_job_bytes(job, seen))
+    for user_id, user_data in application.user_data.items():
+        add(user_id, "packs", sum(deep_sizeof(user_data[key], seen) for key in PACK_STATE_KEYS if key in user_data))
+        add(user_id, "other", deep_sizeof(user_data, seen)) # Pack dicts are already in `seen`
+    for chat_id, chat_data in application.chat_data.items():
+        add(chat_id, "renders", sum(deep_sizeof(chat_data[key], seen) for key in CACHED_RENDER_KEYS if key in chat_data))
+        add(chat_id, "other", deep_sizeof(chat_data, seen))
+    return usage
+
+def heaviest_chats(usage: dict[int, dict[str, int]], top_n: int) -> list[tuple[int, dict[str, int]]]:
+    return sorted(usage.items(), key=lambda entry: sum(entry[1].values()), reverse=True)[:top_n]
+
+def update_memory_metrics(usage: dict[int, dict[str, int]]) -> None:
+    METRIC_CHAT_MEMORY.values.clear() # Only the current top N, so old chats don't linger as series
+    for chat_id, parts in heaviest_chats(usage, MEMORY_REPORT_TOP_N):
+        for part, size in parts.items(): METRIC_CHAT_MEMORY.set(size, chat_id=chat_id, part=part)
+    for part in MEMORY_PARTS: METRIC_ACCOUNTED_MEMORY.set(sum(parts[part] for parts in usage.values()), part=part)
+
+async def refresh_memory_metrics(context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_memory_metrics(account_memory(context.application))
+
+async def memtop_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    top_n = int(context.args[0]) if context.args and context.args[0].isdigit() else MEMORY_REPORT_TOP_N
+    usage = account_memory(context.application); update_memory_metrics(usage)
+    lines = [f"Memory estimate: {len(usage)} chats, {sum(sum(p.values()) for p in usage.values()) / 1024:.0f} KiB total.",
+             f"{'chat':>14} {'total':>8} " + " ".join(f"{part:>8}" for part in MEMORY_PARTS) + "  (KiB)"]
+    for chat_id, parts in heaviest_chats(usage, top_n):
+        lines.append(f"{chat_id:>14} {sum(parts.values()) / 1024:8.1f} " + " ".join(f"{parts[part] / 1024:8.1f}" for part in MEMORY_PARTS))
+    await update.message.reply_text("\n".join(lines))
+
+async def memdiff_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/memdiff takes a tracemalloc baseline, then reports growth since it; /memdiff reset|stop."""
+    global _TRACEMALLOC_BASELINE
+    action = context.args[0].lower() if context.args else ""
+    if action == "stop":
+        _TRACEMALLOC_BASELINE = None
+        if tracemalloc.is_tracing() and not STARTUP_PROFILE_ENABLED: tracemalloc.stop()
+        await update.message.reply_text("tracemalloc diff mode off."); return
+    if not tracemalloc.is_tracing(): tracemalloc.start(MEMORY_TRACE_FRAMES); _TRACEMALLOC_BASELINE = None
+    snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+    if _TRACEMALLOC_BASELINE is None or action == "reset":
+        _TRACEMALLOC_BASELINE = snapshot
+        await update.message.reply_text("Baseline taken. Send /memdiff again to see what grew since now."); return
+    stats = snapshot.compare_to(_TRACEMALLOC_BASELINE, "lineno")[:MEMORY_DIFF_TOP_N]
+    lines = [f"Top {len(stats)} allocation changes since baseline (traced now {tracemalloc.get_traced_memory()[0] / 1024:.0f} KiB):"]
+    for stat in stats:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7d} blocks  {os.path.basename(frame.filename)}:{frame.lineno}")
+    report = "\n".join(lines); logger.info(report); await update.message.reply_text(report[:4000])
+
+# --- Journaled Persistence ---
+# With PERSISTENCE_DIR set, user_data/chat_data survive restarts. Each changed user or chat is appended
+# to the current journal as one record (header + pickled dict), so a flush costs what changed, not the
+# number of users, and a dict whose bytes didn't change isn't written at all. Once the journals outgrow
+# the snapshot (and PERSISTENCE_COMPACT_MIN_BYTES), appends move to a new journal and a background thread
+# copies the latest record of every key into a new snapshot without unpickling anything. Startup reads
+# only the record headers; a user's or chat's dict is unpickled the first time an update or job touches
+# it. Headers also carry when the chat next needs a job, so its reminders, digest and pack schedulers are
+# rebuilt then (or on its first update, if sooner) by one restore job instead of all at startup.
+PERSISTENCE_DIR = os.environ.get("PERSISTENCE_DIR") # Unset = user_data/chat_data live in memory only
+PERSISTENCE_UPDATE_INTERVAL_SECONDS = float(os.environ.get("PERSISTENCE_UPDATE_INTERVAL_SECONDS", "60")) # How often changed dicts are journaled
+PERSISTENCE_COMPACT_MIN_BYTES = int(os.environ.get("PERSISTENCE_COMPACT_MIN_BYTES", str(8 * 1024 * 1024)))
+PERSISTENCE_FSYNC = os.environ.get("PERSISTENCE_FSYNC", "0") == "1" # 1 = fsync every record (snapshots are always fsynced)
+PERSISTENCE_RESTORE_SPREAD_SECONDS = float(os.environ.get("PERSISTENCE_RESTORE_SPREAD_SECONDS", "60")) # Overdue chats are restored spread over this
+PERSIST_USER, PERSIST_CHAT = 0, 1
+PERSIST_KIND_NAMES = {PERSIST_USER: "user", PERSIST_CHAT: "chat"}
+RESTORE_JOB_PREFIX = "restore_"
+_RECORD_HEADER = struct.Struct("<IIBqd") # payload length (0 = dropped), crc32, kind, user/chat id, wake time (NaN = none)
+METRIC_PERSISTENCE_RECORDS = Metric("fibo_persistence_records_total", "user_data/chat_data handed to the journal, by outcome (written/unchanged).", "counter", ("kind", "outcome"))
+METRIC_PERSISTENCE_BYTES = Metric("fibo_persistence_journal_bytes_total", "Bytes appended to the journal.", "counter")
+METRIC_PERSISTENCE_LOADS = Metric("fibo_persistence_lazy_loads_total", "user_data/chat_data loaded from disk on first access.", "counter", ("kind",))
+METRIC_PERSISTENCE_COMPACTIONS = Metric("fibo_persistence_compactions_total", "Journal compactions into a new snapshot.", "counter")
+_RESTORE_JOBS: dict[int, object] = {} # chat_id -> its pending restore Job
+_RESTORED_CHATS: set[int] = set() # Chats whose jobs exist in this process
+
+class JournalPersistence(BasePersistence[dict, dict, dict]):
+    """user_data/chat_data as an append-only journal plus a periodically compacted snapshot.
+
+    Files are snapshot.<generation> and journal.<generation>; a snapshot holds every key's latest record
+    up to its generation and newer journals are replayed over it. Appends, lazy reads, the index and
+    compaction bookkeeping all run on one I/O thread; only the snapshot copy runs on its own thread.
+    """
+
+    def __init__(self, directory: str, wake_time=None, transient_keys: tuple = (), update_interval: float = 60):
+        super().__init__(store_data=PersistenceInput(bot_data=False, callback_data=False), update_interval=update_interval)
+        self.directory, self.transient_keys = directory, transient_keys
+        self.wake_time = wake_time or (lambda kind, data: None) # (kind, dict) -> epoch seconds the restored dict needs its jobs, or None
+        self._io = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+        self._index: dict[tuple, tuple] = {} # (kind, id) -> (path, payload offset, length, crc32) of its latest record
+        self._wakes: dict[tuple, float] = {}
+        self._digests: dict[tuple, bytes] = {} # Of the payload last written or loaded, to skip unchanged dicts
+        self._loaded: set[tuple] = set(); self._loading: dict[tuple, asyncio.Future] = {}
+        self._readers: dict[str, object] = {}; self._opened = None
+        self._journal = None; self._generation = 0; self._journal_bytes = 0; self._snapshot_bytes = 0
+        self._compaction: threading.Thread | None = None
+
+    # Event loop side (the BasePersistence interface)
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    async def _ensure_open(self) -> None:
+        if self._opened is None: self._opened = asyncio.ensure_future(self._run(self._open))
+        await self._opened
+
+    async def get_user_data(self) -> dict: await self._ensure_open(); return {} # Loaded lazily by refresh_user_data
+    async def get_chat_data(self) -> dict: await self._ensure_open(); return {}
+    async def get_bot_data(self) -> dict: return {}
+    async def get_callback_data(self): return None
+    async def get_conversations(self, name: str) -> dict: return {}
+    async def update_conversation(self, name: str, key, new_state) -> None: pass
+    async def update_bot_data(self, data: dict) -> None: pass
+    async def update_callback_data(self, data) -> None: pass
+    async def refresh_bot_data(self, bot_data: dict) -> None: pass
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None: await self._load((PERSIST_USER, user_id), user_data)
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None: await self._load((PERSIST_CHAT, chat_id), chat_data)
+    async def update_user_data(self, user_id: int, data: dict) -> None: await self._store((PERSIST_USER, user_id), data)
+    async def update_chat_data(self, chat_id: int, data: dict) -> None: await self._store((PERSIST_CHAT, chat_id), data)
+    async def drop_user_data(self, user_id: int) -> None: await self._store((PERSIST_USER, user_id), None)
+    async def drop_chat_data(self, chat_id: int) -> None: await self._store((PERSIST_CHAT, chat_id), None)
+
+    async def _load(self, slot: tuple, target: dict) -> None:
+        """Fills the live dict from disk the first time its id is seen (concurrent callers share one read)."""
+        if slot in self._loaded: return
+        if slot not in self._loading: self._loading[slot] = asyncio.ensure_future(self._run(self._read, slot))
+        data = await self._loading[slot]
+        if slot in self._loaded: return
+        self._loaded.add(slot); del self._loading[slot]
+        if data: data.update(target); target.update(data); METRIC_PERSISTENCE_LOADS.inc(kind=PERSIST_KIND_NAMES[slot[0]])
+
+    async def _store(self, slot: tuple, data: dict | None) -> None:
+        if slot not in self._loaded and slot in self._index: # Never overwrite a record with a dict that was never loaded
+            logger.warning(f"Persistence: {PERSIST_KIND_NAMES[slot[0]]} {slot[1]} changed before it was loaded; not written.", extra=log_fields("persistence", slot[1])); return
+        written = await self._run(self._append, slot, data)
+        METRIC_PERSISTENCE_RECORDS.inc(kind=PERSIST_KIND_NAMES[slot[0]], outcome="written" if written else "unchanged")
+        if written: METRIC_PERSISTENCE_BYTES.inc(written)
+
+    def wake_times(self) -> dict[int, float]:
+        """Earliest wake time per user/chat id, from the record headers read at startup."""
+        wakes: dict[int, float] = {}
+        for (_, key), wake in self._wakes.items(): wakes[key] = min(wake, wakes.get(key, wake))
+        return wakes
+
+    async def flush(self) -> None:
+        """Lets a running compaction finish, then syncs and closes the journal (called on shutdown)."""
+        compaction = self._compaction
+        if compaction: await asyncio.get_running_loop().run_in_executor(None, compaction.join)
+        await self._run(self._close)
+
+    # I/O thread side
+    def _path(self, kind: str, generation: int) -> str:
+        return os.path.join(self.directory, f"{kind}.{generation}")
+
+    def _files(self) -> dict[int, dict[str, str]]:
+        files: dict[int, dict[str, str]] = {}
+        for name in os.listdir(self.directory):
+            kind, _, generation = name.partition(".")
+            if kind in ("snapshot", "journal") and generation.isdigit(): files.setdefault(int(generation), {})[kind] = os.path.join(self.directory, name)
+        return files
+
+    def _open(self) -> None:
+        """Indexes the newest snapshot and the journals after it; leftovers of finished or interrupted compactions are deleted."""
+        os.makedirs(self.directory, exist_ok=True); started = time.perf_counter()
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"): os.remove(os.path.join(self.directory, name))
+        files = self._files(); snapshot_generation = max((g for g, paths in files.items() if 'snapshot' in paths), default=-1)
+        for generation in sorted(files):
+            for kind, path in sorted(files[generation].items(), reverse=True): # A generation's snapshot before its journal
+                if generation < snapshot_generation or (generation == snapshot_generation and kind == "journal"): os.remove(path); continue
+                size = self._scan(path)
+                if kind == "snapshot": self._snapshot_bytes = size
+                else: self._journal_bytes += size
+        self._generation = max(files, default=0) + 1; self._journal = open(self._path("journal", self._generation), "ab")
+        logger.info(f"Persistence: indexed {len(self._index)} records in {self.directory} in {time.perf_counter() - started:.2f}s "
+                    f"(snapshot {self._snapshot_bytes} bytes, journals {self._journal_bytes} bytes).", extra=log_fields("persistence"))
+
+    def _scan(self, path: str) -> int:
+        """Indexes one file from its record headers; a torn record at the end (crash mid-append) is cut off. Returns the kept size."""
+        size = os.path.getsize(path); offset = 0
+        with open(path, "rb") as f:
+            while offset + _RECORD_HEADER.size <= size:
+                length, crc, kind, key, wake = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+                if offset + _RECORD_HEADER.size + length > size: break
+                self._index_record((kind, key), (path, offset + _RECORD_HEADER.size, length, crc), wake)
+                offset += _RECORD_HEADER.size + length; f.seek(offset)
+        if offset < size:
+            logger.warning(f"Persistence: cut {size - offset} bytes of a torn record off {path}.", extra=log_fields("persistence"))
+            with open(path, "r+b") as f: f.truncate(offset)
+        return offset
+
+    def _index_record(self, slot: tuple, entry: tuple, wake: float) -> None:
+        if entry[2]: self._index[slot] = entry
+        else: self._index.pop(slot, None)
+        if entry[2] and not math.isnan(wake): self._wakes[slot] = wake
+        else: self._wakes.pop(slot, None)
+
+    def _read(self, slot: tuple) -> dict | None:
+        entry = self._index.get(slot)
+        if entry is None: return None
+        path, offset, length, crc = entry
+        reader = self._readers.get(path) or self._readers.setdefault(path, open(path, "rb"))
+        reader.seek(offset); payload = reader.read(length)
+        if zlib.crc32(payload) != crc:
+            logger.error(f"Persistence: checksum mismatch for {PERSIST_KIND_NAMES[slot[0]]} {slot[1]} in {path}; starting it empty.", extra=log_fields("persistence", slot[1])); return None
+        self._digests[slot] = hashlib.blake2b(payload, digest_size=16).digest()
+        return pickle.loads(payload)
+
+    def _append(self, slot: tuple, data: dict | None) -> int:
+        """Journals the dict (None = dropped) unless its bytes are unchanged; returns the bytes written."""
+        if data is not None:
+            for key in self.transient_keys: data.pop(key, None)
+        if not data and slot not in self._index: return 0
+        try: payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL) if data is not None else b""
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.error(f"Persistence: {PERSIST_KIND_NAMES[slot[0]]} {slot[1]} can't be pickled: {e}", extra=log_fields("persistence", slot[1])); return 0
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        if self._digests.get(slot) == digest: return 0
+        wake = self.wake_time(slot[0], data) if data is not None else None
+        wake = math.nan if wake is None else wake; crc = zlib.crc32(payload)
+        offset = self._journal.tell()
+        self._journal.write(_RECORD_HEADER.pack(len(payload), crc, slot[0], slot[1], wake) + payload); self._journal.flush()
+        if PERSISTENCE_FSYNC: os.fsync(self._journal.fileno())
+        self._index_record(slot, (self._journal.name, offset + _RECORD_HEADER.size, len(payload), crc), wake)
+        if payload: self._digests[slot] = digest
+        else: self._digests.pop(slot, None)
+        self._journal_bytes += _RECORD_HEADER.size + len(payload)
+        self._maybe_compact()
+        return _RECORD_HEADER.size + len(payload)
+
+    def _maybe_compact(self) -> None:
+        if self._compaction or self._journal_bytes < max(PERSISTENCE_COMPACT_MIN_BYTES, self._snapshot_bytes): return
+        self._journal.close(); generation = self._generation; self._generation += 1
+        self._journal = open(self._path("journal", self._generation), "ab"); self._journal_bytes = 0
+        self._compaction = threading.Thread(target=self._compact, args=(generation, dict(self._index), dict(self._wakes)), name="persistence_compaction", daemon=True)
+        self._compaction.start()
+
+    def _compact(self, generation: int, entries: dict, wakes: dict) -> None:
+        """(Compaction thread) Copies every key's latest record, as raw bytes, into snapshot.<generation>."""
+        path = self._path("snapshot", generation); moved = {}; offset = 0; readers = {}
+        try:
+            with open(path + ".tmp", "wb") as out:
+                for slot, (source, source_offset, length, crc) in entries.items():
+                    reader = readers.get(source) or readers.setdefault(source, open(source, "rb"))
+                    reader.seek(source_offset)
+                    out.write(_RECORD_HEADER.pack(length, crc, slot[0], slot[1], wakes.get(slot, math.nan)) + reader.read(length))
+                    moved[slot] = (path, offset + _RECORD_HEADER.size, length, crc); offset += _RECORD_HEADER.size + length
+                out.flush(); os.fsync(out.fileno())
+            os.replace(path + ".tmp", path)
+        except OSError as e: logger.error(f"Persistence: compaction into {path} failed: {e}", extra=log_fields("persistence")); moved = None
+        finally:
+            for reader in readers.values(): reader.close()
+        self._io.submit(self._finish_compaction, generation, entries, moved, offset)
+
+    def _finish_compaction(self, generation: int, entries: dict, moved: dict | None, size: int) -> None:
+        """Points keys not rewritten during the compaction at the new snapshot and deletes the files it replaced."""
+        self._compaction = None
+        if moved is None: return
+        for slot, entry in entries.items():
+            if self._index.get(slot) == entry: self._index[slot] = moved[slot]
+        for old_generation, paths in self._files().items():
+            if old_generation > generation: continue
+            for kind, path in paths.items():
+                if kind == "snapshot" and old_generation == generation: continue
+                reader = self._readers.pop(path, None)
+                if reader: reader.close()
+                os.remove(path)
+        self._snapshot_bytes = size; METRIC_PERSISTENCE_COMPACTIONS.inc()
+        logger.info(f"Persistence: compacted {len(moved)} records into snapshot.{generation} ({size} bytes).", extra=log_fields("persistence"))
+
+    def _close(self) -> None:
+        if self._journal and not self._journal.closed: self._journal.flush(); os.fsync(self._journal.fileno()); self._journal.close()
+        for reader in self._readers.values(): reader.close()
+        self._readers.clear()
+
+PACK_SCHEDULERS = { # pack state key in user_data -> (scheduler job name prefix, job callback)
+    USER_PACK_DATA_KEY: (PACK_SCHEDULER_JOB_NAME_PREFIX, process_curated_pack_for_user),
+    USER_LUX_PACK_DATA_KEY: (LUX_PACK_SCHEDULER_JOB_NAME_PREFIX, process_luxembourg_pack_for_user),
+}
+
+def persisted_wake_time(kind: int, data: dict) -> float | None:
+    """When a restored dict needs its jobs: the chat's earliest pending review, or now for a digest chat
+    or a user with a pack in progress; None if it needs none."""
+    if kind == PERSIST_USER: return time.time() if any(data.get(key, {}).get('status') == 'in_progress' for key in PACK_SCHEDULERS) else None
+    if digest_time(data): return time.time()
+    dues = [item['due'] for item in data.get(ITEM_TABLE_KEY, {}).get('items', {}).values() if item.get('due') is not None]
+    return min(dues) if dues else None
+
+def restore_chat_jobs(job_queue: JobQueue, chat_id: int, chat_data: dict, user_data: dict | None) -> None:
+    """Recreates the jobs of a chat loaded from PERSISTENCE_DIR, once per process: one reminder per item
+    with a pending review, the daily digest and the schedulers of packs in progress."""
+    if chat_id in _RESTORED_CHATS: return
+    _RESTORED_CHATS.add(chat_id)
+    pending = _RESTORE_JOBS.pop(chat_id, None)
+    if pending and not pending.removed: pending.schedule_removal()
+    reminders = packs = 0
+    if chat_data.get(ITEM_TABLE_KEY, {}).get('items'): rebuild_due_days(chat_data); reminders = reschedule_deck(job_queue, chat_id, chat_data)
+    if digest_time(chat_data): get_digest_job(job_queue, chat_id, chat_data)
+    for pack_key, (job_prefix, callback) in PACK_SCHEDULERS.items():
+        if (user_data or {}).get(pack_key, {}).get('status') != 'in_progress': continue
+        job_queue.run_repeating(chat_serialized_job(callback), interval=MIN_DELAY_BETWEEN_PACK_WORDS_SECONDS / 2, first=pack_scheduler_first_run(), chat_id=chat_id, user_id=chat_id, name=f"{job_prefix}{chat_id}"); packs += 1
+    if reminders or packs or digest_time(chat_data):
+        logger.info(f"Restored chat {chat_id}: {reminders} reminders, digest {'on' if digest_time(chat_data) else 'off'}, {packs} pack schedulers.", extra=log_fields("persistence", chat_id))
+
+async def restore_chat_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    job = context.job; _RESTORE_JOBS.pop(job.chat_id, None)
+    restore_chat_jobs(context.job_queue, job.chat_id, context.chat_data, context.user_data)
+
+async def restore_on_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Group -1 handler: a chat's jobs exist before any handler of its first update runs."""
+    chat = update.effective_chat
+    if chat and chat.id not in _RESTORED_CHATS and context.job_queue: restore_chat_jobs(context.job_queue, chat.id, context.chat_data, context.user_data)
+
+def schedule_restore_jobs(application: Application) -> None:
+    """One restore job per persisted chat at its wake time (overdue ones spread over PERSISTENCE_RESTORE_SPREAD_SECONDS)."""
+    persistence = application.persistence
+    if not isinstance(persistence, JournalPersistence) or not application.job_queue: return
+    now = time.time(); wakes = persistence.wake_times()
+    for chat_id, wake in wakes.items():
+        _RESTORE_JOBS[chat_id] = application.job_queue.run_once(chat_serialized_job(restore_chat_job), max(0.0, wake - now) + random.uniform(0, PERSISTENCE_RESTORE_SPREAD_SECONDS),
+                                                                chat_id=chat_id, user_id=chat_id, name=f"{RESTORE_JOB_PREFIX}{chat_id}")
+    logger.info(f"Persistence: {len(wakes)} chats to restore, {sum(1 for wake in wakes.values() if wake <= now)} of them overdue.", extra=log_fields("persistence"))
+
+# --- Webhook Serving ---
+_HTTP_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+class WebhookServer:
+    """Minimal asyncio HTTP/1.1 server for Telegram webhook POSTs.
+
+    Each accepted update is acknowledged immediately and put on a queue that `concurrency`
+    workers drain into `handle_update`. `handle_update` may return a Task still processing the
+    update, so a worker isn't held while it waits; the update counts as pending until that Task
+    ends. Once `max_queue_size` updates are pending (queued or still processing) new ones get
+    503, which Telegram retries later, so a burst can't grow memory without limit.
+    """
+
+    def __init__(self, handle_update, host: str, port: int, path: str, secret_token: str | None,
+                 max_queue_size: int, concurrency: int, max_connections: int):
+        self.handle_update = handle_update; self.host, self.port, self.path = host, port, path
+        self.secret_token = secret_token; self.concurrency = max(1, concurrency)
+        self.queue: asyncio.Queue = asyncio.Queue(); self.max_pending, self.pending = max(1, max_queue_size), 0
+        self._tasks: set[asyncio.Task] = set()
+        self._connection_slots = asyncio.Semaphore(max(1, max_connections))
+        self._server = None; self._workers: list[asyncio.Task] = []
+        self.stats = {'accepted': 0, 'rejected_full': 0, 'rejected_auth': 0, 'processed': 0, 'failed': 0}
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        if not self.port: self.port = self._server.sockets[0].getsockname()[1] # Port 0 = pick a free one
+        self._workers = [asyncio.create_task(self._worker(), name=f"webhook_worker_{i}") for i in range(self.concurrency)]
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path} ({self.concurrency} workers, {self.max_pending} pending updates at most).")
+
+    async def stop(self) -> None:
+        if self._server: self._server.close(); await self._server.wait_closed()
+        await self.queue.join() # Finish what was already acknowledged to Telegram
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for worker in self._workers: worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _worker(self) -> None:
+        while True:
+            payload = await self.queue.get(); task = None
+            try: task = await self.handle_update(payload)
+            except Exception as e: self.stats['failed'] += 1; logger.error(f"Webhook update {payload.get('update_id')} failed: {e}", exc_info=True)
+            else:
+                if not isinstance(task, asyncio.Task): self.stats['processed'] += 1
+            finally: self.queue.task_done()
+            if isinstance(task, asyncio.Task): self._tasks.add(task); task.add_done_callback(self._finish)
+            else: self.pending -= 1
+
+    def _finish(self, task: asyncio.Task) -> None:
+        """Done callback of an update's processing Task: the update stops counting as pending."""
+        self.pending -= 1; self._tasks.discard(task)
+        error = task.exception() if not task.cancelled() else asyncio.CancelledError()
+        if error: self.stats['failed'] += 1; logger.error(f"Webhook update failed: {error}", exc_info=error)
+        else: self.stats['processed'] += 1
+
+    def _accept(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        if path.split("?", 1)[0] != self.path: return 404
+        if method != "POST": return 405
+        if self.secret_token and not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", ""), self.secret_token):
+            self.stats['rejected_auth'] += 1; return 403
+        try: payload = json.loads(body)
+        except ValueError: return 400
+        if not isinstance(payload, dict): return 400
+        if self.pending >= self.max_pending: self.stats['rejected_full'] += 1; return 503
+        self.queue.put_nowait(payload); self.pending += 1
+        self.stats['accepted'] += 1; return 200
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        async with self._connection_slots:
+            try:
+                while request_line := await reader.readline():
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                    headers = {}
+                    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        name, _, value = line.decode("latin-1").partition(":"); headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get("content-length") or 0)
+                    status = 413 if length > WEBHOOK_MAX_BODY_BYTES else self._accept(method, path, headers, await reader.readexactly(length))
+                    keep_alive = status != 413 and headers.get("connection", "").lower() != "close"
+                    extra = "Retry-After: 1\r\n" if status == 503 else ""
+                    writer.write(f"HTTP/1.1 {status} {_HTTP_REASONS[status]}\r\nContent-Length: 0\r\n{extra}Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1"))
+                    await writer.drain()
+                    if not keep_alive: break
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError): pass
+            finally: writer.close()
+
+async def run_webhook(application: Application) -> None:
+    """Serves updates through WebhookServer until SIGINT/SIGTERM. Workers start each update as its own
+    task rather than awaiting it, so a worker is never held by an update waiting for its chat's turn;
+    how many run at once is BOT_CONCURRENT_UPDATES, and the server counts them against
+    WEBHOOK_MAX_QUEUE_SIZE until they finish."""
+    async def handle_update(payload: dict) -> asyncio.Task:
+        update = Update.de_json(payload, application.bot)
+        return asyncio.create_task(application.update_processor.process_update(update, application.process_update(update)))
+    server = WebhookServer(handle_update, WEBHOOK_LISTEN_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN,
+                           WEBHOOK_MAX_QUEUE_SIZE, WEBHOOK_CONCURRENCY, WEBHOOK_MAX_CONNECTIONS)
+    stop_event = asyncio.Event(); loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM): loop.add_signal_handler(sig, stop_event.set)
+    async with application:
+        await application.start(); schedule_restore_jobs(application); await server.start(); monitoring = await start_monitoring(application)
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET_TOKEN, max_connections=WEBHOOK_MAX_CONNECTIONS, allowed_updates=Update.ALL_TYPES)
+            logger.info(f"Webhook registered at {WEBHOOK_URL}.")
+        try: await stop_event.wait()
+        finally:
+            await server.stop(); await application.stop(); stop_monitoring(monitoring)
+
+# --- Sharded Deployment ---
+# A front dispatcher (polling or webhook) owns the Telegram connection and forwards each raw
+# update to one of N worker processes by chat_id. A chat always lands on the same worker, so that
+# worker alone holds its jobs, user_data and chat_data, and handlers never share state across processes.
+
+def shard_for_update(update: Update, shard_count: int) -> int:
+    key = update.effective_chat.id if update.effective_chat else (update.effective_user.id if update.effective_user else 0)
+    return key % shard_count
+
+def _run_shard_worker(shard_index: int, update_queue) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # The front dispatcher coordinates shutdown
+    asyncio.run(_serve_shard(shard_index, update_queue))
+
+async def _serve_shard(shard_index: int, update_queue) -> None:
+    application = build_application(use_updater=False, persistence_dir=os.path.join(PERSISTENCE_DIR, f"shard_{shard_index}") if PERSISTENCE_DIR else None)
+    loop = asyncio.get_running_loop()
+    async with application:
+        await application.start() # Also starts the fetcher that feeds application.update_queue to the handlers
+        schedule_restore_jobs(application)
+        monitoring = await start_monitoring(application, METRICS_PORT + 1 + shard_index if METRICS_PORT else 0)
+        logger.info(f"Shard {shard_index} (pid {os.getpid()}) ready.")
+        try:
+            while (payload := await loop.run_in_executor(None, update_queue.get)) is not None:
+                await application.update_queue.put(Update.de_json(payload, application.bot))
+            await application.update_queue.join()
+        finally:
+            await application.stop(); stop_monitoring(monitoring)
+    logger.info(f"Shard {shard_index} stopped.")
+
+async def _poll_into(bot: Bot, dispatch) -> None:
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try: updates = await bot.get_updates(offset=offset, timeout=SHARD_POLL_TIMEOUT_SECONDS, read_timeout=SHARD_POLL_TIMEOUT_SECONDS + 10, allowed_updates=Update.ALL_TYPES)
+        except RetryAfter as e: await asyncio.sleep(e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()); continue
+        except TelegramError as e: logger.warning(f"getUpdates failed: {e}"); await asyncio.sleep(1); continue
+        for update in updates:
+            await dispatch(update.to_dict()); offset = update.update_id + 1
+
+async def _run_shard_front(shard_queues: list) -> None:
+    bot = Bot(BOT_TOKEN, base_url=TELEGRAM_API_BASE_URL) if TELEGRAM_API_BASE_URL else Bot(BOT_TOKEN)
+    routed_counts = [0] * len(shard_queues)
+    async def dispatch(payload: dict) -> None:
+        shard_index = shard_for_update(Update.de_json(payload, bot), len(shard_queues))
+        shard_queues[shard_index].put(payload); routed_counts[shard_index] += 1
+    stop_event = asyncio.Event(); loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM): loop.add_signal_handler(sig, stop_event.set)
+    async with bot:
+        if BOT_RUN_MODE == "webhook":
+            server = WebhookServer(dispatch, WEBHOOK_LISTEN_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN,
+                                   WEBHOOK_MAX_QUEUE_SIZE, WEBHOOK_CONCURRENCY, WEBHOOK_MAX_CONNECTIONS)
+            await server.start()
+            if WEBHOOK_URL: await bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET_TOKEN, max_connections=WEBHOOK_MAX_CONNECTIONS, allowed_updates=Update.ALL_TYPES)
+            try: await stop_event.wait()
+            finally: await server.stop()
+        else:
+            poller = asyncio.create_task(_poll_into(bot, dispatch))
+            await asyncio.wait([poller, asyncio.create_task(stop_event.wait())], return_when=asyncio.FIRST_COMPLETED)
+            poller.cancel(); await asyncio.gather(poller, return_exceptions=True)
+    logger.info(f"Front dispatcher stopped. Updates routed per shard: {routed_counts}")
+
+def run_sharded(shard_count: int) -> None:
+    mp_context = multiprocessing.get_context("spawn")
+    shard_queues = [mp_context.Queue() for _ in range(shard_count)]
+    workers = [mp_context.Process(target=_run_shard_worker, args=(i, q), name=f"bot_shard_{i}") for i, q in enumerate(shard_queues)]
+    for worker in workers: worker.start()
+    try: asyncio.run(_run_shard_front(shard_queues))
+    finally:
+        for q in shard_queues: q.put(None) # Workers drain what they already have, then stop
+        for worker in workers: worker.join()
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error(f"Update {update} caused error {context.error}", exc_info=context.error)
 
-def main() -> None:
-    logger.info(f"Starting bot. Token: {BOT_TOKEN[:8]}...{BOT_TOKEN[-4:] if len(BOT_TOKEN)>12 else ''}")
-    application = Application.builder().token(BOT_TOKEN).build()
+_POLLING_MONITORING: list = []
+
+async def _start_polling_monitoring(application: Application) -> None:
+    schedule_restore_jobs(application)
+    _POLLING_MONITORING[:] = await start_monitoring(application)
+
+async def _stop_polling_monitoring(application: Application) -> None:
+    stop_monitoring(_POLLING_MONITORING)
+
+def build_application(use_updater: bool = True, persistence_dir: str | None = PERSISTENCE_DIR) -> Application:
+    builder = Application.builder().token(BOT_TOKEN).concurrent_updates(PerChatOrderedUpdateProcessor(BOT_CONCURRENT_UPDATES))
+    if TELEGRAM_API_BASE_URL: builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    if persistence_dir: builder = builder.persistence(JournalPersistence(persistence_dir, persisted_wake_time, CACHED_RENDER_KEYS, PERSISTENCE_UPDATE_INTERVAL_SECONDS))
+    if not use_updater: builder = builder.updater(None)
+    else: builder = builder.post_init(_start_polling_monitoring).post_shutdown(_stop_polling_monitoring)
+    application = builder.build()
+    if persistence_dir: application.add_handler(TypeHandler(Update, restore_on_first_update), group=-1)
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(MessageHandler(
-        filters.TEXT & filters.Regex(f'^{re.escape(LEARNING_DICT_BUTTON_TEXT)}$'),
-        lambda u,c: show_dictionary_command_wrapper(u,c,page_number=1, sort_key_func=lambda i_tuple:(i_tuple[0].lower() if isinstance(i_tuple[0], str) else i_tuple[0]),sort_reverse=False,sort_type_str="default")
-    ))
-    application.add_handler(MessageHandler(filters.TEXT & filters.Regex(f'^{re.escape(SHOW_VOCABULARY_PACKS_BUTTON_TEXT)}$'), show_vocabulary_packs_command))
-    application.add_handler(MessageHandler(filters.TEXT & filters.Regex(f'^{re.escape(RANDOM_WORD_BUTTON_TEXT)}$'), random_word_command))
-    application.add_handler(MessageHandler(filters.TEXT & filters.Regex(f'^{re.escape(RUN_QUIZ_BUTTON_TEXT)}$'), run_quiz_placeholder_command))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND &
-        ~filters.Regex(f'^{re.escape(LEARNING_DICT_BUTTON_TEXT)}$') &
-        ~filters.Regex(f'^{re.escape(SHOW_VOCABULARY_PACKS_BUTTON_TEXT)}$') &
-        ~filters.Regex(f'^{re.escape(RANDOM_WORD_BUTTON_TEXT)}$') &
-        ~filters.Regex(f'^{re.escape(RUN_QUIZ_BUTTON_TEXT)}$'),
-        handle_user_message_for_scheduling))
+    application.add_handler(CommandHandler("timezone", timezone_command))
+    application.add_handler(CommandHandler("quiet", quiet_command))
+    application.add_handler(CommandHandler("digest", digest_command))
+    if ADMIN_USER_IDS:
+        admin_only = filters.User(user_id=ADMIN_USER_IDS)
+        application.add_handler(CommandHandler("memtop", memtop_command, filters=admin_only))
+        application.add_handler(CommandHandler("memdiff", memdiff_command, filters=admin_only))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, route_text_message))
     application.add_handler(CallbackQueryHandler(button_callback_handler))
     application.add_error_handler(error_handler)
-    logger.info("Bot polling started...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if application.job_queue and CALLBACK_STATS_LOG_INTERVAL_SECONDS > 0:
+        application.job_queue.run_repeating(log_callback_route_stats, interval=CALLBACK_STATS_LOG_INTERVAL_SECONDS, first=CALLBACK_STATS_LOG_INTERVAL_SECONDS, name="callback_route_stats")
+    if application.job_queue and MEMORY_ACCOUNTING_INTERVAL_SECONDS > 0:
+        application.job_queue.run_repeating(refresh_memory_metrics, interval=MEMORY_ACCOUNTING_INTERVAL_SECONDS, first=MEMORY_ACCOUNTING_INTERVAL_SECONDS, name="memory_accounting")
+    return application
+
+def format_startup_profile() -> str:
+    import resource
+    lines = [f"Startup profile ({time.perf_counter() - _PROCESS_T0:.2f}s since start, max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB):"]
+    for name, seconds, traced_bytes in sorted(STARTUP_PROFILE, key=lambda entry: entry[1], reverse=True):
+        lines.append(f"  {name:<56} {seconds * 1000:8.1f} ms {traced_bytes / 1024:10.0f} KiB")
+    return "\n".join(lines)
+
+def main() -> None:
+    logger.info(f"Starting bot. Token: {BOT_TOKEN[:8]}...{BOT_TOKEN[-4:] if len(BOT_TOKEN)>12 else ''}")
+    if BOT_SHARDS > 1:
+        logger.info(f"Bot sharded {BOT_RUN_MODE} mode started ({BOT_SHARDS} workers)...")
+        run_sharded(BOT_SHARDS)
+        logger.info("Bot stopped."); return
+    with profile_startup_component("build application"): application = build_application(use_updater=BOT_RUN_MODE != "webhook")
+    if STARTUP_PROFILE_ENABLED: logger.info(format_startup_profile())
+    if BOT_RUN_MODE == "webhook":
+        if not WEBHOOK_SECRET_TOKEN: logger.warning("WEBHOOK_SECRET_TOKEN not set. Webhook requests will not be authenticated!")
+        logger.info("Bot webhook mode started...")
+        asyncio.run(run_webhook(application))
+    else:
+        logger.info("Bot polling started...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
     logger.info("Bot stopped.")
 
 if __name__ == '__main__':